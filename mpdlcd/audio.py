@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2011-2013 Raphaël Barrois
+
+"""Analysis of the audio played by MPD, read from a ``fifo`` output.
+
+MPD writes raw PCM samples to the named pipe of a ``fifo`` audio output::
+
+    audio_output {
+        type    "fifo"
+        name    "mpdlcd"
+        path    "/tmp/mpd.fifo"
+        format  "44100:16:2"
+    }
+
+An AudioSource reads them in a background thread, only keeping the latest
+samples in a ring buffer. Display updates analyze the most recent window, at
+the display's frame rate: when the display can't keep up, frames are dropped
+instead of queued.
+
+The analysis needs NumPy; it is an optional dependency.
+"""
+
+import logging
+import math
+import threading
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+from . import timing
+
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_FORMAT = '44100:16:2'
+DEFAULT_WINDOW = 2048
+
+# Signed, little-endian samples, by bits per sample.
+SAMPLE_TYPES = {
+    8: 'i1',
+    16: '<i2',
+    32: '<i4',
+}
+
+# Levels are displayed from this loudness (in dBFS) up to 0dBFS.
+FLOOR_DB = -60.0
+
+# Frequency range of spectrum bands, in Hz.
+MIN_FREQUENCY = 40.0
+MAX_FREQUENCY = 16000.0
+
+
+class AudioFormatError(ValueError):
+    pass
+
+
+def parse_format(audio_format):
+    """Parse a MPD audio format.
+
+    Args:
+        audio_format (str): a ``rate:bits:channels`` format, e.g ``44100:16:2``
+
+    Returns:
+        (int, int, int): the sample rate, bits per sample and channels.
+    """
+    try:
+        rate, bits, channels = [int(part) for part in audio_format.split(':')]
+    except ValueError:
+        raise AudioFormatError("Invalid audio format %r, expected rate:bits:channels" % audio_format)
+    if bits not in SAMPLE_TYPES:
+        raise AudioFormatError(
+            "Unsupported sample size %d (supported: %s)" % (bits, ', '.join(str(b) for b in sorted(SAMPLE_TYPES))))
+    if rate <= 0 or channels <= 0:
+        raise AudioFormatError("Invalid audio format %r" % audio_format)
+    return rate, bits, channels
+
+
+def _to_level(db):
+    return min(1.0, max(0.0, (db - FLOOR_DB) / -FLOOR_DB))
+
+
+def band_levels(samples, bands, rate):
+    """The loudness of logarithmically spaced frequency bands.
+
+    Args:
+        samples (numpy.ndarray): samples in [-1, 1], one column per channel
+        bands (int): the number of bands
+        rate (int): the sample rate, in Hz
+
+    Returns:
+        float list: the level of each band, from 0 (silent) to 1 (full scale)
+    """
+    size = len(samples)
+    mono = samples.mean(axis=1)
+    power = numpy.abs(numpy.fft.rfft(mono * numpy.hanning(size))) ** 2
+    frequencies = numpy.fft.rfftfreq(size, 1.0 / rate)
+
+    edges = numpy.geomspace(MIN_FREQUENCY, min(MAX_FREQUENCY, rate / 2.0), bands + 1)
+    indices = numpy.searchsorted(frequencies, edges)
+    cumulated = numpy.concatenate(([0.0], numpy.cumsum(power)))
+    energies = cumulated[indices[1:]] - cumulated[indices[:-1]]
+
+    # A full scale sine, through the Hann window (whose noise bandwidth is 1.5 bins)
+    reference = 1.5 * (size / 4.0) ** 2
+    db = 10 * numpy.log10(energies / reference + 1e-12)
+    return [_to_level(value) for value in db]
+
+
+def vu_levels(samples):
+    """The loudness of each channel.
+
+    Args:
+        samples (numpy.ndarray): samples in [-1, 1], one column per channel
+
+    Returns:
+        float list: the level of each channel, from 0 (silent) to 1 (full scale)
+    """
+    rms = numpy.sqrt(numpy.mean(samples ** 2, axis=0))
+    # Relative to a full scale sine
+    db = 20 * numpy.log10(rms * math.sqrt(2) + 1e-12)
+    return [_to_level(value) for value in db]
+
+
+class AudioFrame(object):
+    """The audio played at a given time, and its analysis.
+
+    Attributes:
+        sequence (int): identifies the frame; a new frame gets a new sequence
+        samples (numpy.ndarray): samples in [-1, 1], one column per channel;
+            None when nothing is being played
+        rate (int): the sample rate, in Hz
+    """
+
+    def __init__(self, sequence, samples, rate):
+        self.sequence = sequence
+        self.samples = samples
+        self.rate = rate
+        self._bands = {}
+        self._vu = None
+
+    def bands(self, count):
+        """Levels of ``count`` frequency bands; see band_levels()."""
+        if self.samples is None:
+            return [0.0] * count
+        if count not in self._bands:
+            self._bands[count] = band_levels(self.samples, count, self.rate)
+        return self._bands[count]
+
+    def vu(self):
+        """The level of the loudest channel; see vu_levels()."""
+        if self.samples is None:
+            return 0.0
+        if self._vu is None:
+            self._vu = max(vu_levels(self.samples))
+        return self._vu
+
+
+class AudioSource(object):
+    """Read PCM samples from a FIFO, in a background thread.
+
+    Only the last ``window`` samples are kept, in a ring buffer.
+
+    Attributes:
+        path (str): the FIFO to read from
+        rate (int): the sample rate, in Hz
+        channels (int): the number of channels
+        window (int): the number of samples analyzed for each frame
+        clock (mpdlcd.timing.Clock): tells when data is too old to be displayed
+    """
+
+    CHUNK_SIZE = 4096
+    REOPEN_DELAY = 1
+    # Without new data for that long, playback has stopped.
+    STALE_AFTER = 0.5
+
+    def __init__(self, path, audio_format=DEFAULT_FORMAT, window=DEFAULT_WINDOW, clock=None):
+        self.path = path
+        self.rate, bits, self.channels = parse_format(audio_format)
+        self.window = window
+        self.clock = clock or timing.MONOTONIC
+        self._dtype = numpy.dtype(SAMPLE_TYPES[bits])
+        self._scale = float(1 << (bits - 1))
+        self._frame_size = self._dtype.itemsize * self.channels
+
+        self._lock = threading.Lock()
+        self._ring = numpy.zeros((window, self.channels), dtype=self._dtype)
+        self._position = 0
+        self._filled = 0
+        self._partial = b''
+        self._received = 0
+        self._last_data = None
+        self._frame = AudioFrame(0, None, self.rate)
+        self._frame_received = 0
+
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='audio-%s' % self.path)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop reading; the thread only exits once the FIFO has a writer."""
+        self._stopped.set()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                # Blocks until MPD opens the FIFO.
+                with open(self.path, 'rb', buffering=0) as fifo:
+                    logger.info('Reading audio from %s', self.path)
+                    while not self._stopped.is_set():
+                        chunk = fifo.read(self.CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        self.feed(chunk)
+            except (IOError, OSError) as e:
+                logger.warning('Unable to read audio from %s: %s', self.path, e)
+            self._stopped.wait(self.REOPEN_DELAY)
+
+    def feed(self, data):
+        """Add raw PCM data to the ring buffer."""
+        data = self._partial + data
+        usable = len(data) - len(data) % self._frame_size
+        self._partial = data[usable:]
+        samples = numpy.frombuffer(data[:usable], dtype=self._dtype).reshape(-1, self.channels)
+        # Older samples would be overwritten at once.
+        samples = samples[-self.window:]
+        count = len(samples)
+
+        with self._lock:
+            end = self._position + count
+            if end <= self.window:
+                self._ring[self._position:end] = samples
+            else:
+                first = self.window - self._position
+                self._ring[self._position:] = samples[:first]
+                self._ring[:count - first] = samples[first:]
+            self._position = end % self.window
+            self._filled = min(self.window, self._filled + count)
+            self._received += count
+            if count:
+                self._last_data = self.clock.now()
+
+    def samples(self):
+        """The latest samples, oldest first, in [-1, 1]."""
+        with self._lock:
+            ordered = numpy.roll(self._ring, -self._position, axis=0)[self.window - self._filled:]
+        return ordered / self._scale
+
+    def frame(self):
+        """The current frame; a new one if samples arrived since the last call."""
+        with self._lock:
+            received, last_data = self._received, self._last_data
+        stale = last_data is None or self.clock.now() - last_data > self.STALE_AFTER
+        if stale:
+            if self._frame.samples is not None:
+                self._frame = AudioFrame(self._frame.sequence + 1, None, self.rate)
+        elif received != self._frame_received or self._frame.samples is None:
+            self._frame = AudioFrame(self._frame.sequence + 1, self.samples(), self.rate)
+        self._frame_received = received
+        return self._frame
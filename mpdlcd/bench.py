@@ -0,0 +1,521 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2011-2013 Raphaël Barrois
+
+"""End-to-end benchmarks, against in-process fake MPD and LCDd servers.
+
+Each scenario drives a real MpdRunner for a number of ticks (display updates),
+applying events to the simulated player between ticks; the time of the player
+advances by the refresh rate on each tick, without actually sleeping.
+
+Reported figures:
+- ticks_per_second: display updates per second of wall time
+- cpu_per_display_hour: CPU seconds spent by the updating thread for an hour
+  of display at the configured refresh rate
+- latency_p50 / latency_p99: seconds between an event and the last LCDd
+  command it caused (excluding the wait until the next tick)
+- commands_per_event: LCDd commands sent per event
+- errors: failed display updates
+"""
+
+import collections
+import json
+import logging
+import optparse
+import platform
+import sys
+import time
+
+from . import cli
+from . import lcdrunner
+from . import mpdhooks
+from . import mpdwrapper
+from . import timing
+from . import trace
+from . import utils
+from .testing import fake_lcdd
+from .testing import fake_mpd
+
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_TICKS = 300
+DEFAULT_LINES = '1,2,4'
+DEFAULT_TOLERANCE = 0.2
+DEFAULT_SONGS = 50
+
+FORMAT_VERSION = 1
+
+# Figures compared against a baseline, and whether higher values are better.
+COMPARED_FIGURES = collections.OrderedDict([
+    ('ticks_per_second', True),
+    ('cpu_per_display_hour', False),
+    ('latency_p50', False),
+    ('latency_p99', False),
+    ('commands_per_event', False),
+])
+
+# Only measure the CPU used by the updating thread, not the fake servers.
+_thread_time = getattr(time, 'thread_time', time.process_time)
+
+
+def percentile(values, fraction):
+    """Compute a percentile with the nearest-rank method."""
+    if not values:
+        return None
+    values = sorted(values)
+    rank = max(0, int(round(fraction * len(values))) - 1)
+    return values[min(rank, len(values) - 1)]
+
+
+class BenchEnvironment(object):
+    """Fake MPD and LCDd servers, connected to a MpdRunner.
+
+    Attributes:
+        clock (mpdlcd.timing.VirtualClock): the simulated time
+        player (mpdlcd.testing.fake_mpd.Player): the simulated player
+        mpd_server (mpdlcd.testing.fake_mpd.FakeMPDServer): the fake MPD server
+        lcdd (mpdlcd.testing.fake_lcdd.FakeLCDdServer): the fake LCDd server
+        runner (mpdlcd.lcdrunner.MpdRunner): the runner under test
+
+    The fake servers only keep the last ``history`` commands, if set; player
+    states may get their own patterns through ``state_patterns``.
+    """
+
+    def __init__(
+            self, lines, width=20, songs=DEFAULT_SONGS, refresh=cli.DEFAULT_REFRESH, latency=0, history=None,
+            state_patterns=None):
+        self.clock = timing.VirtualClock()
+        self.refresh = refresh
+        self.player = fake_mpd.Player([fake_mpd.make_song(i) for i in range(songs)], clock=self.clock)
+        self.player.set_option('repeat', 1)
+        self.mpd_server = fake_mpd.FakeMPDServer(self.player, latency=latency, history=history).start()
+        self.lcdd = fake_lcdd.FakeLCDdServer(width=width, height=lines, latency=latency, history=history).start()
+        self.retry_config = utils.AutoRetryConfig(
+            retry_attempts=cli.DEFAULT_RETRY_ATTEMPTS,
+            retry_wait=cli.DEFAULT_RETRY_WAIT,
+            retry_backoff=cli.DEFAULT_RETRY_BACKOFF,
+        )
+
+        lcd_host, lcd_port = self.lcdd.address
+        lcd = lcdrunner.LcdProcServer(lcd_host, lcd_port)
+        self.runner = lcdrunner.MpdRunner(
+            self.make_client(), lcd,
+            lcdproc_screen=cli.DEFAULT_LCD_SCREEN_NAME,
+            refresh_rate=refresh,
+            backlight_on=cli.DEFAULT_BACKLIGHT_ON,
+            priority_playing=cli.DEFAULT_PRIORITY,
+            priority_not_playing=cli.DEFAULT_PRIORITY,
+            retry_config=self.retry_config,
+            clock=self.clock,
+        )
+        self.runner.setup_pattern(
+            cli._make_patterns(cli.DEFAULT_PATTERNS, clock=self.clock),
+            hook_registry=mpdhooks.HookRegistry(clock=self.clock),
+            state_patterns=cli._make_state_patterns(state_patterns or {}, clock=self.clock),
+        )
+
+    def make_client(self):
+        host, port = self.mpd_server.address
+        client = mpdwrapper.MPDClient(host=host, port=port, retry_config=self.retry_config, clock=self.clock)
+        client.connect()
+        return client
+
+    def reconnect(self):
+        """Replace the MPD connection of the runner."""
+        self.runner.client = self.make_client()
+
+    def close(self):
+        self.runner.lcd.tn.close()
+        self.lcdd.stop()
+        self.mpd_server.stop()
+
+
+class Scenario(object):
+    """A benchmark scenario.
+
+    Subclasses define prepare() and event(), which update the player.
+    """
+    name = ''
+    description = ''
+
+    def prepare(self, env):
+        env.player.play()
+
+    def event(self, env, tick):
+        """Apply the events for a tick; return whether an event happened."""
+        raise NotImplementedError()
+
+
+class SteadyScenario(Scenario):
+    name = 'steady'
+    description = "Steady playback; each tick is an event, as time moves on."
+
+    def event(self, env, tick):
+        return True
+
+
+class SkippingScenario(Scenario):
+    name = 'skipping'
+    description = "Skip to the next song on each tick."
+
+    def event(self, env, tick):
+        env.player.next()
+        return True
+
+
+class StreamScenario(Scenario):
+    name = 'stream'
+    description = "Play a radio stream whose title changes on each tick."
+
+    def prepare(self, env):
+        env.player.clear()
+        env.player.add(fake_mpd.make_song(0, duration=0, Name="Radio", Title="Jingle"))
+        env.player.play()
+
+    def event(self, env, tick):
+        env.player.set_tags(Title="Track number %d" % tick, Artist="Artist %d" % (tick % 5))
+        return True
+
+
+class ReconnectScenario(Scenario):
+    name = 'reconnect'
+    description = "Drop MPD connections every 10 ticks."
+
+    period = 10
+
+    def event(self, env, tick):
+        if tick % self.period:
+            return False
+        env.mpd_server.disconnect_clients()
+        return True
+
+
+SCENARIOS = collections.OrderedDict(
+    (scenario.name, scenario) for scenario in [
+        SteadyScenario,
+        SkippingScenario,
+        StreamScenario,
+        ReconnectScenario,
+    ]
+)
+
+
+class Result(object):
+    """Measurements for a scenario run.
+
+    Attributes:
+        recorded_commands (int): when replaying a trace, the number of LCDd
+            commands in the recording
+    """
+
+    def __init__(self, scenario, lines, refresh):
+        self.scenario = scenario
+        self.lines = lines
+        self.refresh = refresh
+        self.ticks = 0
+        self.events = 0
+        self.errors = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.commands = 0
+        self.recorded_commands = 0
+        self.latencies = []
+
+    @property
+    def key(self):
+        return '%s/%d' % (self.scenario, self.lines)
+
+    def summary(self):
+        ticks_per_hour = 3600.0 / self.refresh
+        return collections.OrderedDict([
+            ('ticks', self.ticks),
+            ('events', self.events),
+            ('errors', self.errors),
+            ('ticks_per_second', self.ticks / self.wall if self.wall else None),
+            ('cpu_per_display_hour', self.cpu / self.ticks * ticks_per_hour if self.ticks else None),
+            ('latency_p50', percentile(self.latencies, 0.5)),
+            ('latency_p99', percentile(self.latencies, 0.99)),
+            ('commands_per_event', float(self.commands) / self.events if self.events else None),
+        ])
+
+
+def run_scenario(scenario, lines, ticks=DEFAULT_TICKS, refresh=cli.DEFAULT_REFRESH, latency=0):
+    """Run a scenario, and collect its measurements.
+
+    Args:
+        scenario (Scenario): the scenario to run
+        lines (int): the height of the display, selecting the pattern
+        ticks (int): the number of display updates
+        refresh (float): the simulated refresh rate
+        latency (float): the simulated latency of the servers
+
+    Returns:
+        Result
+    """
+    env = BenchEnvironment(lines=lines, refresh=refresh, latency=latency)
+    result = Result(scenario.name, lines, refresh)
+    try:
+        scenario.prepare(env)
+        env.runner.update()
+
+        for tick in range(1, ticks + 1):
+            env.clock.advance(refresh)
+            mark = env.lcdd.mark()
+            event_start = time.monotonic()
+            has_event = scenario.event(env, tick)
+
+            wall_start, cpu_start = time.perf_counter(), _thread_time()
+            try:
+                env.runner.update()
+            except Exception as e:
+                # The runner could not recover by itself; let's do it.
+                logger.debug("Update failed: %r", e)
+                result.errors += 1
+                env.reconnect()
+                env.runner.update()
+            result.wall += time.perf_counter() - wall_start
+            result.cpu += _thread_time() - cpu_start
+            result.ticks += 1
+
+            if has_event:
+                commands = env.lcdd.commands_since(mark)
+                result.events += 1
+                result.commands += len(commands)
+                if commands:
+                    result.latencies.append(commands[-1].time - event_start)
+    finally:
+        env.close()
+    return result
+
+
+def run_replay(path, speed=0):
+    """Replay a trace recorded with --record-trace through a MpdRunner.
+
+    MPD replies come from the trace; LCDd commands go to a fake server, and
+    are compared to the recorded ones.
+
+    Args:
+        path (str): the trace file
+        speed (float): replay speed relative to the recording (e.g 1 for
+            wall speed), or 0 to replay as fast as possible
+
+    Returns:
+        Result: its events are the recorded ticks
+    """
+    session = trace.TraceSession(path)
+    ticks = session.ticks()
+    setup = next(ticks)
+    width, height = session.screen_size or (20, 4)
+    refresh = session.meta.get('refresh', cli.DEFAULT_REFRESH)
+    retry_config = utils.AutoRetryConfig(retry_attempts=0, retry_wait=0.01, retry_backoff=2)
+    replay = trace.MPDReplay()
+    replay.start_tick(setup)
+
+    def make_client():
+        client = trace.ReplayMPDClient(replay, session.mpd_version, retry_config=retry_config)
+        client.connect()
+        return client
+
+    lcdd = fake_lcdd.FakeLCDdServer(width=width, height=height).start()
+    result = Result('replay', height, refresh)
+    try:
+        lcd_host, lcd_port = lcdd.address
+        lcd = lcdrunner.LcdProcServer(lcd_host, lcd_port)
+        runner = lcdrunner.MpdRunner(
+            make_client(), lcd,
+            lcdproc_screen=cli.DEFAULT_LCD_SCREEN_NAME,
+            refresh_rate=refresh,
+            backlight_on=cli.DEFAULT_BACKLIGHT_ON,
+            priority_playing=cli.DEFAULT_PRIORITY,
+            priority_not_playing=cli.DEFAULT_PRIORITY,
+            retry_config=retry_config,
+        )
+        runner.setup_pattern(
+            cli._make_patterns(session.meta.get('patterns') or cli.DEFAULT_PATTERNS),
+            hook_registry=mpdhooks.HookRegistry(hook_options=session.meta.get('hook_options')),
+            state_patterns=cli._make_state_patterns(session.meta.get('state_patterns') or {}),
+        )
+
+        origin = None
+        for tick in ticks:
+            if speed:
+                if origin is None:
+                    origin = (tick.time, time.monotonic())
+                delay = origin[1] + (tick.time - origin[0]) / speed - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+
+            replay.start_tick(tick)
+            mark = lcdd.mark()
+            event_start = time.monotonic()
+            wall_start, cpu_start = time.perf_counter(), _thread_time()
+            try:
+                runner.update()
+            except Exception as e:
+                logger.debug("Update failed: %r", e)
+                result.errors += 1
+                runner.client = make_client()
+            result.wall += time.perf_counter() - wall_start
+            result.cpu += _thread_time() - cpu_start
+            result.ticks += 1
+            result.events += 1
+            result.recorded_commands += tick.lcd_commands
+
+            commands = lcdd.commands_since(mark)
+            result.commands += len(commands)
+            if commands:
+                result.latencies.append(commands[-1].time - event_start)
+        lcd.tn.close()
+    finally:
+        lcdd.stop()
+
+    logger.info("Replayed %d ticks, %d MPD commands were not found in their tick", result.ticks, replay.misses)
+    return result
+
+
+def run(scenarios, lines, **kwargs):
+    """Run scenarios for the given display heights.
+
+    Returns:
+        dict: the summary of each run, by "scenario/lines" key
+    """
+    results = collections.OrderedDict()
+    for scenario in scenarios:
+        for height in lines:
+            result = run_scenario(scenario, height, **kwargs)
+            results[result.key] = result.summary()
+    return results
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Compare results to a baseline.
+
+    Args:
+        results (dict): the summaries of the current runs
+        baseline (dict): the summaries of the baseline runs
+        tolerance (float): the allowed relative change
+
+    Returns:
+        str list: a description of each regression
+    """
+    regressions = []
+    for key, summary in results.items():
+        reference = baseline.get(key)
+        if reference is None:
+            continue
+        for figure, higher_is_better in COMPARED_FIGURES.items():
+            value, expected = summary.get(figure), reference.get(figure)
+            if value is None or not expected:
+                continue
+            change = (value - expected) / expected
+            if higher_is_better:
+                change = -change
+            if change > tolerance:
+                regressions.append("%s: %s went from %.6g to %.6g (%+.0f%%)" % (
+                    key, figure, expected, value, 100 * (value - expected) / expected))
+    return regressions
+
+
+def format_results(results):
+    """Render results as a text table."""
+    header = '%-14s %10s %12s %11s %11s %10s %7s' % (
+        'scenario', 'ticks/s', 'cpu s/hour', 'p50 ms', 'p99 ms', 'cmd/event', 'errors')
+    lines = [header, '-' * len(header)]
+
+    def fmt(value, scale=1, precision=1):
+        if value is None:
+            return '-'
+        return '%.*f' % (precision, value * scale)
+
+    for key, summary in results.items():
+        lines.append('%-14s %10s %12s %11s %11s %10s %7d' % (
+            key,
+            fmt(summary['ticks_per_second'], precision=0),
+            fmt(summary['cpu_per_display_hour'], precision=2),
+            fmt(summary['latency_p50'], scale=1000, precision=2),
+            fmt(summary['latency_p99'], scale=1000, precision=2),
+            fmt(summary['commands_per_event'], precision=2),
+            summary['errors'],
+        ))
+    return '\n'.join(lines)
+
+
+def _make_parser():
+    parser = optparse.OptionParser(
+        usage="%prog [options] [SCENARIO ...]",
+        description="Benchmark mpdlcd against fake MPD and LCDd servers. Scenarios: %s" % ', '.join(SCENARIOS),
+    )
+    parser.add_option(
+        '--ticks', type='int', default=DEFAULT_TICKS,
+        help="Number of display updates per scenario (default: %d)" % DEFAULT_TICKS)
+    parser.add_option(
+        '--lines', default=DEFAULT_LINES,
+        help="Comma-separated display heights to test (default: %s)" % DEFAULT_LINES)
+    parser.add_option(
+        '--refresh', type='float', default=cli.DEFAULT_REFRESH,
+        help="Simulated refresh rate, in seconds (default: %.1f)" % cli.DEFAULT_REFRESH)
+    parser.add_option(
+        '--latency', type='float', default=0,
+        help="Simulated latency of the MPD and LCDd servers, in seconds (default: 0)")
+    parser.add_option(
+        '--replay', metavar='TRACE',
+        help="Replay a trace recorded with mpdlcd --record-trace, instead of running scenarios")
+    parser.add_option(
+        '--speed', type='float', default=0,
+        help="Replay speed, relative to the recording (default: 0, as fast as possible)")
+    parser.add_option(
+        '-o', '--output', metavar='FILE',
+        help="Save results to FILE, as JSON")
+    parser.add_option(
+        '-b', '--baseline', metavar='FILE',
+        help="Compare results to those saved in FILE")
+    parser.add_option(
+        '--tolerance', type='float', default=DEFAULT_TOLERANCE,
+        help="Allowed relative regression against the baseline (default: %.2f)" % DEFAULT_TOLERANCE)
+    return parser
+
+
+def main(argv):
+    parser = _make_parser()
+    options, args = parser.parse_args(argv[1:])
+
+    unknown = [name for name in args if name not in SCENARIOS]
+    if unknown:
+        parser.error("Unknown scenarios: %s" % ', '.join(unknown))
+    scenarios = [SCENARIOS[name]() for name in (args or SCENARIOS)]
+    try:
+        lines = [int(height) for height in options.lines.split(',')]
+    except ValueError:
+        parser.error("Invalid --lines: %s" % options.lines)
+
+    logging.basicConfig(level=logging.ERROR)
+    if options.replay:
+        result = run_replay(options.replay, speed=options.speed)
+        results = collections.OrderedDict([(result.key, result.summary())])
+        print(format_results(results))
+        print("\nLCDd commands: %d recorded, %d replayed" % (result.recorded_commands, result.commands))
+    else:
+        results = run(scenarios, lines, ticks=options.ticks, refresh=options.refresh, latency=options.latency)
+        print(format_results(results))
+
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump({
+                'version': FORMAT_VERSION,
+                'python': platform.python_version(),
+                'ticks': options.ticks,
+                'refresh': options.refresh,
+                'results': results,
+            }, f, indent=2)
+
+    if options.baseline:
+        with open(options.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline['results'], tolerance=options.tolerance)
+        if regressions:
+            print("\nRegressions against %s:" % options.baseline)
+            for regression in regressions:
+                print("  %s" % regression)
+            sys.exit(1)
+        print("\nNo regression against %s." % options.baseline)
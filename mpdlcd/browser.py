@@ -0,0 +1,365 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2011-2013 Raphaël Barrois
+
+"""Browse the MPD library from the LCD keypad.
+
+The browser is reached through entries of the LCDd menu ("Artists",
+"Albums"); once one is selected, its own screen is displayed, and the Up,
+Down, Enter and Escape keys move through the list, enter an artist or album,
+or go back.
+
+Libraries may hold hundreds of thousands of songs: lists are fetched from MPD
+in pages (``list artist window START:END``), and only the most recently used
+pages are kept. Pages are loaded in a background thread, on their own MPD
+connection; the next page is requested before the cursor reaches it.
+
+Servers older than MPD 0.24 don't support windows: each list is then fetched
+once, and pages are taken from it.
+"""
+
+import collections
+from concurrent import futures
+import logging
+import threading
+
+from . import mpdwrapper
+from . import timing
+
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_PAGE_SIZE = 50
+DEFAULT_CACHE_PAGES = 20
+
+# LCDd menu entries: (item id, tag, text)
+MENU_ENTRIES = [
+    ('mpdlcd_artists', 'artist', 'Artists'),
+    ('mpdlcd_albums', 'album', 'Albums'),
+]
+
+# Entering a value of a tag lists the values of the next one.
+NEXT_TAG = {
+    'artist': 'album',
+    'album': 'title',
+}
+
+KEY_UP = 'Up'
+KEY_DOWN = 'Down'
+KEY_ENTER = 'Enter'
+KEY_ESCAPE = 'Escape'
+KEYS = (KEY_UP, KEY_DOWN, KEY_ENTER, KEY_ESCAPE)
+
+
+class PageCache(object):
+    """Pages of lists, the least recently used ones dropped first.
+
+    Attributes:
+        size (int): the maximum number of pages kept
+    """
+
+    def __init__(self, size=DEFAULT_CACHE_PAGES):
+        self.size = size
+        self._pages = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._pages)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._pages
+
+    def get(self, key):
+        with self._lock:
+            page = self._pages.get(key)
+            if page is not None:
+                self._pages.move_to_end(key)
+            return page
+
+    def put(self, key, page):
+        with self._lock:
+            self._pages[key] = page
+            self._pages.move_to_end(key)
+            while len(self._pages) > self.size:
+                self._pages.popitem(last=False)
+
+
+class Listing(object):
+    """A list of tag values, e.g the albums of an artist.
+
+    Attributes:
+        tag (str): the listed tag
+        filters (str tuple): alternating tags and values, restricting the songs
+        title (str): the title of the list
+        cursor (int): the position of the selected value
+        length (int): the number of values, once the last page was fetched
+    """
+
+    def __init__(self, tag, filters=(), title=''):
+        self.tag = tag
+        self.filters = tuple(filters)
+        self.title = title or tag.capitalize() + 's'
+        self.cursor = 0
+        self.length = None
+
+    @property
+    def key(self):
+        return (self.tag, self.filters)
+
+
+class PageLoader(object):
+    """Fetch pages of listings in a background thread.
+
+    The thread uses its own MPD connection, created by ``client_factory``.
+    Without windowed ``list`` commands, the last few whole lists are kept,
+    one per level of browsing.
+
+    Attributes:
+        cache (PageCache): where fetched pages go
+        page_size (int): the number of values in a page
+    """
+
+    FULL_LISTS = 3
+
+    def __init__(self, client_factory, cache, page_size=DEFAULT_PAGE_SIZE):
+        self.client_factory = client_factory
+        self.cache = cache
+        self.page_size = page_size
+        self._client = None
+        self._executor = futures.ThreadPoolExecutor(max_workers=1)
+        self._pending = {}
+        self._closed = False
+        # Only used from the loader thread.
+        self._full_lists = collections.OrderedDict()
+
+    def page(self, listing, index):
+        """A page, or None if it wasn't fetched yet."""
+        return self.cache.get((listing.key, index))
+
+    def request(self, listing, index):
+        """Fetch a page in the background, unless already available."""
+        key = (listing.key, index)
+        if index < 0 or key in self.cache or key in self._pending:
+            return
+        self._pending[key] = self._executor.submit(self._load, listing.tag, listing.filters, index)
+        self._pending[key].add_done_callback(lambda _future: self._pending.pop(key, None))
+
+    def _load(self, tag, filters, index):
+        start = index * self.page_size
+        try:
+            if self._client is None:
+                self._client = self.client_factory()
+            values = self._client.list_tags(tag, filters, (start, start + self.page_size))
+            if values is None:
+                values = self._full_list(tag, filters)[start:start + self.page_size]
+        except mpdwrapper.MPDError as e:
+            logger.warning('Unable to list %s values from MPD: %s', tag, e)
+            return
+        logger.debug('Fetched %d %s values from %d', len(values), tag, start)
+        self.cache.put(((tag, tuple(filters)), index), values)
+
+    def _full_list(self, tag, filters):
+        key = (tag, tuple(filters))
+        if key in self._full_lists:
+            self._full_lists.move_to_end(key)
+        else:
+            self._full_lists[key] = self._client.list_tags(tag, filters)
+            while len(self._full_lists) > self.FULL_LISTS:
+                self._full_lists.popitem(last=False)
+        return self._full_lists[key]
+
+    def wait(self, timeout=None):
+        """Wait for the pending pages."""
+        futures.wait(list(self._pending.values()), timeout)
+
+    def close(self):
+        """Stop loading pages, and disconnect from MPD once the pending ones are loaded."""
+        if self._closed:
+            return
+        self._closed = True
+        self._executor.submit(self._disconnect)
+        self._executor.shutdown(wait=False)
+
+    def _disconnect(self):
+        if self._client is not None:
+            self._client.disconnect()
+
+
+class LibraryBrowser(object):
+    """Browse the MPD library on a dedicated LCDd screen.
+
+    Attributes:
+        lcd (mpdlcd.lcdrunner.LcdProcServer): the LCDd connection
+        ref (str): the ref of the browser screen
+        loader (PageLoader): fetches pages of listings
+        prefetch (int): request the next page when the cursor is that close
+            to the edge of the current one
+        timeout (float): close the browser after that many seconds without
+            a key press
+        listings (Listing list): the browsed listings, the current one last;
+            empty when the browser is closed
+    """
+
+    POLL_INTERVAL = 0.1
+    DEFAULT_TIMEOUT = 30
+    CURSOR = '>'
+    LOADING = '...'
+
+    def __init__(
+            self, lcd, client_factory, ref, page_size=DEFAULT_PAGE_SIZE, cache_pages=DEFAULT_CACHE_PAGES,
+            prefetch=None, timeout=DEFAULT_TIMEOUT, clock=None):
+        self.lcd = lcd
+        self.ref = ref
+        self.loader = PageLoader(client_factory, PageCache(cache_pages), page_size)
+        self.prefetch = page_size // 4 if prefetch is None else prefetch
+        self.timeout = timeout
+        self.clock = clock or timing.MONOTONIC
+        self.listings = []
+        self.screen = None
+        self._lines = []
+        self._last_key = None
+
+    @property
+    def active(self):
+        return bool(self.listings)
+
+    @property
+    def page_size(self):
+        return self.loader.page_size
+
+    def setup(self):
+        """Add the menu entries, keys and (hidden) screen."""
+        self.screen = self.lcd.add_screen(self.ref)
+        self.screen.set_heartbeat('off')
+        self.screen.set_priority('hidden')
+        width = self.lcd.server_info['screen_width']
+        height = self.lcd.server_info['screen_height']
+        self._lines = [
+            self.screen.add_string_widget('line%d' % line, ' ' * width, x=1, y=line)
+            for line in range(1, height + 1)
+        ]
+        self.reset()
+
+    def reset(self):
+        """Add the menu entries and keys, e.g after reconnecting to LCDd."""
+        for item, _tag, text in MENU_ENTRIES:
+            self.lcd.request('menu_add_item "" %s action "%s" -menu_result quit' % (item, text))
+        for key in KEYS:
+            if key in self.lcd.keys:
+                self.lcd.keys.remove(key)
+            # Shared keys are sent to us while our screen is displayed.
+            self.lcd.add_key(key)
+        if self.active:
+            self.close()
+
+    # Events
+    # ------
+
+    def handle_event(self, event):
+        """Handle a LCDd notification; returns whether it was for the browser."""
+        words = event.split()
+        if words[:2] == ['menuevent', 'select'] and len(words) == 3:
+            for item, tag, _text in MENU_ENTRIES:
+                if words[2] == item:
+                    self.open(Listing(tag))
+                    return True
+        elif words[:1] == ['key'] and len(words) == 2 and self.active:
+            self.key_pressed(words[1])
+            return True
+        return False
+
+    def open(self, listing):
+        logger.info('Browsing %s', listing.title)
+        if not self.active:
+            self.screen.set_priority('input')
+        self.listings.append(listing)
+        self._last_key = self.clock.now()
+        self._moved(listing)
+
+    def close(self):
+        logger.info('Closing the library browser')
+        self.listings = []
+        self.screen.set_priority('hidden')
+
+    def key_pressed(self, key):
+        listing = self.listings[-1]
+        self._last_key = self.clock.now()
+        if key == KEY_UP:
+            listing.cursor = max(0, listing.cursor - 1)
+        elif key == KEY_DOWN:
+            if listing.length is None or listing.cursor + 1 < listing.length:
+                listing.cursor += 1
+        elif key == KEY_ENTER:
+            value = self.value(listing, listing.cursor)
+            if value is not None and listing.tag in NEXT_TAG:
+                self.open(Listing(
+                    NEXT_TAG[listing.tag], listing.filters + (listing.tag, value), title=value or '<Unknown>'))
+                return
+        elif key == KEY_ESCAPE:
+            self.listings.pop()
+            if not self.listings:
+                self.close()
+                return
+            listing = self.listings[-1]
+        self._moved(listing)
+
+    def _moved(self, listing):
+        """Request the page under the cursor, and the next one if close to it."""
+        index, offset = divmod(listing.cursor, self.page_size)
+        self.loader.request(listing, index)
+        if offset >= self.page_size - self.prefetch:
+            self.loader.request(listing, index + 1)
+        elif offset < self.prefetch:
+            self.loader.request(listing, index - 1)
+
+    # Display
+    # -------
+
+    def value(self, listing, position):
+        """A value of a listing, or None if it isn't available (yet)."""
+        index, offset = divmod(position, self.page_size)
+        page = self.loader.page(listing, index)
+        if page is None:
+            return None
+        if len(page) < self.page_size:
+            listing.length = index * self.page_size + len(page)
+        if offset >= len(page):
+            return None
+        return page[offset]
+
+    def refresh(self):
+        """Redraw the screen, e.g once pages arrived; close it after a while without key presses."""
+        if not self.active:
+            return
+        if self.clock.now() - self._last_key >= self.timeout:
+            self.close()
+            return
+
+        listing = self.listings[-1]
+        width = self.lcd.server_info['screen_width']
+        # The cursor is on the last line; a title is displayed above if possible.
+        rows = len(self._lines) - 1 if len(self._lines) > 1 else 1
+        self.value(listing, listing.cursor)
+        if listing.length is not None:
+            listing.cursor = max(0, min(listing.cursor, listing.length - 1))
+        first = listing.cursor - listing.cursor % rows
+        texts = []
+        for position in range(first, first + rows):
+            value = self.value(listing, position)
+            if listing.length is not None and position >= listing.length:
+                texts.append('')
+                continue
+            marker = self.CURSOR if position == listing.cursor else ' '
+            texts.append(marker + (self.LOADING if value is None else value))
+        if len(self._lines) > 1:
+            # Rows may have revealed the length of the listing.
+            position = '%d' % (listing.cursor + 1)
+            if listing.length is not None:
+                position += '/%d' % listing.length
+            texts.insert(0, listing.title[:width - len(position) - 1].ljust(width - len(position)) + position)
+        for widget, text in zip(self._lines, texts):
+            text = text.replace('"', "'")[:width].ljust(width)
+            if widget.text != text:
+                widget.set_text(text)
@@ -6,18 +6,26 @@ import configparser
 import urllib.parse
 
 import collections
+from concurrent import futures
 import logging
 from logging import handlers as logging_handlers
 import optparse
 import socket
 import sys
+import tempfile
 
+from . import audio
+from . import browser
 from . import enums
 from . import lcdrunner
+from . import metrics
 from . import mpdwrapper
 from . import display_fields
 from . import display_pattern
 from . import mpdhooks
+from . import profiling
+from . import timing
+from . import trace
 from . import utils
 from . import __version__
 
@@ -31,14 +39,32 @@ DEFAULT_LCD_SCREEN_NAME = 'MPD'
 DEFAULT_PATTERN = ''
 DEFAULT_BACKLIGHT_ON = enums.BACKLIGHT_ON_NEVER
 DEFAULT_PRIORITY = 'foreground'
+DEFAULT_SONG_SETTLE = 0
+DEFAULT_OVERLAY_DURATION = 2
+DEFAULT_IDLE_CLOCK = False
+DEFAULT_POWER_SAVE_AFTER = 0
+DEFAULT_LIBRARY_BROWSER = False
 
 # Connection
 DEFAULT_MPD_PORT = 6600
 DEFAULT_LCD_PORT = 13666
 DEFAULT_LCDPROC_CHARSET = 'iso-8859-1'
+DEFAULT_LCDPROC_RATE = 0
+DEFAULT_LCDPROC_BURST = 4
 DEFAULT_RETRY_ATTEMPTS = 3
 DEFAULT_RETRY_WAIT = 3
 DEFAULT_RETRY_BACKOFF = 2
+DEFAULT_CONNECT_TIMEOUT = 5
+DEFAULT_READ_TIMEOUT = 5
+DEFAULT_REQUEST_TIMEOUT = 10
+DEFAULT_AUDIO_FIFO = ''
+DEFAULT_AUDIO_FORMAT = audio.DEFAULT_FORMAT
+
+# Metrics
+DEFAULT_METRICS_TEXTFILE = ''
+DEFAULT_METRICS_INTERVAL = 15
+DEFAULT_METRICS_LISTEN = ''
+DEFAULT_METRICS_PORT = 9101
 
 # Logging
 DEFAULT_SYSLOG_ENABLED = False
@@ -47,6 +73,8 @@ DEFAULT_SYSLOG_FACILITY = 'daemon'
 DEFAULT_SYSLOG_ADDRESS = '/dev/log'
 DEFAULT_LOGFILE = '-'
 DEFAULT_DEBUG_MODULES = ''
+DEFAULT_PROFILE_DIR = tempfile.gettempdir()
+DEFAULT_RECORD_TRACE = ''
 
 BASE_CONFIG = {
     'display': {
@@ -56,15 +84,32 @@ BASE_CONFIG = {
         'backlight_on': ('str', DEFAULT_BACKLIGHT_ON),
         'priority_playing': ('str', DEFAULT_PRIORITY),
         'priority_not_playing': ('str', DEFAULT_PRIORITY),
+        'song_settle': ('float', DEFAULT_SONG_SETTLE),
+        'overlay_duration': ('float', DEFAULT_OVERLAY_DURATION),
+        'idle_clock': ('bool', DEFAULT_IDLE_CLOCK),
+        'power_save_after': ('float', DEFAULT_POWER_SAVE_AFTER),
+        'library_browser': ('bool', DEFAULT_LIBRARY_BROWSER),
     },
     'connections': {
         'mpd': ('str', 'localhost:%s' % DEFAULT_MPD_PORT),
         'lcdproc': ('str', 'localhost:%s' % DEFAULT_LCD_PORT),
         'lcdproc_charset': ('str', DEFAULT_LCDPROC_CHARSET),
         'lcdd_debug': ('bool', False),
+        'lcdproc_rate': ('float', DEFAULT_LCDPROC_RATE),
+        'lcdproc_burst': ('int', DEFAULT_LCDPROC_BURST),
         'retry_attempts': ('int', DEFAULT_RETRY_ATTEMPTS),
         'retry_wait': ('int', DEFAULT_RETRY_WAIT),
         'retry_backoff': ('int', DEFAULT_RETRY_BACKOFF),
+        'connect_timeout': ('float', DEFAULT_CONNECT_TIMEOUT),
+        'read_timeout': ('float', DEFAULT_READ_TIMEOUT),
+        'request_timeout': ('float', DEFAULT_REQUEST_TIMEOUT),
+        'audio_fifo': ('str', DEFAULT_AUDIO_FIFO),
+        'audio_format': ('str', DEFAULT_AUDIO_FORMAT),
+    },
+    'metrics': {
+        'metrics_textfile': ('str', DEFAULT_METRICS_TEXTFILE),
+        'metrics_interval': ('float', DEFAULT_METRICS_INTERVAL),
+        'metrics_listen': ('str', DEFAULT_METRICS_LISTEN),
     },
     'logging': {
         'syslog': ('bool', DEFAULT_SYSLOG_ENABLED),
@@ -73,6 +118,8 @@ BASE_CONFIG = {
         'syslog_address': ('str', DEFAULT_SYSLOG_ADDRESS),
         'logfile': ('str', DEFAULT_LOGFILE),
         'debug': ('str', DEFAULT_DEBUG_MODULES),
+        'profile_dir': ('str', DEFAULT_PROFILE_DIR),
+        'record_trace': ('str', DEFAULT_RECORD_TRACE),
     },
 }
 
@@ -96,6 +143,26 @@ DEFAULT_PATTERNS = [
     """{elapsed}  {state}  {remaining}""",
 ]
 
+# Displayed while MPD is stopped, with --idle-clock
+DEFAULT_IDLE_PATTERNS = [
+    # One line
+    """{date} {clock}""",
+
+    # Two lines
+    """{clock}\n"""
+    """{date}""",
+
+    # Three lines
+    """\n"""
+    """{clock}\n"""
+    """{date}""",
+
+    # Four lines
+    """\n"""
+    """{clock}\n"""
+    """{date}\n""",
+]
+
 
 logger = logging.getLogger('mpdlcd')
 
@@ -128,14 +195,19 @@ def _make_hostport(conn, default_host, default_port, default_user='', default_pa
 
 def _make_lcdproc(
         lcd_host, lcd_port, retry_config,
-        charset=DEFAULT_LCDPROC_CHARSET, lcdd_debug=False):
-    """Create and connect to the LCDd server.
+        charset=DEFAULT_LCDPROC_CHARSET, lcdd_debug=False,
+        command_rate=DEFAULT_LCDPROC_RATE, command_burst=DEFAULT_LCDPROC_BURST, tracer=None, timeouts=None):
+    """Create and connect to the LCDd server, and start a session.
 
     Args:
         lcd_host (str): the hostname to connect to
         lcd_prot (int): the port to connect to
         charset (str): the charset to use when sending messages to lcdproc
         lcdd_debug (bool): whether to enable full LCDd debug
+        command_rate (float): maximum commands per second (0 for no limit)
+        command_burst (int): number of commands allowed in a burst
+        tracer (mpdlcd.trace.TraceWriter): where to record the traffic, if set
+        timeouts (mpdlcd.utils.TimeoutConfig): I/O timeouts
         retry_attempts (int): the number of connection attempts
         retry_wait (int): the time to wait between connection attempts
         retry_backoff (int): the backoff for increasing inter-attempt delay
@@ -149,8 +221,11 @@ def _make_lcdproc(
 
         @utils.auto_retry
         def connect(self):
-            return lcdrunner.LcdProcServer(
-                lcd_host, lcd_port, charset=charset, debug=lcdd_debug)
+            lcd = lcdrunner.LcdProcServer(
+                lcd_host, lcd_port, charset=charset, debug=lcdd_debug,
+                command_rate=command_rate, command_burst=command_burst, tracer=tracer, timeouts=timeouts)
+            lcd.start_session()
+            return lcd
 
     spawner = ServerSpawner(retry_config=retry_config, logger=logger)
 
@@ -161,17 +236,47 @@ def _make_lcdproc(
         raise SystemExit(1)
 
 
-def _make_patterns(patterns):
+def _connect_servers(mpd_client, make_lcdproc, startup):
+    """Connect to MPD and LCDd concurrently.
+
+    A failure to reach MPD is not fatal: the first update displays the
+    "offline" screen, and retries later.
+
+    Args:
+        mpd_client (mpdlcd.mpdwrapper.MPDClient): the MPD client to connect
+        make_lcdproc (callable): creates the connected LcdProcServer
+        startup (mpdlcd.timing.StepTimer): records the duration of each connection
+
+    Returns:
+        LcdProcServer: the result of make_lcdproc()
+    """
+    def connect_mpd():
+        with startup.step('mpd connect'):
+            try:
+                mpd_client.connect()
+            except mpdwrapper.MPDConnectionError:
+                pass
+
+    with futures.ThreadPoolExecutor(max_workers=1) as executor:
+        mpd_connected = executor.submit(connect_mpd)
+        with startup.step('lcdproc connect'):
+            lcd = make_lcdproc()
+        mpd_connected.result()
+    return lcd
+
+
+def _make_patterns(patterns, clock=None):
     """Create a ScreenPatternList from a given pattern text.
 
     Args:
         pattern_txt (str list): the patterns
+        clock (mpdlcd.timing.Clock): the clock used by fields
 
     Returns:
         mpdlcd.display_pattern.ScreenPatternList: a list of patterns from the
             given entries.
     """
-    field_registry = display_fields.FieldRegistry()
+    field_registry = display_fields.FieldRegistry(clock=clock)
 
     pattern_list = display_pattern.ScreenPatternList(
         field_registry=field_registry,
@@ -181,18 +286,91 @@ def _make_patterns(patterns):
     return pattern_list
 
 
+def _make_state_patterns(state_patterns, clock=None):
+    """Create the ScreenPatternList of each player state.
+
+    Args:
+        state_patterns (dict(str => str list)): the patterns of player states
+        clock (mpdlcd.timing.Clock): the clock used by fields
+
+    Returns:
+        dict(str => mpdlcd.display_pattern.ScreenPatternList): the patterns of
+            states which have some
+    """
+    return dict(
+        (state, _make_patterns(patterns, clock=clock))
+        for state, patterns in state_patterns.items()
+        if patterns
+    )
+
+
+def _start_audio(fifo='', audio_format=DEFAULT_AUDIO_FORMAT):
+    """Start reading audio for the spectrum and VU meter fields, if configured.
+
+    Returns:
+        mpdlcd.audio.AudioSource: the source of audio frames, or None
+    """
+    if not fifo:
+        return None
+    if audio.numpy is None:
+        logger.warning('NumPy is not installed: spectrum and VU meter fields will stay empty.')
+        return None
+    try:
+        source = audio.AudioSource(fifo, audio_format)
+    except audio.AudioFormatError as e:
+        logger.error('Invalid audio format: %s', e)
+        raise SystemExit(1)
+    return source.start()
+
+
+def _start_metrics(textfile='', interval=DEFAULT_METRICS_INTERVAL, listen=''):
+    """Start the requested metrics exporters.
+
+    Args:
+        textfile (str): write metrics to this file, if set
+        interval (float): how often to write the metrics file
+        listen (str): serve metrics over HTTP at this host:port, if set
+    """
+    if textfile:
+        metrics.TextfileExporter(textfile, interval).start()
+    if listen:
+        listen_conn = _make_hostport(listen, 'localhost', DEFAULT_METRICS_PORT)
+        try:
+            metrics.HTTPExporter(listen_conn.hostname, listen_conn.port).start()
+        except socket.error as e:
+            logger.error('Unable to serve metrics on %s:%s : %r', listen_conn.hostname, listen_conn.port, e)
+            raise SystemExit(1)
+
+
 def run_forever(
         lcdproc='', mpd='', lcdproc_screen=DEFAULT_LCD_SCREEN_NAME,
         lcdproc_charset=DEFAULT_LCDPROC_CHARSET,
         lcdd_debug=False,
-        pattern='', patterns=[],
+        lcdproc_rate=DEFAULT_LCDPROC_RATE,
+        lcdproc_burst=DEFAULT_LCDPROC_BURST,
+        pattern='', patterns=[], paused_patterns=(), stopped_patterns=(),
         refresh=DEFAULT_REFRESH,
         backlight_on=DEFAULT_BACKLIGHT_ON,
         priority_playing=DEFAULT_PRIORITY,
         priority_not_playing=DEFAULT_PRIORITY,
+        song_settle=DEFAULT_SONG_SETTLE,
+        overlay_duration=DEFAULT_OVERLAY_DURATION,
+        idle_clock=DEFAULT_IDLE_CLOCK,
+        power_save_after=DEFAULT_POWER_SAVE_AFTER,
+        library_browser=DEFAULT_LIBRARY_BROWSER,
         retry_attempts=DEFAULT_RETRY_ATTEMPTS,
         retry_wait=DEFAULT_RETRY_WAIT,
-        retry_backoff=DEFAULT_RETRY_BACKOFF):
+        retry_backoff=DEFAULT_RETRY_BACKOFF,
+        connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+        read_timeout=DEFAULT_READ_TIMEOUT,
+        request_timeout=DEFAULT_REQUEST_TIMEOUT,
+        audio_fifo=DEFAULT_AUDIO_FIFO,
+        audio_format=DEFAULT_AUDIO_FORMAT,
+        metrics_textfile=DEFAULT_METRICS_TEXTFILE,
+        metrics_interval=DEFAULT_METRICS_INTERVAL,
+        metrics_listen=DEFAULT_METRICS_LISTEN,
+        record_trace=DEFAULT_RECORD_TRACE,
+        profiler=None):
     """Run the server.
 
     Args:
@@ -201,14 +379,44 @@ def run_forever(
         lcdproc_screen (str): the name of the screen to use for lcdproc
         lcdproc_charset (str): the charset to use with lcdproc
         lcdd_debug (bool): whether to enable full LCDd debug
+        lcdproc_rate (float): maximum commands per second sent to lcdproc
+        lcdproc_burst (int): number of commands allowed in a burst
         pattern (str): the pattern to use
         patterns (str list): the patterns to use
+        paused_patterns (str list): patterns to display on a separate screen
+            while MPD is paused
+        stopped_patterns (str list): patterns to display on a separate screen
+            while MPD is stopped
         refresh (float): how often to refresh the display
         backlight_on (str): the rules for activating backlight
+        song_settle (float): how long a new song should stay current before
+            being displayed
+        overlay_duration (float): how long to display changes of volume,
+            options and errors, 0 to disable them
+        idle_clock (bool): whether to display the time and date while MPD is
+            stopped, unless stopped_patterns are given
+        power_save_after (float): park the display and stop updating it after
+            that many seconds without activity, 0 to disable
+        library_browser (bool): whether to browse the MPD library from the
+            LCDd menu
         retry_attempts (int): number of connection attempts
         retry_wait (int): time between connection attempts
         retry_backoff (int): increase to between-attempts delay
+        connect_timeout (float): maximum time to connect to a server
+        read_timeout (float): maximum time to wait for each line of a reply
+        request_timeout (float): maximum time for a whole request
+        audio_fifo (str): the FIFO where MPD writes the played audio, for the
+            spectrum and VU meter fields
+        audio_format (str): the format of that audio, as rate:bits:channels
+        metrics_textfile (str): file where metrics should be written
+        metrics_interval (float): time between two writes of metrics_textfile
+        metrics_listen (str): the host:port where metrics should be served
+        record_trace (str): file where a trace of the session should be written
+        profiler (mpdlcd.profiling.Profiler): the profiler for display updates
     """
+    startup = timing.StepTimer()
+    _start_metrics(textfile=metrics_textfile, interval=metrics_interval, listen=metrics_listen)
+
     # Compute host/ports
     lcd_conn = _make_hostport(lcdproc, 'localhost', 13666)
     mpd_conn = _make_hostport(mpd, 'localhost', 6600)
@@ -218,6 +426,34 @@ def run_forever(
         retry_attempts=retry_attempts,
         retry_backoff=retry_backoff,
         retry_wait=retry_wait)
+    timeouts = utils.TimeoutConfig(
+        connect_timeout=connect_timeout,
+        read_timeout=read_timeout,
+        request_timeout=request_timeout)
+
+    # Fill pattern
+    if pattern:
+        # If a specific pattern was given, use it
+        patterns = [pattern]
+    elif not patterns:
+        # If no patterns were given, use the defaults
+        patterns = DEFAULT_PATTERNS
+    if idle_clock and not stopped_patterns:
+        stopped_patterns = DEFAULT_IDLE_PATTERNS
+    state_patterns = {
+        display_fields.MPD_PAUSE: list(paused_patterns),
+        display_fields.MPD_STOP: list(stopped_patterns),
+    }
+    hook_options = {
+        'song': {'settle': song_settle},
+    }
+
+    # Setup tracing
+    tracer = None
+    if record_trace:
+        logger.info('Recording a trace of the session to %s', record_trace)
+        tracer = trace.TraceWriter(record_trace)
+        tracer.meta(patterns=patterns, state_patterns=state_patterns, refresh=refresh, hook_options=hook_options)
 
     # Setup MPD client
     mpd_client = mpdwrapper.MPDClient(
@@ -225,42 +461,61 @@ def run_forever(
         port=mpd_conn.port,
         password=mpd_conn.username,
         retry_config=retry_config,
+        tracer=tracer,
+        timeouts=timeouts,
     )
 
-    # Setup LCDd client
-    lcd = _make_lcdproc(
+    def make_browser_client():
+        # Pages are fetched in a background thread, on their own connection.
+        return mpdwrapper.MPDClient(
+            host=mpd_conn.hostname,
+            port=mpd_conn.port,
+            password=mpd_conn.username,
+            retry_config=retry_config,
+            timeouts=timeouts,
+        )
+
+    # Setup LCDd client, while connecting to MPD
+    lcd = _connect_servers(mpd_client, lambda: _make_lcdproc(
         lcd_conn.hostname, lcd_conn.port,
         lcdd_debug=lcdd_debug,
         charset=lcdproc_charset,
         retry_config=retry_config,
-    )
-
-    # Setup connector
-    runner = lcdrunner.MpdRunner(
-        mpd_client, lcd,
-        lcdproc_screen=lcdproc_screen,
-        refresh_rate=refresh,
-        retry_config=retry_config,
-        backlight_on=backlight_on,
-        priority_playing=priority_playing,
-        priority_not_playing=priority_not_playing,
-    )
-
-    # Fill pattern
-    if pattern:
-        # If a specific pattern was given, use it
-        patterns = [pattern]
-    elif not patterns:
-        # If no patterns were given, use the defaults
-        patterns = DEFAULT_PATTERNS
-    pattern_list = _make_patterns(patterns)
-
-    mpd_hook_registry = mpdhooks.HookRegistry()
-    runner.setup_pattern(pattern_list, hook_registry=mpd_hook_registry)
+        command_rate=lcdproc_rate,
+        command_burst=lcdproc_burst,
+        tracer=tracer,
+        timeouts=timeouts,
+    ), startup)
+
+    # Setup connector; all screens and widgets are sent in a single batch.
+    with startup.step('screen setup'):
+        pattern_list = _make_patterns(patterns)
+        audio_source = _start_audio(audio_fifo, audio_format)
+        mpd_hook_registry = mpdhooks.HookRegistry(hook_options=dict(hook_options, audio={'source': audio_source}))
+        library = None
+        if library_browser:
+            library = browser.LibraryBrowser(lcd, make_browser_client, ref='%s_browser' % lcdproc_screen)
+        with lcd.batch():
+            runner = lcdrunner.MpdRunner(
+                mpd_client, lcd,
+                lcdproc_screen=lcdproc_screen,
+                refresh_rate=refresh,
+                retry_config=retry_config,
+                backlight_on=backlight_on,
+                priority_playing=priority_playing,
+                priority_not_playing=priority_not_playing,
+                profiler=profiler,
+                overlay_duration=overlay_duration,
+                idle_events=True,
+                power_save_after=power_save_after,
+                browser=library,
+                tracer=tracer,
+            )
+            runner.setup_pattern(
+                pattern_list, hook_registry=mpd_hook_registry, state_patterns=_make_state_patterns(state_patterns))
 
     # Launch
-    mpd_client.connect()
-    runner.run()
+    runner.run(startup=startup)
 
     # Exit
     logging.shutdown()
@@ -297,6 +552,14 @@ def _make_parser():
         '--patterns', dest='patterns', action='append',
         help='Register a PATTERN; the actual pattern is chosen according to screen height.',
         metavar='PATTERN')
+    group.add_option(
+        '--paused-patterns', dest='paused_patterns', action='append',
+        help='Register a PATTERN for a separate screen, displayed while MPD is paused.',
+        metavar='PATTERN')
+    group.add_option(
+        '--stopped-patterns', dest='stopped_patterns', action='append',
+        help='Register a PATTERN for a separate screen, displayed while MPD is stopped.',
+        metavar='PATTERN')
     group.add_option(
         '--refresh', dest='refresh', type='float',
         help='Refresh the display every REFRESH seconds (default: %.1fs)' % DEFAULT_REFRESH,
@@ -318,6 +581,34 @@ def _make_parser():
         '--priority-not-playing', dest='priority_not_playing',
         help="Screen priority when music is not playing (default: %s)" % DEFAULT_PRIORITY,
         metavar='PRIORITY_NOT_PLAYING')
+    group.add_option(
+        '--song-settle', dest='song_settle', type='float',
+        help="Only display a new song once it has been playing for SETTLE seconds (default: %.1fs)"
+        % DEFAULT_SONG_SETTLE,
+        metavar='SETTLE')
+    group.add_option(
+        '--overlay-duration', dest='overlay_duration', type='float',
+        help="Display volume, option and error changes for DURATION seconds, 0 to disable (default: %.1fs)"
+        % DEFAULT_OVERLAY_DURATION,
+        metavar='DURATION')
+    group.add_option(
+        '--idle-clock', dest='idle_clock', action='store_true',
+        help="Display the time and date while MPD is stopped, unless --stopped-patterns are given (default: %s)"
+        % DEFAULT_IDLE_CLOCK)
+    group.add_option(
+        '--no-idle-clock', dest='idle_clock', action='store_false',
+        help="Don't display the time and date while MPD is stopped (Useful when enabled in config file)")
+    group.add_option(
+        '--power-save-after', dest='power_save_after', type='float',
+        help="Turn the backlight off and stop updating the display after DELAY seconds without activity, "
+        "0 to disable (default: %.1fs)" % DEFAULT_POWER_SAVE_AFTER,
+        metavar='DELAY')
+    group.add_option(
+        '--library-browser', dest='library_browser', action='store_true',
+        help="Browse artists and albums from the LCDd menu (default: %s)" % DEFAULT_LIBRARY_BROWSER)
+    group.add_option(
+        '--no-library-browser', dest='library_browser', action='store_false',
+        help="Don't add the library browser to the LCDd menu (Useful when enabled in config file)")
 
     # End display options
     parser.add_option_group(group)
@@ -337,11 +628,20 @@ def _make_parser():
     group.add_option(
         '--lcdd-debug', dest='lcdd_debug', action='store_true',
         help='Add full debug output of LCDd commands', default=False)
+    group.add_option(
+        '--lcdproc-rate', dest='lcdproc_rate', type='float',
+        help='Send at most RATE commands per second to lcdproc; 0 for no limit (default: %d)' % DEFAULT_LCDPROC_RATE,
+        metavar='RATE')
+    group.add_option(
+        '--lcdproc-burst', dest='lcdproc_burst', type='int',
+        help='Allow bursts of BURST commands to lcdproc when rate-limited (default: %d)' % DEFAULT_LCDPROC_BURST,
+        metavar='BURST')
 
     # Auto-retry
     group.add_option(
         '--retry-attempts', dest='retry_attempts', type='int',
-        help='Retry connections RETRY_ATTEMPTS times (default: %d)' % DEFAULT_RETRY_ATTEMPTS,
+        help='Consider a server dead after RETRY_ATTEMPTS failed connections in a row (default: %d)'
+        % DEFAULT_RETRY_ATTEMPTS,
         metavar='RETRY_ATTEMPTS')
     group.add_option(
         '--retry-wait', dest='retry_wait', type='float',
@@ -352,9 +652,53 @@ def _make_parser():
         help='Increase RETRY_WAIT by a RETRY_BACKOFF factor after each failure (default: %d)' % DEFAULT_RETRY_BACKOFF,
         metavar='RETRY_BACKOFF')
 
+    # Timeouts
+    group.add_option(
+        '--connect-timeout', dest='connect_timeout', type='float',
+        help='Give up connecting to a server after TIMEOUT seconds; 0 for no limit (default: %.1fs)'
+        % DEFAULT_CONNECT_TIMEOUT,
+        metavar='TIMEOUT')
+    group.add_option(
+        '--read-timeout', dest='read_timeout', type='float',
+        help='Wait at most TIMEOUT seconds for each line of a reply; 0 for no limit (default: %.1fs)'
+        % DEFAULT_READ_TIMEOUT,
+        metavar='TIMEOUT')
+    group.add_option(
+        '--request-timeout', dest='request_timeout', type='float',
+        help='Wait at most TIMEOUT seconds for a whole reply; 0 for no limit (default: %.1fs)'
+        % DEFAULT_REQUEST_TIMEOUT,
+        metavar='TIMEOUT')
+    group.add_option(
+        '--audio-fifo', dest='audio_fifo',
+        help="Read the audio played by MPD from the FIFO at PATH, for the spectrum and VU meter fields",
+        metavar='PATH')
+    group.add_option(
+        '--audio-format', dest='audio_format',
+        help="Format of the audio in the FIFO, as rate:bits:channels (default: %s)" % DEFAULT_AUDIO_FORMAT,
+        metavar='FORMAT')
+
     # End connection options
     parser.add_option_group(group)
 
+    # Metrics options
+    # ---------------
+    group = optparse.OptionGroup(parser, 'Metrics')
+    group.add_option(
+        '--metrics-textfile', dest='metrics_textfile',
+        help='Periodically write metrics to FILE, in the Prometheus text format',
+        metavar='FILE')
+    group.add_option(
+        '--metrics-interval', dest='metrics_interval', type='float',
+        help='Write the metrics file every INTERVAL seconds (default: %.1fs)' % DEFAULT_METRICS_INTERVAL,
+        metavar='INTERVAL')
+    group.add_option(
+        '--metrics-listen', dest='metrics_listen',
+        help='Serve metrics over HTTP at HOST:PORT (default port: %d)' % DEFAULT_METRICS_PORT,
+        metavar='HOST:PORT')
+
+    # End metrics options
+    parser.add_option_group(group)
+
     # Logging options
     # ---------------
     group = optparse.OptionGroup(parser, 'Logging')
@@ -387,6 +731,15 @@ def _make_parser():
         '-d', '--debug', dest='debug',
         help="Log debug output from the MODULES components",
         metavar='MODULES')
+    group.add_option(
+        '--profile-dir', dest='profile_dir',
+        help="Write profiles (toggled by SIGUSR1) and memory snapshots (SIGUSR2) to DIR (default: %s)"
+        % DEFAULT_PROFILE_DIR,
+        metavar='DIR')
+    group.add_option(
+        '--record-trace', dest='record_trace',
+        help="Append a trace of all exchanges with MPD and LCDd to FILE, for replaying with mpdlcd-bench",
+        metavar='FILE')
 
     # End logging options
     parser.add_option_group(group)
@@ -475,6 +828,13 @@ def _read_config(filename):
         patterns = DEFAULT_PATTERNS
     config['patterns'] = patterns
 
+    for state in ('paused', 'stopped'):
+        section = 'patterns_%s' % state
+        if section in parser.sections():
+            config['%s_patterns' % state] = [parser.get(section, opt) for opt in parser.options(section)]
+        else:
+            config['%s_patterns' % state] = []
+
     return config
 
 
@@ -514,10 +874,18 @@ def main(argv):
         base_config, options,
         'syslog', 'syslog_facility', 'syslog_address',
         'logfile', 'loglevel', 'debug'))
-    run_forever(**_extract_options(
+
+    profiler = profiling.Profiler(output_dir=_extract_options(base_config, options, 'profile_dir')['profile_dir'])
+    profiler.install_signal_handlers()
+
+    run_forever(profiler=profiler, **_extract_options(
         base_config, options,
         'lcdproc', 'mpd', 'lcdproc_charset', 'lcdproc_screen', 'lcdd_debug',
+        'lcdproc_rate', 'lcdproc_burst',
         'refresh', 'backlight_on',
-        'priority_playing', 'priority_not_playing',
-        'pattern', 'patterns',
-        'retry_attempts', 'retry_backoff', 'retry_wait'))
+        'priority_playing', 'priority_not_playing', 'song_settle', 'overlay_duration',
+        'idle_clock', 'power_save_after', 'library_browser',
+        'pattern', 'patterns', 'paused_patterns', 'stopped_patterns',
+        'retry_attempts', 'retry_backoff', 'retry_wait',
+        'connect_timeout', 'read_timeout', 'request_timeout', 'audio_fifo', 'audio_format',
+        'metrics_textfile', 'metrics_interval', 'metrics_listen', 'record_trace'))
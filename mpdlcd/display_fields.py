@@ -6,8 +6,12 @@
 
 import collections
 import logging
+import math
+import time
 
 from . import enums
+from . import metrics
+from . import timing
 from . import utils
 
 logger = logging.getLogger(__name__)
@@ -18,6 +22,11 @@ class FieldRegistryError(Exception):
 
 
 class FieldRegistry(object):
+    """Registry of available fields.
+
+    Attributes:
+        clock (mpdlcd.timing.Clock): the clock given to created fields
+    """
     _REGISTRY = {}
 
     @classmethod
@@ -33,7 +42,8 @@ class FieldRegistry(object):
                 raise FieldRegistryError(
                     "Cannot register two fields with the same name.")
 
-    def __init__(self):
+    def __init__(self, clock=None):
+        self.clock = clock or timing.MONOTONIC
         self._counter = collections.defaultdict(lambda: 0)
 
     def create(self, name, **kwargs):
@@ -44,7 +54,10 @@ class FieldRegistry(object):
 
         ref = self._counter[name]
         self._counter[name] += 1
-        return self._REGISTRY[name](ref=ref, **kwargs)
+        field_class = self._REGISTRY[name]
+        if issubclass(field_class, Field):
+            kwargs.setdefault('clock', self.clock)
+        return field_class(ref=ref, **kwargs)
 
 
 def register_field(field_class):
@@ -52,6 +65,11 @@ def register_field(field_class):
     return field_class
 
 
+# Priority of widget updates, when the LCD command rate is limited.
+WRITE_PRIORITY_HIGH = 0
+WRITE_PRIORITY_NORMAL = 1
+WRITE_PRIORITY_LOW = 2
+
 MPD_STOP = 'stop'
 MPD_PLAY = 'play'
 MPD_PAUSE = 'pause'
@@ -63,14 +81,112 @@ MPD_TO_LCDD_MAP = {
 }
 
 
+class WriteThrottle(object):
+    """Decide when a new value should actually be written to a widget.
+
+    A value identical to the displayed one is never rewritten; other values
+    may be dropped (deadband) or delayed (min_interval).
+
+    ``hold`` is an alias of ``min_interval``: keeping each written value
+    displayed for N seconds is the same as spacing writes by N seconds. When
+    both are given, the largest one applies.
+
+    Attributes:
+        min_interval (float): minimum delay between two writes, in seconds
+        deadband (float): minimum change required for numeric values
+        hold (float): alias of min_interval
+        text (str): the last written text
+        value (float): the numeric value of the last written text, if any
+        written_at (float): when the last write happened
+        pending ((callable, str, float)): a delayed write, as
+            (setter, text, value)
+    """
+
+    def __init__(self, min_interval=0, deadband=0, hold=0):
+        self.min_interval = float(min_interval)
+        self.deadband = float(deadband)
+        self.hold = float(hold)
+        if self.min_interval < 0 or self.deadband < 0 or self.hold < 0:
+            raise ValueError("min_interval, deadband and hold should be positive.")
+
+        self.text = None
+        self.value = None
+        self.written_at = None
+        self.pending = None
+
+    def next_write(self):
+        """Earliest time at which a new value may be written."""
+        if self.written_at is None:
+            return None
+        return self.written_at + max(self.min_interval, self.hold)
+
+    def _within_deadband(self, value):
+        if not self.deadband or value is None or self.value is None:
+            return False
+        return abs(value - self.value) < self.deadband
+
+    def submit(self, setter, text, value, now):
+        """Submit a new value.
+
+        Args:
+            setter (callable): the widget method writing the text
+            text (str): the new text
+            value (float): the numeric value behind the text, or None
+            now (float): the current time
+
+        Returns:
+            bool: whether the text should be written right away; otherwise, it
+                has either been dropped or stored as pending.
+        """
+        self.pending = None
+        if text == self.text or self._within_deadband(value):
+            return False
+
+        next_write = self.next_write()
+        if next_write is not None and now < next_write:
+            self.pending = (setter, text, value)
+            return False
+        return True
+
+    def written(self, text, value, now):
+        """Record that a text was written to the widget."""
+        self.text = text
+        self.value = value
+        self.written_at = now
+        self.pending = None
+
+    def due(self, now):
+        """Retrieve the pending write, if its delay has expired.
+
+        Returns:
+            (callable, str, float): the (setter, text, value) to write, or None
+        """
+        if self.pending is None or now < self.next_write():
+            return None
+        return self.pending
+
+
 class Field(object):
+    """A field of a pattern.
+
+    All fields accept the following options, controlling widget writes:
+    - min_interval: minimum number of seconds between two writes; intermediate
+        values are skipped, the latest one is written once the delay expired
+    - deadband: ignore numeric changes smaller than this amount
+    - hold: alias of min_interval, keeping each displayed value for at least
+        that many seconds
+    """
     base_name = None
     target_hooks = []
+    write_priority = WRITE_PRIORITY_NORMAL
 
-    def __init__(self, ref, width=-1, **kwargs):
+    def __init__(self, ref, width=-1, min_interval=0, deadband=0, hold=0, clock=None, **kwargs):
         assert self.base_name
         self.ref = ref
         self.width = width
+        self.clock = clock or timing.MONOTONIC
+        self.write_options = dict(min_interval=min_interval, deadband=deadband, hold=hold)
+        self.throttle = WriteThrottle(**self.write_options)
 
     @property
     def name(self):
@@ -120,14 +236,53 @@ class Field(object):
     def time_changed(self, widget, elapsed, total):
         pass
 
-    def set_widget_text(self, widget, text):
-        """Sets the text of a widget, taking into account server charset.
+    def set_widget_text(self, widget, text, value=None):
+        """Sets the text of a widget, taking into account write options.
 
         Args:
             widget (lcdproc.Widget): widget whose text should be set
             text (unicode): text to set
+            value (float): numeric value behind the text, for ``deadband``
         """
-        widget.set_text(text)
+        self.write(widget, widget.set_text, text, value)
+
+    def write(self, widget, setter, text, value=None, throttle=None):
+        """Write a value to a widget, unless throttled.
+
+        Args:
+            widget (lcdproc.Widget): the target widget
+            setter (callable): the widget method to call with the text
+            text (str): the text to write
+            value (float): numeric value behind the text, for ``deadband``
+            throttle (WriteThrottle): the throttle of the widget, for fields
+                drawn with several widgets; the field's throttle by default
+        """
+        if throttle is None:
+            throttle = self.throttle
+        now = self.clock.now()
+        if throttle.submit(setter, text, value, now):
+            logger.debug('Setting widget %s to %r', widget.ref, text)
+            setter(text)
+            throttle.written(text, value, now)
+            metrics.WIDGET_WRITES.labels('written').inc()
+        elif throttle.pending:
+            logger.debug('Delaying write of %r to widget %s', text, widget.ref)
+            metrics.WIDGET_WRITES.labels('delayed').inc()
+        else:
+            metrics.WIDGET_WRITES.labels('suppressed').inc()
+
+    def flush(self, widget, throttle=None):
+        """Perform a delayed write, if its delay has expired."""
+        if throttle is None:
+            throttle = self.throttle
+        now = self.clock.now()
+        pending = throttle.due(now)
+        if pending is not None:
+            setter, text, value = pending
+            logger.debug('Setting widget %s to %r (delayed)', widget.ref, text)
+            setter(text)
+            throttle.written(text, value, now)
+            metrics.WIDGET_WRITES.labels('written').inc()
 
     def __repr__(self):
         return '<Field %s (%d)>' % (self.name, self.width)
@@ -149,6 +304,7 @@ class FixedText(Field):
 class StateField(Field):
     base_name = 'state'
     target_hooks = ['state']
+    write_priority = WRITE_PRIORITY_HIGH
 
     def __init__(self, **kwargs):
         super(StateField, self).__init__(width=1, **kwargs)
@@ -158,8 +314,7 @@ class StateField(Field):
 
     def state_changed(self, widget, new_state):
         name = MPD_TO_LCDD_MAP.get(new_state, MPD_STOP)
-        logger.debug('Setting widget %s to %r', widget.ref, name)
-        widget.set_name(name)
+        self.write(widget, widget.set_name, name)
 
 
 class BacklightPseudoField(Field):
@@ -186,8 +341,9 @@ class BacklightPseudoField(Field):
         else:
             backlight_on = False
         backlight = 'on' if backlight_on else 'off'
-        logger.debug("Setting backlight to %s", backlight)
-        self._screen.set_backlight(backlight)
+        if backlight != self._screen.backlight:
+            logger.debug("Setting backlight to %s", backlight)
+            self._screen.set_backlight(backlight)
 
 
 class PriorityPseudoField(Field):
@@ -208,12 +364,14 @@ class PriorityPseudoField(Field):
             priority = self.priority_playing
         else:
             priority = self.priority_not_playing
-        logger.debug("Setting priority to %s", priority)
-        self._screen.set_priority(priority)
+        if priority != self._screen.priority:
+            logger.debug("Setting priority to %s", priority)
+            self._screen.set_priority(priority)
 
 
 class BaseTimeField(Field):
     target_hooks = ['state', 'elapsed_and_total']
+    write_priority = WRITE_PRIORITY_HIGH
 
     def __init__(self, **kwargs):
         super(BaseTimeField, self).__init__(width=5, **kwargs)
@@ -237,9 +395,7 @@ class BaseTimeField(Field):
 
     def state_changed(self, widget, new_state):
         if new_state not in (MPD_PLAY, MPD_PAUSE):
-            txt = self._format_time(None)
-            logger.debug('Setting widget %s to %r', widget.ref, txt)
-            widget.set_text(txt)
+            self.set_widget_text(widget, self._format_time(None))
 
 
 @register_field
@@ -247,9 +403,7 @@ class ElapsedTimeField(BaseTimeField):
     base_name = 'elapsed'
 
     def time_changed(self, widget, elapsed, total):
-        txt = self._format_time(elapsed)
-        logger.debug('Setting widget %s to %r', widget.ref, txt)
-        widget.set_text(txt)
+        self.set_widget_text(widget, self._format_time(elapsed), elapsed)
 
 
 @register_field
@@ -257,9 +411,7 @@ class TotalTimeField(BaseTimeField):
     base_name = 'total'
 
     def time_changed(self, widget, elapsed, total):
-        txt = self._format_time(total)
-        logger.debug('Setting widget %s to %r', widget.ref, txt)
-        widget.set_text(txt)
+        self.set_widget_text(widget, self._format_time(total), total)
 
 
 @register_field
@@ -271,15 +423,172 @@ class RemainingTimeField(BaseTimeField):
             remaining = total - elapsed
         else:
             remaining = None
-        txt = self._format_time(remaining)
-        logger.debug('Setting widget %s to %r', widget.ref, txt)
-        widget.set_text(txt)
+        self.set_widget_text(widget, self._format_time(remaining), remaining)
+
+
+class BaseBarField(Field):
+    """A horizontal bar, taking the available width.
+
+    The bar is drawn at LCDd's sub-character resolution, and only written
+    when its length in pixels changes.
+    """
+    DEFAULT_CELL_WIDTH = 5
+
+    def __init__(self, width=-1, **kwargs):
+        super(BaseBarField, self).__init__(width=int(width), **kwargs)
+        self.cell_width = self.DEFAULT_CELL_WIDTH
+
+    def add_to_screen(self, screen, left, top):
+        self.cell_width = screen.server.server_info.get('cell_width', self.DEFAULT_CELL_WIDTH)
+        return screen.add_hbar_widget(self.name, x=left, y=top, length=0)
+
+    @property
+    def pixels(self):
+        """The length of a full bar, in pixels."""
+        return self.width * self.cell_width
+
+    def set_bar_length(self, widget, length):
+        self.write(widget, widget.set_length, length, length)
+
+
+@register_field
+class ProgressField(BaseBarField):
+    """A progress bar of the current song."""
+    base_name = 'progress'
+    target_hooks = ['state', 'elapsed_and_total']
+
+    def _bar_length(self, elapsed, total):
+        """The length of the bar, in pixels."""
+        if not total or elapsed is None:
+            return 0
+        return min(self.pixels, self.pixels * elapsed // total)
+
+    def state_changed(self, widget, new_state):
+        if new_state not in (MPD_PLAY, MPD_PAUSE):
+            self.set_bar_length(widget, 0)
+
+    def time_changed(self, widget, elapsed, total):
+        self.set_bar_length(widget, self._bar_length(elapsed, total))
+
+
+@register_field
+class VUField(BaseBarField):
+    """A VU meter, showing the level of the loudest channel.
+
+    Attributes:
+        frame_interval (float): the delay between two frames, in seconds
+    """
+    base_name = 'vu'
+    target_hooks = ['state', 'audio']
+    write_priority = WRITE_PRIORITY_LOW
+
+    def __init__(self, rate=10, **kwargs):
+        super(VUField, self).__init__(**kwargs)
+        self.frame_interval = 1.0 / float(rate)
+
+    def hook_changed(self, hook_name, widget, new_data):
+        if hook_name == 'audio':
+            level = new_data.vu() if new_data is not None else 0.0
+            self.set_bar_length(widget, int(round(level * self.pixels)))
+        super(VUField, self).hook_changed(hook_name, widget, new_data)
+
+    def state_changed(self, widget, new_state):
+        # Frames stop with playback.
+        if new_state != MPD_PLAY:
+            self.set_bar_length(widget, 0)
+
+
+@register_field
+class VolumeBarField(BaseBarField):
+    """The mixer volume, as a horizontal bar."""
+    base_name = 'volbar'
+    target_hooks = ['volume']
+
+    def hook_changed(self, hook_name, widget, new_data):
+        if hook_name == 'volume':
+            self.set_bar_length(widget, self.pixels * max(new_data, 0) // 100)
+
+
+class WidgetGroup(object):
+    """The widgets of a field drawn with several LCDd widgets.
+
+    Attributes:
+        widgets (list): the widgets, from left to right
+    """
+
+    def __init__(self, widgets):
+        self.widgets = widgets
+
+    @property
+    def ref(self):
+        return self.widgets[0].ref
+
+
+def iter_widgets(widget):
+    """The LCDd widgets behind the widget of a field."""
+    if isinstance(widget, WidgetGroup):
+        return list(widget.widgets)
+    return [widget]
+
+
+@register_field
+class SpectrumField(Field):
+    """A spectrum analyzer, with a vertical bar per frequency band.
+
+    Each bar has its own WriteThrottle, applying the field's write options.
+
+    Attributes:
+        bands (int): the number of bands, which is also the width
+        frame_interval (float): the delay between two frames, in seconds
+        throttles (WriteThrottle list): the throttle of each bar
+    """
+    base_name = 'spectrum'
+    target_hooks = ['state', 'audio']
+    write_priority = WRITE_PRIORITY_LOW
+
+    DEFAULT_CELL_HEIGHT = 8
+
+    def __init__(self, bands=8, rate=10, **kwargs):
+        self.bands = int(bands)
+        self.frame_interval = 1.0 / float(rate)
+        self.cell_height = self.DEFAULT_CELL_HEIGHT
+        super(SpectrumField, self).__init__(width=self.bands, **kwargs)
+        self.throttles = [WriteThrottle(**self.write_options) for _band in range(self.bands)]
+
+    def add_to_screen(self, screen, left, top):
+        self.cell_height = screen.server.server_info.get('cell_height', self.DEFAULT_CELL_HEIGHT)
+        return WidgetGroup([
+            screen.add_vbar_widget('%s_%d' % (self.name, index), x=left + index, y=top, length=0)
+            for index in range(self.bands)
+        ])
+
+    def hook_changed(self, hook_name, widget, new_data):
+        if hook_name == 'audio':
+            levels = new_data.bands(self.bands) if new_data is not None else [0.0] * self.bands
+            self.set_levels(widget, levels)
+        super(SpectrumField, self).hook_changed(hook_name, widget, new_data)
+
+    def state_changed(self, widget, new_state):
+        # Frames stop with playback.
+        if new_state != MPD_PLAY:
+            self.set_levels(widget, [0.0] * self.bands)
+
+    def set_levels(self, widget, levels):
+        for bar, throttle, level in zip(widget.widgets, self.throttles, levels):
+            # Bars are only written when their length in pixels changes.
+            length = int(round(level * self.cell_height))
+            self.write(bar, bar.set_length, length, length, throttle=throttle)
+
+    def flush(self, widget):
+        for bar, throttle in zip(widget.widgets, self.throttles):
+            super(SpectrumField, self).flush(bar, throttle)
 
 
 @register_field
 class BitRateField(Field):
     base_name = 'bitrate'
     target_hooks = ['status']
+    write_priority = WRITE_PRIORITY_LOW
 
     def _format_bitrate(self, bitrate=0):
         bitrate = int(bitrate)
@@ -298,15 +607,15 @@ class BitRateField(Field):
         super(BitRateField, self).hook_changed(hook_name, widget, new_data)
 
     def status_changed(self, widget, new_status):
-        txt = self._format_bitrate(new_status.get('bitrate') or 0)
-        logger.debug("Setting widget %r to %r", widget.ref, txt)
-        widget.set_text(txt)
+        bitrate = int(new_status.get('bitrate') or 0)
+        self.set_widget_text(widget, self._format_bitrate(bitrate), bitrate)
 
 
 @register_field
 class SamplingField(Field):
     base_name = 'sampling'
     target_hooks = ['status']
+    write_priority = WRITE_PRIORITY_LOW
 
     def _format_sampling(self, sampling='44100:16:2'):
         rate = sampling.split(':')[0]
@@ -326,14 +635,186 @@ class SamplingField(Field):
 
     def status_changed(self, widget, new_status):
         txt = self._format_sampling(new_status.get('audio') or '0:0:0')
-        logger.debug("Setting widget %r to %r", widget.ref, txt)
-        widget.set_text(txt)
+        self.set_widget_text(widget, txt)
+
+
+@register_field
+class VolumeField(Field):
+    """The mixer volume, e.g `` 75%``; empty without a mixer."""
+    base_name = 'volume'
+    target_hooks = ['volume']
+
+    def _format_volume(self, volume=100):
+        if volume < 0:
+            return ''
+        return '%3d%%' % volume
+
+    def __init__(self, **kwargs):
+        width = len(self._format_volume())
+        super(VolumeField, self).__init__(width=width, **kwargs)
+
+    def add_to_screen(self, screen, left, top):
+        return screen.add_string_widget(self.name, ' ' * self.width, x=left, y=top)
+
+    def hook_changed(self, hook_name, widget, new_data):
+        if hook_name == 'volume':
+            self.set_widget_text(widget, self._format_volume(new_data).rjust(self.width), new_data)
+
+
+@register_field
+class StatsField(Field):
+    """A statistic of the MPD database, e.g the number of songs.
+
+    Attributes:
+        key (str): the statistic, one of KEYS
+    """
+    base_name = 'stats'
+    target_hooks = ['stats']
+    write_priority = WRITE_PRIORITY_LOW
+
+    KEYS = ('songs', 'albums', 'artists', 'db_playtime')
+    DEFAULT_WIDTH = 6
+
+    def __init__(self, key='songs', width=DEFAULT_WIDTH, **kwargs):
+        if key not in self.KEYS:
+            raise ValueError("Unknown stats key %r (available: %s)" % (key, ', '.join(self.KEYS)))
+        self.key = key
+        super(StatsField, self).__init__(width=int(width), **kwargs)
+
+    def _format_stat(self, value):
+        if value is None:
+            return ''
+        if self.key == 'db_playtime':
+            # In hours
+            return '%dh' % (int(value) // 3600)
+        return '%d' % int(value)
+
+    def add_to_screen(self, screen, left, top):
+        return screen.add_string_widget(self.name, ' ' * self.width, x=left, y=top)
+
+    def register_hooks(self):
+        yield 'stats', set([self.key])
+
+    def hook_changed(self, hook_name, widget, new_data):
+        if hook_name == 'stats':
+            txt = self._format_stat(new_data.get(self.key))
+            self.set_widget_text(widget, txt.rjust(self.width)[-self.width:])
+
+
+@register_field
+class RatingField(Field):
+    """The rating of the current song, as stars, e.g ``***..``.
+
+    Ratings are read from MPD's "rating" song sticker; empty for unrated songs.
+
+    Attributes:
+        scale (int): the highest rating, displayed as ``width`` full stars
+    """
+    base_name = 'rating'
+    target_hooks = ['rating']
+
+    DEFAULT_WIDTH = 5
+    DEFAULT_SCALE = 10
+    STAR = '*'
+    NO_STAR = '.'
+
+    def __init__(self, scale=DEFAULT_SCALE, width=DEFAULT_WIDTH, **kwargs):
+        self.scale = int(scale)
+        super(RatingField, self).__init__(width=int(width), **kwargs)
+
+    def _parse_rating(self, rating):
+        """The numeric value of a rating; None when unrated or not a (finite) number."""
+        if rating is None:
+            return None
+        try:
+            value = float(rating)
+        except ValueError:
+            return None
+        return value if math.isfinite(value) else None
+
+    def _format_rating(self, rating, value):
+        if rating is None:
+            return ''
+        if value is None:
+            # Not a number: display as is.
+            return rating[:self.width]
+        stars = int(round(min(max(value, 0), self.scale) * self.width / self.scale))
+        return self.STAR * stars + self.NO_STAR * (self.width - stars)
+
+    def add_to_screen(self, screen, left, top):
+        return screen.add_string_widget(self.name, ' ' * self.width, x=left, y=top)
+
+    def hook_changed(self, hook_name, widget, new_data):
+        if hook_name == 'rating':
+            value = self._parse_rating(new_data)
+            self.set_widget_text(widget, self._format_rating(new_data, value).ljust(self.width), value)
+
+
+@register_field
+class ClockField(Field):
+    """The current time, formatted with strftime().
+
+    Texts are padded or truncated to the width of the field; by default, that
+    is the longest text over a year, as names of days, months or AM/PM vary
+    in length.
+
+    Attributes:
+        format (str): the strftime() format
+        resolution (int): how often the text may change, in seconds
+    """
+    base_name = 'clock'
+    target_hooks = ['clock']
+    write_priority = WRITE_PRIORITY_HIGH
+
+    DEFAULT_FORMAT = '%H:%M'
+    # Directives which change every second.
+    SECONDS_DIRECTIVES = ('%S', '%T', '%X', '%c', '%r', '%s')
+
+    def __init__(self, format=None, width=None, **kwargs):
+        self.format = format or self.DEFAULT_FORMAT
+        if any(directive in self.format for directive in self.SECONDS_DIRECTIVES):
+            self.resolution = 1
+        else:
+            self.resolution = 60
+        width = self._max_width() if width is None else int(width)
+        super(ClockField, self).__init__(width=width, **kwargs)
+
+    def _max_width(self):
+        """The length of the longest text, over every day of a (leap) year, morning and afternoon."""
+        return max(
+            len(time.strftime(self.format, time.localtime(time.mktime((2024, 1, 1 + day, hour, 0, 0, 0, 0, -1)))))
+            for day in range(366)
+            for hour in (0, 12)
+        )
+
+    def _format_time(self, when):
+        return time.strftime(self.format, time.localtime(when))[:self.width].ljust(self.width)
+
+    def add_to_screen(self, screen, left, top):
+        return screen.add_string_widget(self.name, self._format_time(self.clock.time()), x=left, y=top)
+
+    def register_hooks(self):
+        """Override: register the format as a subhook of the 'clock' hook."""
+        yield 'clock', set([self.format])
+
+    def hook_changed(self, hook_name, widget, new_data):
+        if hook_name == 'clock':
+            self.set_widget_text(widget, self._format_time(new_data))
+
+
+@register_field
+class DateField(ClockField):
+    base_name = 'date'
+    write_priority = WRITE_PRIORITY_LOW
+
+    DEFAULT_FORMAT = '%a %d %b'
 
 
 @register_field
 class SongField(Field):
     base_name = 'song'
     target_hooks = ['song']
+    write_priority = WRITE_PRIORITY_LOW
 
     SCROLL_CONTINUOUS = 'c'
     SCROLL_BOUNCE = 'b'
@@ -377,5 +858,62 @@ class SongField(Field):
         if len(txt) > self.width and self.scroll == self.SCROLL_CONTINUOUS:
             txt = txt.strip() + self.padding
 
-        logger.debug('Setting widget %s to %r', widget.ref, txt)
         self.set_widget_text(widget, txt)
+
+
+@register_field
+class NextSongField(SongField):
+    """An upcoming song of the queue, as a scrolling text.
+
+    Attributes:
+        pos (int): which upcoming song to display; 1 for the next one
+    """
+    base_name = 'next'
+    target_hooks = ['queue']
+
+    DEFAULT_FORMAT = '%(artist)s - %(title)s'
+
+    def __init__(self, format='', pos=1, **kwargs):
+        self.pos = int(pos)
+        super(NextSongField, self).__init__(format=format or self.DEFAULT_FORMAT, **kwargs)
+
+    def register_hooks(self):
+        """Override: only watch the displayed song of the 'queue' hook."""
+        yield 'queue', set(['next:%d' % self.pos])
+
+    def hook_changed(self, hook_name, widget, new_data):
+        if hook_name == 'queue':
+            upcoming = new_data.upcoming
+            self.song_changed(widget, upcoming[self.pos - 1] if self.pos <= len(upcoming) else None)
+
+
+@register_field
+class QueueField(Field):
+    """The position of the current song in the queue, e.g ``12/3400``."""
+    base_name = 'queue'
+    target_hooks = ['queue']
+    write_priority = WRITE_PRIORITY_LOW
+
+    DEFAULT_WIDTH = 9
+
+    def __init__(self, width=DEFAULT_WIDTH, **kwargs):
+        super(QueueField, self).__init__(width=int(width), **kwargs)
+
+    def add_to_screen(self, screen, left, top):
+        return screen.add_string_widget(self.name, ' ' * self.width, x=left, y=top)
+
+    def register_hooks(self):
+        yield 'queue', set(['queue'])
+
+    def hook_changed(self, hook_name, widget, new_data):
+        if hook_name == 'queue':
+            self.queue_changed(widget, new_data.position, new_data.length)
+
+    def queue_changed(self, widget, position, length):
+        if not length:
+            txt = ''
+        elif position is None:
+            txt = '-/%d' % length
+        else:
+            txt = '%d/%d' % (position + 1, length)
+        self.set_widget_text(widget, txt.rjust(self.width)[-self.width:])
@@ -156,6 +156,12 @@ class ScreenPattern(object):
             widget = self.widgets[field]
             field.hook_changed(hook, widget, new_data)
 
+    def flush(self):
+        """Perform delayed widget writes whose delay expired."""
+        for field, widget in self.widgets.items():
+            if widget is not None:
+                field.flush(widget)
+
     def active_hooks(self):
         """Retrieve the list of active hooks."""
         return self.subhooks.items()
@@ -173,6 +179,10 @@ class ScreenPattern(object):
         Example:
             '''{song text="%(artist)s",speed=4} {elapsed}'''
             '''{song text="%(title)s",speed=2} {mode}'''
+            '''{bitrate deadband=16,min_interval=5}'''
+
+        Options are passed as keyword arguments to the field; see
+        mpdlcd.display_fields.Field for options common to all fields.
 
         Args:
             line (str): the text to parse
@@ -490,6 +500,6 @@ class ScreenPatternList(object):
                 pattern = self.min_patterns[shorter]
 
                 # Try to vertically center the pattern
-                prefix = [''] * (key - shorter / 2)
+                prefix = [''] * ((key - shorter) // 2)
                 return ScreenPattern(prefix + pattern, self.field_registry)
         return ScreenPattern([], self.field_registry)
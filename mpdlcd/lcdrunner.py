@@ -1,28 +1,477 @@
 # -*- coding: utf-8 -*-
 # Copyright (c) 2011-2013 Raphaël Barrois
 
+import collections
+import contextlib
+import itertools
 import logging
+import socket
+import telnetlib
 import time
+import urllib.parse
 
 from .vendor.lcdproc import server
+from .vendor.lcdproc import widgets as lcd_widgets
 
 from . import display_fields
 from . import enums
+from . import metrics
+from . import mpdwrapper
+from . import timing
+from . import trace
 from . import utils
 
 
 logger = logging.getLogger(__name__)
 
 
+class CommandQueue(object):
+    """Priority queue of pending widget updates.
+
+    Updates are keyed by target widget: a new update for a widget replaces the
+    queued one, keeping its place in the queue.
+
+    Attributes:
+        pending (dict((str, str) => (int, int, str))): maps a (screen, widget)
+            key to a (priority, sequence, command) tuple.
+    """
+
+    def __init__(self):
+        self.pending = {}
+        self._sequence = itertools.count()
+
+    def __len__(self):
+        return len(self.pending)
+
+    def push(self, key, priority, command):
+        """Queue a command, merging it with a pending one for the same key."""
+        if key in self.pending:
+            priority = min(priority, self.pending[key][0])
+            sequence = self.pending[key][1]
+        else:
+            sequence = next(self._sequence)
+        self.pending[key] = (priority, sequence, command)
+
+    def pop(self):
+        """Remove and return the most urgent command."""
+        key = min(self.pending, key=lambda k: self.pending[k][:2])
+        return self.pending.pop(key)[2]
+
+
+# LCDd types of the vendored widget classes, to restore them.
+WIDGET_TYPES = {
+    lcd_widgets.StringWidget: 'string',
+    lcd_widgets.TitleWidget: 'title',
+    lcd_widgets.HBarWidget: 'hbar',
+    lcd_widgets.VBarWidget: 'vbar',
+    lcd_widgets.IconWidget: 'icon',
+    lcd_widgets.ScrollerWidget: 'scroller',
+    lcd_widgets.FrameWidget: 'frame',
+    lcd_widgets.NumberWidget: 'num',
+}
+
+# Screen attributes restored on reconnection: (attribute, option, multiplier)
+SCREEN_SETTINGS = [
+    ('priority', 'priority', None),
+    ('heartbeat', 'heartbeat', None),
+    ('backlight', 'backlight', None),
+    ('cursor', 'cursor', None),
+    ('cursor_x', 'cursor_x', None),
+    ('cursor_y', 'cursor_y', None),
+    ('width', 'wid', None),
+    ('height', 'hgt', None),
+    ('duration', 'duration', 8),
+    ('timeout', 'timeout', 8),
+]
+
+
 class LcdProcServer(server.Server):
-    def __init__(self, hostname, port, **kwargs):
-        super(LcdProcServer, self).__init__(hostname, port, **kwargs)
+    """A lcdproc server, with optional limiting of the command rate.
+
+    When a ``command_rate`` is set, ``widget_set`` commands go through a
+    CommandQueue, and are sent by flush() within a token-bucket budget, most
+    urgent widgets first.
+    Other commands are sent right away, but still count against the budget.
+
+    Within a batch() block, commands are sent at once at the end of the block,
+    without waiting for each reply.
+
+    Attributes:
+        bucket (mpdlcd.utils.TokenBucket): the command budget, or None
+        queue (CommandQueue): queued widget updates
+        widget_priorities (dict((str, str) => int)): the priority of each
+            (screen, widget) pair; lower is more urgent.
+        tracer (mpdlcd.trace.TraceWriter): where to record the traffic, if set
+        timeouts (mpdlcd.utils.TimeoutConfig): I/O timeouts; socket.timeout
+            is raised when one expires.
+        events (deque): notifications sent by LCDd on its own (key presses,
+            menu events...), until read by poll_events()
+    """
+
+    DEFAULT_PRIORITY = display_fields.WRITE_PRIORITY_NORMAL
+    # Older notifications are dropped.
+    MAX_EVENTS = 64
+
+    def __init__(
+            self, hostname, port, command_rate=0, command_burst=1, tracer=None, clock=None, timeouts=None,
+            **kwargs):
+        self.timeouts = timeouts or utils.TimeoutConfig()
+        super(LcdProcServer, self).__init__(hostname, port, timeout=self.timeouts.connect_timeout, **kwargs)
+        self.tn.sock.settimeout(self.timeouts.read_timeout)
+        self.tracer = tracer
+        self.bucket = None
+        if command_rate:
+            self.bucket = utils.TokenBucket(command_rate, command_burst, clock=clock or timing.MONOTONIC)
+        self.queue = CommandQueue()
+        self.widget_priorities = {}
+        self.events = collections.deque(maxlen=self.MAX_EVENTS)
+        self._partial = b''
+        self._batch = None
+
+    def reconnect(self):
+        """Open a new session, and restore all screens and widgets in one batch."""
+        try:
+            self.tn.close()
+        except socket.error:
+            pass
+        self.tn = telnetlib.Telnet(self.hostname, self.port, self.timeouts.connect_timeout)
+        self.tn.sock.settimeout(self.timeouts.read_timeout)
+        self.events.clear()
+        self._partial = b''
+        # Widgets hold their latest values: queued updates are part of the restore.
+        self.queue = CommandQueue()
+        response = self.start_session()
+        with self.batch():
+            for screen in self.screens.values():
+                self._restore_screen(screen)
+        return response
+
+    def _restore_screen(self, screen):
+        self.request('screen_add %s' % screen.ref)
+        options = []
+        if screen.name != screen.ref:
+            options.append('-name %s' % screen.name)
+        for attribute, option, multiplier in SCREEN_SETTINGS:
+            value = getattr(screen, attribute)
+            if value is not None:
+                options.append('-%s %s' % (option, value * multiplier if multiplier else value))
+        if options:
+            self.request('screen_set %s %s' % (screen.ref, ' '.join(options)))
+
+        for widget in screen.widgets.values():
+            self.request('widget_add %s %s %s' % (screen.ref, widget.ref, WIDGET_TYPES[type(widget)]))
+            widget.update()
+
+    @contextlib.contextmanager
+    def batch(self):
+        """Pipeline the commands sent within the block.
+
+        Commands are written at once when the block exits, then all replies are
+        read; errors are logged, as there is no caller to return them to.
+        """
+        if self._batch is not None:
+            # Nested: the outer block sends everything.
+            yield
+            return
+
+        self._batch = []
+        try:
+            yield
+            commands = self._batch
+        finally:
+            self._batch = None
+        if commands:
+            self._send_batch(commands)
+
+    def _widget_key(self, command_string):
+        """The (screen, widget) pair of a widget_set command."""
+        return tuple(command_string.split(' ', 3)[1:3])
+
+    def _send_batch(self, commands):
+        metrics.ROUNDTRIPS.labels('lcdproc').inc()
+        for command in commands:
+            if command.startswith('widget_set '):
+                # Older queued values would overwrite the batched one.
+                self.queue.pending.pop(self._widget_key(command), None)
+        if self.bucket is not None:
+            self.bucket.force(len(commands))
+        if self.tracer is not None:
+            for command in commands:
+                self.tracer.record(trace.KIND_LCD_SEND, command)
+        payload = ''.join('%s\n' % command for command in commands)
+        self.tn.write(self.encode(payload))
+        metrics.BYTES.labels('lcdproc', 'sent').inc(len(payload))
+
+        deadline = self.timeouts.deadline()
+        for command in commands:
+            response = self._read_reply(deadline)
+            if "huh" in response:
+                logger.warning('lcdproc rejected %r: %s', command, response.strip())
+
+    def set_widget_priority(self, screen_ref, widget_ref, priority):
+        self.widget_priorities[(screen_ref, widget_ref)] = priority
+
+    def forget_widget(self, screen_ref, widget_ref):
+        """Drop the priority and queued update of a removed widget."""
+        key = (screen_ref, widget_ref)
+        self.widget_priorities.pop(key, None)
+        self.queue.pending.pop(key, None)
+
+    def request(self, command_string):
+        if self._batch is not None:
+            self._batch.append(command_string)
+            return 'success\n'
+
+        if self.bucket is None:
+            return self._request(command_string)
+
+        if command_string.startswith('widget_set '):
+            key = self._widget_key(command_string)
+            priority = self.widget_priorities.get(key, self.DEFAULT_PRIORITY)
+            self.queue.push(key, priority, command_string)
+            return 'success\n'
+
+        self.bucket.force()
+        return self._request(command_string)
+
+    def _request(self, command_string):
+        metrics.ROUNDTRIPS.labels('lcdproc').inc()
+        self.send(command_string)
+        logger.debug('lcdproc request: %r', command_string)
+
+        response = self._read_reply(self.timeouts.deadline())
+        logger.debug('lcdproc response: %r', response.rstrip('\n'))
+        if "huh" in response:
+            logger.warning('lcdproc rejected %r: %s', command_string, response.strip())
+        return response
+
+    def _read_reply(self, deadline):
+        """Read the reply to a command, keeping key, menu or visibility notifications for later."""
+        while True:
+            response = self._read_line(deadline)
+            if "success" in response or "huh" in response or "connect" in response:
+                break
+            self.events.append(response.rstrip('\n'))
+        metrics.BYTES.labels('lcdproc', 'received').inc(len(response))
+        if self.tracer is not None:
+            self.tracer.record(trace.KIND_LCD_RECV, response)
+        return response
+
+    def _read_line(self, deadline):
+        """Read a line from the server, within the read and request timeouts."""
+        timeout = self.timeouts.line_timeout(deadline)
+        line = self._partial + self.tn.read_until(b"\n", timeout)
+        self._partial = b''
+        if not line.endswith(b"\n"):
+            if timeout is None:
+                raise EOFError('Connection closed by lcdproc')
+            raise socket.timeout('No reply from lcdproc within %.1fs' % timeout)
+        return urllib.parse.unquote(line.decode())
+
+    def poll_events(self):
+        """Read the notifications received so far, without blocking.
+
+        Returns:
+            str list: the notifications, oldest first
+        """
+        while True:
+            # Returns what has been received, even without a newline.
+            data = self.tn.read_until(b"\n", 0)
+            if not data:
+                break
+            self._partial += data
+            if not self._partial.endswith(b"\n"):
+                break
+            line, self._partial = self._partial, b''
+            self.events.append(urllib.parse.unquote(line.decode()).rstrip('\n'))
+        events = list(self.events)
+        self.events.clear()
+        return events
+
+    def send(self, command):
+        if self.tracer is not None:
+            self.tracer.record(trace.KIND_LCD_SEND, command)
+        super(LcdProcServer, self).send(command)
+        metrics.BYTES.labels('lcdproc', 'sent').inc(len(command) + 1)
+
+    def flush(self):
+        """Send queued widget updates, as allowed by the command budget."""
+        while self.queue and self.bucket.consume():
+            self._request(self.queue.pop())
+        if self.queue:
+            logger.debug('%d widget updates left queued', len(self.queue))
+
+    def flush_delay(self):
+        """Time until queued widget updates may be sent; None if nothing is queued."""
+        if not self.queue:
+            return None
+        return self.bucket.delay()
+
+
+class ScreenView(object):
+    """A LCDd screen displaying a pattern.
+
+    Hook changes are only applied while the view is displayed; the others are
+    applied, with their latest data, before it gets displayed again.
+
+    Attributes:
+        screen (lcdproc.screen.Screen): the screen
+        pattern (mpdlcd.display_pattern.ScreenPattern): the displayed pattern
+        stale (str set): hooks whose latest change wasn't applied
+    """
+
+    def __init__(self, screen, pattern):
+        self.screen = screen
+        self.pattern = pattern
+        self.stale = set()
+
+    def refresh(self, hook_data):
+        """Apply the stale hooks.
+
+        Args:
+            hook_data (dict(str => object)): latest data of each hook
+        """
+        for hook_name, new_data in hook_data.items():
+            if hook_name in self.stale:
+                self.pattern.hook_changed(hook_name, new_data)
+        self.stale.clear()
+
+
+# MPD options announced in overlays
+OVERLAY_OPTIONS = ['random', 'repeat', 'single', 'consume']
+
+
+def status_notifications(previous, status):
+    """Describe the changes between two MPD statuses worth a notification.
+
+    Args:
+        previous (dict): the previous status, or None
+        status (dict): the new status
+
+    Returns:
+        str list: the notifications
+    """
+    if previous is None:
+        return []
+
+    notifications = []
+    volume = status.get('volume')
+    if volume != previous.get('volume') and volume not in (None, '-1'):
+        notifications.append('Volume: %s%%' % volume)
+    for option in OVERLAY_OPTIONS:
+        value = status.get(option)
+        if value != previous.get(option) and value is not None:
+            notifications.append('%s: %s' % (option.capitalize(), 'on' if str(value) == '1' else 'off'))
+    error = status.get('error')
+    if error and error != previous.get('error'):
+        notifications.append('Error: %s' % error)
+    return notifications
+
+
+class Overlay(object):
+    """A screen displaying short notifications over the others.
+
+    The screen is shown at 'alert' priority, with a LCDd-side timeout: LCDd
+    removes it once expired, without any command from us. Notifications
+    shown while it is still displayed only change its text.
+
+    The screen isn't registered in LcdProcServer.screens, so that it isn't
+    restored on reconnection.
+
+    Attributes:
+        ref (str): the ref of the screen
+        duration (float): how long each notification is displayed
+        expires (float): when LCDd removes the screen, or None if it doesn't exist
+    """
+
+    WIDGET = 'text'
+    # Create a new screen if the current one may be gone by the time LCDd
+    # receives the commands.
+    EXPIRY_MARGIN = 0.5
+
+    def __init__(self, lcd, ref, duration, clock=None):
+        self.lcd = lcd
+        self.ref = ref
+        self.duration = duration
+        self.clock = clock or timing.MONOTONIC
+        self.expires = None
+
+    def reset(self):
+        """Forget the screen, e.g after reconnecting to LCDd."""
+        self.expires = None
+
+    def show(self, text):
+        """Display a notification; costs 2 commands if the screen is displayed, 4 otherwise."""
+        width = self.lcd.server_info['screen_width']
+        line = (self.lcd.server_info['screen_height'] + 1) // 2
+        timeout = '-timeout %d' % int(self.duration * 8)
+        now = self.clock.now()
+        logger.debug('Displaying overlay %r', text)
+        with self.lcd.batch():
+            if self.expires is None or now >= self.expires - self.EXPIRY_MARGIN:
+                self.lcd.request('screen_add %s' % self.ref)
+                self.lcd.request('screen_set %s -priority alert -heartbeat off %s' % (self.ref, timeout))
+                self.lcd.request('widget_add %s %s scroller' % (self.ref, self.WIDGET))
+            else:
+                self.lcd.request('screen_set %s %s' % (self.ref, timeout))
+            self.lcd.request('widget_set %s %s 1 %d %d %d m 2 "%s"' % (
+                self.ref, self.WIDGET, line, width, line, text.replace('"', "'").center(width)))
+        self.expires = now + self.duration
+
+    def remove(self):
+        """Remove the screen, if still displayed."""
+        if self.expires is not None and self.clock.now() < self.expires:
+            self.lcd.request('screen_del %s' % self.ref)
+        self.expires = None
 
 
 class MpdRunner(utils.AutoRetryCandidate):
+    """Update the LCD screen from the MPD state.
+
+    Updates never wait for a server: while MPD is unreachable, an "offline"
+    screen is displayed; a lost LCDd connection is re-established (and the
+    screens restored) on a later update.
+
+    Player states may get their own pattern, each on its own screen: only the
+    screen of the current state is visible, and updated.
+
+    Attributes:
+        offline (bool): whether MPD is currently unreachable
+        lcd_connection (mpdlcd.utils.ConnectionState): the state of the
+            connection to LCDd
+        screen (lcdproc.screen.Screen): the main screen
+        pattern (mpdlcd.display_pattern.ScreenPattern): the pattern of the
+            main screen
+        state_views (dict(str => ScreenView)): the views of player states with
+            their own pattern
+        view (ScreenView): the displayed view
+        overlay (Overlay): displays changes of volume, options and MPD
+            errors, if enabled
+        idle_events (bool): while MPD is stopped, wait for its events between
+            updates instead of sleeping
+        power_save_after (float): enter power-save mode after that many
+            seconds without activity, 0 to never enter it
+        power_saving (bool): whether the display is parked in power-save mode
+        browser (mpdlcd.browser.LibraryBrowser): browses the MPD library from
+            the LCDd menu, if enabled
+    """
+
+    OFFLINE_TEXT = "MPD offline"
+    # While stopped, wake up on these boundaries, unless a clock field needs more.
+    IDLE_RESOLUTION = 60
+    # Wake up a bit after the boundary, for the clock to have changed.
+    IDLE_MARGIN = 0.01
+    # In power-save mode, look for activity this often, unless woken up by MPD.
+    POWER_SAVE_POLL = 300
+    # Status fields whose change is activity; playing also counts as such.
+    ACTIVITY_KEYS = ('state', 'volume', 'repeat', 'random', 'single', 'consume', 'songid', 'playlist', 'error')
+
+    _lcd_errors = (socket.error, EOFError)
+
     def __init__(
             self, client, lcd, lcdproc_screen, refresh_rate,
-            backlight_on, priority_playing, priority_not_playing, *args, **kwargs):
+            backlight_on, priority_playing, priority_not_playing, profiler=None, tracer=None, overlay_duration=0,
+            idle_events=False, power_save_after=0, browser=None, *args, **kwargs):
         super(MpdRunner, self).__init__(logger=logger, *args, **kwargs)
 
         self.lcd = lcd
@@ -31,18 +480,48 @@ class MpdRunner(utils.AutoRetryCandidate):
         self.priority_playing = priority_playing
         self.priority_not_playing = priority_not_playing
         self.refresh_rate = refresh_rate
+        self.idle_events = idle_events
+        # Whether MPD events were waited for since the last update.
+        self._events_collected = False
+        self.power_save_after = power_save_after
+        self.browser = browser
+        self.profiler = profiler
+        self.tracer = tracer
+        self.lcd_connection = utils.ConnectionState(self._retry_config, name='lcdproc', clock=self._clock)
 
         # Make sure we can connect - no need to go further otherwise.
         self._connect_lcd()
+        self.lcd_connection.succeeded()
         self.pattern = None
-        self.screen = self.setup_screen(self.lcdproc_screen)
+        with self.lcd.batch():
+            self.screen = self.setup_screen(self.lcdproc_screen)
+            self.offline_screen = self.setup_offline_screen()
+            if self.browser is not None:
+                self.browser.setup()
+        self.offline = False
+        self._online_priority = None
+        self.overlay = None
+        if overlay_duration:
+            self.overlay = Overlay(lcd, '%s_overlay' % lcdproc_screen, overlay_duration, clock=self._clock)
+        self._last_status = None
+        self.power_saving = False
+        self._activity_key = None
+        self._last_activity = None
+        self._saved_backlight = None
+        self.main_view = None
+        self.state_views = {}
+        self.view = None
+        self.hook_data = collections.OrderedDict()
         self.hooks = {}
         self.subhooks = {}
         self.client = client
+        self.running = False
 
     @utils.auto_retry
     def _connect_lcd(self):
-        self.lcd.start_session()
+        # The session may have been started while connecting.
+        if not self.lcd.server_info:
+            self.lcd.start_session()
 
     def setup_screen(self, screen_name):
         logger.debug('Adding lcdproc screen %s', screen_name)
@@ -60,12 +539,46 @@ class MpdRunner(utils.AutoRetryCandidate):
         logger.info('%s screen added to lcdproc.', screen_name)
         return screen
 
-    def add_pseudo_fields(self):
-        """Add 'pseudo' fields (e.g non-displayed fields) to the display."""
+    def setup_offline_screen(self):
+        """Add the (hidden) screen displayed while MPD is unreachable."""
+        screen = self.lcd.add_screen('%s_offline' % self.lcdproc_screen)
+        screen.set_heartbeat('off')
+        screen.set_priority('hidden')
+
+        width = self.lcd.server_info['screen_width']
+        height = self.lcd.server_info['screen_height']
+        text = self.OFFLINE_TEXT.center(width)[:width]
+        screen.add_string_widget('message', text, x=1, y=(height + 1) // 2)
+        return screen
+
+    def set_offline(self, offline):
+        """Switch between the main screen and the offline screen."""
+        if offline == self.offline:
+            return
+        self.offline = offline
+        screen = self.view.screen if self.view is not None else self.screen
+        if offline:
+            self._online_priority = screen.priority
+            self.offline_screen.set_priority(self.priority_not_playing)
+            screen.set_priority('hidden')
+        else:
+            self.offline_screen.set_priority('hidden')
+            screen.set_priority(self._online_priority)
+
+    def add_pseudo_fields(self, pattern=None, screen=None):
+        """Add 'pseudo' fields (e.g non-displayed fields) to the display.
+
+        Args:
+            pattern (mpdlcd.display_pattern.ScreenPattern): the target pattern,
+                defaults to the main pattern
+            screen (lcdproc.screen.Screen): the screen of the pattern
+        """
+        pattern = pattern or self.pattern
+        screen = screen or self.screen
         fields = []
         if self.backlight_on != enums.BACKLIGHT_ON_NEVER:
             fields.append(
-                display_fields.BacklightPseudoField(ref='0', backlight_rule=self.backlight_on)
+                display_fields.BacklightPseudoField(ref='0', backlight_rule=self.backlight_on, clock=self._clock)
             )
 
         fields.append(
@@ -73,42 +586,395 @@ class MpdRunner(utils.AutoRetryCandidate):
                 ref='0',
                 priority_playing=self.priority_playing,
                 priority_not_playing=self.priority_not_playing,
+                clock=self._clock,
             )
         )
 
-        self.pattern.add_pseudo_fields(fields, self.screen)
+        pattern.add_pseudo_fields(fields, screen)
+
+    def _setup_view(self, screen, patterns):
+        pattern = patterns[screen.height]
+        pattern.parse()
+        self.add_pseudo_fields(pattern, screen)
+        pattern.add_to_screen(screen.width, screen)
+        return ScreenView(screen, pattern)
+
+    def setup_pattern(self, patterns, hook_registry, state_patterns=None):
+        """Set up the displayed patterns.
 
-    def setup_pattern(self, patterns, hook_registry):
-        self.pattern = patterns[self.screen.height]
-        self.pattern.parse()
-        self.add_pseudo_fields()
-        self.pattern.add_to_screen(self.screen.width, self.screen)
+        Args:
+            patterns (mpdlcd.display_pattern.ScreenPatternList): the patterns
+                of the main screen
+            hook_registry (mpdlcd.mpdhooks.HookRegistry): creates the hooks
+            state_patterns (dict(str => ScreenPatternList)): patterns for some
+                player states ('play', 'pause' or 'stop'), each displayed on
+                its own screen; other states use the main screen.
+        """
+        with self.lcd.batch():
+            self.main_view = self._setup_view(self.screen, patterns)
+            self.pattern = self.main_view.pattern
+            for state, state_pattern_list in sorted((state_patterns or {}).items()):
+                screen = self.setup_screen('%s_%s' % (self.lcdproc_screen, state))
+                screen.set_priority('hidden')
+                self.state_views[state] = self._setup_view(screen, state_pattern_list)
+        self.view = self.main_view
+        self.hook_data.clear()
+        self.setup_priorities()
         self.setup_hooks(hook_registry)
 
+    @property
+    def views(self):
+        """All views, the main one first."""
+        return [self.main_view] + [self.state_views[state] for state in sorted(self.state_views)]
+
+    def clear_pattern(self):
+        """Remove the widgets and hooks of the current patterns, and the state screens."""
+        if self.pattern is None:
+            return
+        if self.view is not self.main_view and not self.offline:
+            self.screen.set_priority(self.view.screen.priority)
+        for view in self.views:
+            if view.screen is not self.screen:
+                self.lcd.del_screen(view.screen.ref)
+            for field_widget in view.pattern.widgets.values():
+                if field_widget is None:
+                    continue
+                for widget in display_fields.iter_widgets(field_widget):
+                    if view.screen is self.screen:
+                        self.screen.del_widget(widget.ref)
+                    self.lcd.forget_widget(view.screen.ref, widget.ref)
+        self.pattern = None
+        self.main_view = None
+        self.state_views = {}
+        self.view = None
+        self.hooks = {}
+        self.subhooks = {}
+
+    def reload_pattern(self, patterns, hook_registry, state_patterns=None):
+        """Replace the current patterns; all fields are filled again."""
+        logger.info('Reloading screen pattern.')
+        self.clear_pattern()
+        self.setup_pattern(patterns, hook_registry, state_patterns=state_patterns)
+
+    def setup_priorities(self):
+        """Declare the update priority of each widget to the LCD server."""
+        for view in self.views:
+            for field, field_widget in view.pattern.widgets.items():
+                if field_widget is None:
+                    continue
+                for widget in display_fields.iter_widgets(field_widget):
+                    self.lcd.set_widget_priority(view.screen.ref, widget.ref, field.write_priority)
+
     def setup_hooks(self, hook_registry):
-        for hook_name, subhooks in self.pattern.active_hooks():
-            hook = hook_registry.create(hook_name)
-            self.hooks[hook_name] = hook
-            self.subhooks[hook_name] = subhooks
+        for view in self.views:
+            for hook_name, subhooks in view.pattern.active_hooks():
+                if hook_name not in self.hooks:
+                    self.hooks[hook_name] = hook_registry.create(hook_name)
+                    self.subhooks[hook_name] = set()
+                self.subhooks[hook_name] |= subhooks
+
+    def hook_changed(self, hook_name, new_data):
+        """Apply a hook change to the displayed view; a new state may display another view."""
+        self.hook_data[hook_name] = new_data
+        for view in self.views:
+            view.stale.add(hook_name)
+        if hook_name == 'state':
+            self.show_view(self.state_views.get(new_data, self.main_view))
+        self.view.refresh(self.hook_data)
+
+    def show_view(self, view):
+        """Display a view, hiding the current one.
+
+        The view gets its stale hooks applied first; its priority pseudo-field
+        then makes it visible.
+        """
+        if view is self.view:
+            return
+        previous, self.view = self.view, view
+        with self.lcd.batch():
+            view.refresh(self.hook_data)
+            if self.offline:
+                # Shown when MPD comes back.
+                self._online_priority = view.screen.priority
+                view.screen.set_priority('hidden')
+            previous.screen.set_priority('hidden')
+
+    def _reconnect_lcd(self):
+        """Try to reconnect to LCDd, restoring the screens as they were.
+
+        Returns:
+            bool: whether the connection is up again.
+        """
+        if not self.lcd_connection.can_attempt():
+            return False
+        logger.info('Reconnecting to lcdproc')
+        self.lcd_connection.attempting()
+        try:
+            self.lcd.reconnect()
+        except self._lcd_errors as e:
+            logger.warning('Unable to reconnect to lcdproc: %s', e)
+            self.lcd_connection.failed()
+            return False
+        if self.overlay is not None:
+            self.overlay.reset()
+        if self.browser is not None:
+            self.browser.reset()
+        self.lcd_connection.succeeded()
+        return True
 
-    @utils.auto_retry
     def update(self):
-        for hook_name, hook in self.hooks.items():
-            subhooks = self.subhooks[hook_name]
-            updated, new_data = hook.handle(self.client, subhooks)
-            if updated:
-                self.pattern.hook_changed(hook_name, new_data)
+        if self.tracer is not None:
+            self.tracer.tick()
+        if not self.lcd_connection.connected and not self._reconnect_lcd():
+            return
+
+        start = time.perf_counter()
+        mpd_roundtrips = metrics.ROUNDTRIPS.labels('mpd')
+        lcd_roundtrips = metrics.ROUNDTRIPS.labels('lcdproc')
+        mpd_before, lcd_before = mpd_roundtrips.value, lcd_roundtrips.value
+
+        try:
+            if self.browser is not None:
+                self.update_browser()
+            self._update()
+        except self._lcd_errors as e:
+            logger.warning('Lost connection to lcdproc: %s', e)
+            self.lcd_connection.lost()
+
+        metrics.UPDATE_DURATION.observe(time.perf_counter() - start)
+        metrics.UPDATE_ROUNDTRIPS.labels('mpd').observe(mpd_roundtrips.value - mpd_before)
+        metrics.UPDATE_ROUNDTRIPS.labels('lcdproc').observe(lcd_roundtrips.value - lcd_before)
+
+    def update_browser(self):
+        """Handle key presses and menu events, and redraw the library browser."""
+        for event in self.lcd.poll_events():
+            if not self.browser.handle_event(event):
+                logger.debug('Ignoring LCDd notification %r', event)
+        self.browser.refresh()
+
+    def event_subsystems(self):
+        """Subsystems watched by hooks, whose changes don't show in MPD's status."""
+        subsystems = set()
+        for hook in self.hooks.values():
+            subsystems.update(hook.subsystems)
+        return subsystems - set(self.client.STATUS_SUBSYSTEMS)
+
+    def _update(self):
+        try:
+            if not self._events_collected and self.event_subsystems():
+                # E.g while playing: collect the events MPD queued since the last update.
+                self.client.wait_for_changes(0)
+            self._events_collected = False
+            self.client.fetch_snapshot()
+            changes = self.client.pop_changes()
+            for hook in self.hooks.values():
+                hook.subsystems_changed(changes)
+            if not self.check_activity(self.client.status):
+                return
+            for hook_name, hook in self.hooks.items():
+                subhooks = self.subhooks[hook_name]
+                updated, new_data = hook.handle(self.client, subhooks)
+                if updated:
+                    self.hook_changed(hook_name, new_data)
+            if self.overlay is not None:
+                self.notify(self.client.status)
+        except mpdwrapper.MPDConnectionError as e:
+            if not self.offline:
+                logger.warning('MPD is offline: %s', e)
+            self.set_offline(True)
+        else:
+            self.set_offline(False)
+        self.view.pattern.flush()
+        self.lcd.flush()
+
+    def check_activity(self, status):
+        """Track player activity, entering or leaving power-save mode.
+
+        Returns:
+            bool: whether the display should be updated.
+        """
+        if not self.power_save_after:
+            return True
+        key = tuple(status.get(name) for name in self.ACTIVITY_KEYS)
+        now = self._clock.now()
+        if key != self._activity_key or status.get('state') == display_fields.MPD_PLAY:
+            self._activity_key = key
+            self._last_activity = now
+            if self.power_saving:
+                self.resume()
+        elif not self.power_saving and now - self._last_activity >= self.power_save_after:
+            self.power_save()
+        return not self.power_saving
+
+    def power_save(self):
+        """Park the display: backlight off, lowest visible priority, no more updates."""
+        logger.info('No activity for %ds, entering power-save mode', self.power_save_after)
+        self.power_saving = True
+        screen = self.view.screen
+        self._saved_backlight = screen.backlight
+        with self.lcd.batch():
+            screen.set_backlight('off')
+            screen.set_priority('background')
+
+    def resume(self):
+        """Leave power-save mode; the next update redraws all fields."""
+        logger.info('Activity detected, leaving power-save mode')
+        self.power_saving = False
+        for hook in self.hooks.values():
+            hook.previous_keys.clear()
+        # The pseudo-fields set the priority, and backlight, again.
+        # 'open' leaves the backlight to LCDd.
+        self.view.screen.set_backlight(self._saved_backlight or 'open')
+
+    def notify(self, status):
+        """Display the noteworthy changes of the MPD status in the overlay."""
+        notifications = status_notifications(self._last_status, status)
+        self._last_status = status
+        if notifications:
+            self.overlay.show(', '.join(notifications))
 
     def quit(self):
+        if self.browser is not None:
+            self.browser.loader.close()
         logger.info('Exiting: removing screen %s', self.lcdproc_screen)
-        self.lcd.del_screen(self.lcdproc_screen)
+        if not self.lcd_connection.connected:
+            return
+        try:
+            for view in self.state_views.values():
+                self.lcd.del_screen(view.screen.ref)
+            if self.overlay is not None:
+                self.overlay.remove()
+            self.lcd.del_screen(self.offline_screen.ref)
+            self.lcd.del_screen(self.lcdproc_screen)
+        except self._lcd_errors as e:
+            logger.warning('Unable to remove screens: %s', e)
 
-    def run(self):
+    def stop(self):
+        """Make run() return after the current update."""
+        self.running = False
+
+    def _profiled_update(self):
+        if self.profiler is None:
+            self.update()
+        else:
+            with self.profiler.profiled():
+                self.update()
+
+    def idle_delay(self):
+        """The delay until the displayed clock may change, while stopped."""
+        resolutions = [
+            field.resolution for field in self.view.pattern.widgets
+            if getattr(field, 'resolution', None)
+        ]
+        resolution = min(resolutions + [self.IDLE_RESOLUTION])
+        return resolution - self._clock.time() % resolution + self.IDLE_MARGIN
+
+    def frame_interval(self):
+        """The delay between frames of the animated fields on display, if any."""
+        if self.view is None or self.offline or self.hook_data.get('state') != display_fields.MPD_PLAY:
+            return None
+        intervals = [
+            field.frame_interval for field in self.view.pattern.widgets
+            if getattr(field, 'frame_interval', None)
+        ]
+        return min(intervals) if intervals else None
+
+    def play_frames(self, delay):
+        """Wait for ``delay`` seconds, animating fields meanwhile.
+
+        Frames only fetch local hooks, without querying MPD; frames are
+        dropped when running late.
+        """
+        deadline = self._clock.now() + delay
+        interval = self.frame_interval()
+        if interval is not None:
+            next_frame = self._clock.now() + interval
+            # The update at the deadline also draws a frame.
+            while self.running and next_frame < deadline - interval / 2:
+                self._clock.sleep_until(next_frame)
+                self.update_frame()
+                next_frame += interval
+                late = self._clock.now() - next_frame
+                if late >= 0:
+                    dropped = int(late // interval) + 1
+                    metrics.DROPPED_FRAMES.inc(dropped)
+                    next_frame += dropped * interval
+        self._clock.sleep_until(deadline)
+
+    def update_frame(self):
+        """Apply changes of the local hooks, e.g the audio analysis."""
+        if not self.lcd_connection.connected:
+            return
+        try:
+            for hook_name, hook in self.hooks.items():
+                if hook.local:
+                    updated, new_data = hook.handle(self.client, self.subhooks[hook_name])
+                    if updated:
+                        self.hook_changed(hook_name, new_data)
+            self.lcd.flush()
+        except self._lcd_errors as e:
+            logger.warning('Lost connection to lcdproc: %s', e)
+            self.lcd_connection.lost()
+
+    def wait(self):
+        """Wait until the next update.
+
+        While MPD is stopped, the display only changes with the time of day:
+        wake up on the next minute (or second) boundary, or on a MPD event.
+        In power-save mode, only MPD events (or a long poll) wake us up.
+        Widget updates left queued by the LCDd command budget wake us up once
+        they can be sent.
+        With a library browser, LCDd notifications wake us up as well; key
+        presses are polled for quickly while it is displayed.
+        """
+        if self.browser is not None and self.browser.active:
+            delay = self.browser.POLL_INTERVAL
+        elif self.power_saving:
+            delay = self.POWER_SAVE_POLL
+        elif self.hook_data.get('state') == display_fields.MPD_STOP and not self.offline and self.view is not None:
+            delay = self.idle_delay()
+        else:
+            self.play_frames(self.refresh_rate)
+            return
+
+        # Don't leave widget updates queued until the next event.
+        queued = self.lcd.flush_delay() if self.lcd_connection.connected else None
+        if queued is not None:
+            delay = min(delay, queued)
+
+        if not self.idle_events:
+            self._clock.sleep(delay)
+            return
+        try:
+            wake_on = []
+            if self.browser is not None and self.lcd_connection.connected:
+                wake_on.append(self.lcd.tn.sock)
+            changes = self.client.wait_for_changes(delay, wake_on=wake_on)
+        except mpdwrapper.MPDConnectionError as e:
+            logger.warning('Unable to wait for MPD events: %s', e)
+            self._clock.sleep(self.refresh_rate)
+        else:
+            logger.debug('Woke up on MPD changes: %s', changes)
+            self._events_collected = True
+
+    def run(self, startup=None):
+        """Update the display until stop() is called.
+
+        Args:
+            startup (mpdlcd.timing.StepTimer): the startup steps so far; the
+                first update is added, and the total logged.
+        """
         logger.info('Starting update loop.')
+        self.running = True
         try:
-            while True:
-                self.update()
-                time.sleep(self.refresh_rate)
+            if startup is not None:
+                with startup.step('first frame'):
+                    self._profiled_update()
+                logger.info('Started in %.1fms: %s', startup.elapsed() * 1000, startup.summary())
+                self.wait()
+            while self.running:
+                self._profiled_update()
+                self.wait()
         except (KeyboardInterrupt, SystemExit):
             pass
         except Exception as e:
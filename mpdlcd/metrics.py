@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2011-2013 Raphaël Barrois
+
+"""Lightweight, always-on metrics, exported in the Prometheus text format."""
+
+import bisect
+import collections
+import http.server
+import logging
+import os
+import socketserver
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class MetricError(Exception):
+    pass
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return '%d' % value
+    return repr(value)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (name, str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+        for name, value in labels
+    )
+
+
+class CounterValue(object):
+    """A single counter, for a given set of label values."""
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self, name, labels):
+        yield name, labels, self.value
+
+
+class HistogramValue(object):
+    """A single histogram, for a given set of label values.
+
+    Attributes:
+        buckets (float list): upper bounds of the buckets
+        counts (int list): number of observations per bucket (not cumulative);
+            the last entry holds observations above all bounds.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, name, labels):
+        cumulated = 0
+        for bound, count in zip(list(self.buckets) + [float('inf')], self.counts):
+            cumulated += count
+            yield name + '_bucket', labels + (('le', _format_value(bound)),), cumulated
+        yield name + '_sum', labels, self.sum
+        yield name + '_count', labels, self.count
+
+
+class Metric(object):
+    """A named metric, holding one value per set of label values.
+
+    Values are retrieved through labels(); metrics without labels also provide
+    shortcuts (inc(), observe()).
+    """
+    kind = ''
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def _make_value(self):  # pragma: no cover
+        raise NotImplementedError()
+
+    def labels(self, *values):
+        """Retrieve the value for the given label values."""
+        try:
+            return self._values[values]
+        except KeyError:
+            if len(values) != len(self.labelnames):
+                raise MetricError(
+                    "Metric %s expects labels %s, got %r" % (self.name, ', '.join(self.labelnames), values))
+            with self._lock:
+                return self._values.setdefault(values, self._make_value())
+
+    def samples(self):
+        """Yield (name, ((label, value), ...), value) tuples."""
+        for values, value in list(self._values.items()):
+            labels = tuple(zip(self.labelnames, values))
+            for sample in value.samples(self.name, labels):
+                yield sample
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def _make_value(self):
+        return CounterValue()
+
+    def inc(self, amount=1):
+        """Increment an unlabelled counter."""
+        self.labels().inc(amount)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, documentation, labelnames=labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _make_value(self):
+        return HistogramValue(self.buckets)
+
+    def observe(self, value):
+        """Record an observation in an unlabelled histogram."""
+        self.labels().observe(value)
+
+
+class Registry(object):
+    """Holds a set of metrics."""
+
+    def __init__(self):
+        self.metrics = collections.OrderedDict()
+
+    def register(self, metric):
+        if metric.name in self.metrics:
+            raise MetricError("Cannot register two metrics with the same name %s." % metric.name)
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames=labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), **kwargs):
+        return self.register(Histogram(name, documentation, labelnames=labelnames, **kwargs))
+
+    def render(self):
+        """Render all metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in self.metrics.values():
+            lines.append('# HELP %s %s' % (metric.name, metric.documentation))
+            lines.append('# TYPE %s %s' % (metric.name, metric.kind))
+            for name, labels, value in metric.samples():
+                lines.append('%s%s %s' % (name, _format_labels(labels), _format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, path):
+        """Atomically write all metrics to a file, e.g for node_exporter."""
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.%s.' % os.path.basename(path))
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(self.render())
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+
+
+REGISTRY = Registry()
+
+UPDATE_DURATION = REGISTRY.histogram(
+    'mpdlcd_update_duration_seconds', "Duration of display updates.")
+UPDATE_ROUNDTRIPS = REGISTRY.histogram(
+    'mpdlcd_update_roundtrips', "Requests sent to a server during a display update.",
+    labelnames=['server'], buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34))
+ROUNDTRIPS = REGISTRY.counter(
+    'mpdlcd_roundtrips_total', "Requests sent to a server.", labelnames=['server'])
+BYTES = REGISTRY.counter(
+    'mpdlcd_bytes_total', "Bytes exchanged with a server.", labelnames=['server', 'direction'])
+WIDGET_WRITES = REGISTRY.counter(
+    'mpdlcd_widget_writes_total', "Widget updates, by outcome (written, delayed or suppressed).",
+    labelnames=['result'])
+RETRIES = REGISTRY.counter(
+    'mpdlcd_retries_total', "Failed connection attempts and lost connections.", labelnames=['target'])
+DROPPED_FRAMES = REGISTRY.counter(
+    'mpdlcd_dropped_frames_total', "Frames of animated fields skipped while running late.")
+
+
+class TextfileExporter(object):
+    """Periodically write metrics to a file, from a background thread."""
+
+    def __init__(self, path, interval, registry=REGISTRY):
+        self.path = path
+        self.interval = interval
+        self.registry = registry
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='metrics-textfile', daemon=True)
+
+    def start(self):
+        logger.info("Writing metrics to %s every %.1fs", self.path, self.interval)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            try:
+                self.registry.write_textfile(self.path)
+            except EnvironmentError as e:
+                logger.warning("Unable to write metrics to %s: %s", self.path, e)
+            if self._stop.wait(self.interval):
+                return
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    # http.server.ThreadingHTTPServer only exists from Python 3.7.
+    daemon_threads = True
+
+
+class HTTPExporter(object):
+    """Serve metrics over HTTP, from a background thread."""
+
+    def __init__(self, host, port, registry=REGISTRY):
+        registry_ = registry
+
+        class MetricsHandler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = registry_.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, fmt, *args):
+                logger.debug("HTTP %s - %s", self.address_string(), fmt % args)
+
+        self.server = _ThreadingHTTPServer((host, port), MetricsHandler)
+        self._thread = threading.Thread(target=self.server.serve_forever, name='metrics-http', daemon=True)
+
+    @property
+    def address(self):
+        return self.server.server_address[:2]
+
+    def start(self):
+        logger.info("Serving metrics on http://%s:%d/metrics", *self.address)
+        self._thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self._thread.join()
@@ -1,7 +1,11 @@
 # -*- coding: utf-8 -*-
 # Copyright (c) 2011-2013 Raphaël Barrois
 
+import collections
 import logging
+import time
+
+from . import timing
 
 logger = logging.getLogger(__name__)
 
@@ -11,8 +15,19 @@ class HookRegistryError(Exception):
 
 
 class HookRegistry(object):
+    """Registry of available hooks.
+
+    Attributes:
+        hook_options (dict(str => dict)): extra keyword arguments for the
+            creation of each hook, by name.
+        clock (mpdlcd.timing.Clock): the clock given to created hooks
+    """
     _REGISTRY = {}
 
+    def __init__(self, hook_options=None, clock=None):
+        self.hook_options = hook_options or {}
+        self.clock = clock or timing.MONOTONIC
+
     @classmethod
     def register_hook(cls, name, hook_class):
         if not name:
@@ -32,7 +47,12 @@ class HookRegistry(object):
                 "Unknown hook name '%s' (available: %s)"
                 % (name, ', '.join(self._REGISTRY.keys())))
 
-        return self._REGISTRY[name](**kwargs)
+        hook_class = self._REGISTRY[name]
+        options = dict(self.hook_options.get(name, {}))
+        if issubclass(hook_class, MPDHook):
+            options['clock'] = self.clock
+        options.update(kwargs)
+        return hook_class(**options)
 
 
 def register_hook(hook_class):
@@ -41,16 +61,29 @@ def register_hook(hook_class):
 
 
 class MPDHook(object):
-    """A MPD-related hook."""
+    """A MPD-related hook.
+
+    Attributes:
+        local (bool): whether the hook's data comes from elsewhere than MPD;
+            such hooks may be fetched between updates, without querying MPD.
+        subsystems (str tuple): the MPD subsystems whose changes affect the
+            hook's data
+    """
     name = ''
+    local = False
+    subsystems = ()
 
-    def __init__(self, **kwargs):
+    def __init__(self, clock=None, **kwargs):
         super(MPDHook, self).__init__(**kwargs)
+        self.clock = clock or timing.MONOTONIC
         self.previous_keys = {}
 
     def fetch(self, client):  # pragma: no cover
         return None
 
+    def subsystems_changed(self, subsystems):
+        """Handle changes of MPD subsystems, as reported since the last update."""
+
     def extract_key(self, data, key=''):
         """Retrieve a simple identifier for data change detection.
 
@@ -74,8 +107,14 @@ class MPDHook(object):
         Returns:
             (bool, new_data): whether changes occurred, and the new value.
         """
-        new_data = self.fetch(client)
+        return self.compare(self.fetch(client), subhooks)
+
+    def compare(self, new_data, subhooks=()):
+        """Compare fetched data to the previous lookup.
 
+        Returns:
+            (bool, new_data): whether changes occurred, and the new value.
+        """
         # Holds the list of updated fields.
         updated = {}
 
@@ -96,6 +135,39 @@ class MPDHook(object):
         return (False, None)
 
 
+class CachedHook(MPDHook):
+    """A hook whose data is only fetched again once stale.
+
+    Data gets stale when MPD reports changes in one of the hook's subsystems,
+    or after ``ttl`` seconds.
+
+    Attributes:
+        ttl (float): the maximum age of the data, in seconds
+    """
+    DEFAULT_TTL = 3600
+
+    def __init__(self, ttl=DEFAULT_TTL, **kwargs):
+        super(CachedHook, self).__init__(**kwargs)
+        self.ttl = float(ttl)
+        self._data = None
+        self._fetched_at = None
+
+    def invalidate(self):
+        self._fetched_at = None
+
+    def subsystems_changed(self, subsystems):
+        if set(subsystems) & set(self.subsystems):
+            self.invalidate()
+
+    def handle(self, client, subhooks=()):
+        now = self.clock.now()
+        if self._fetched_at is None or now - self._fetched_at >= self.ttl:
+            logger.debug("Hook %s: fetching fresh data", self.name)
+            self._data = self.fetch(client)
+            self._fetched_at = now
+        return self.compare(self._data, subhooks)
+
+
 @register_hook
 class StatusHook(MPDHook):
     """The whole MPD status result."""
@@ -123,11 +195,43 @@ class ElapsedAndTotalHook(MPDHook):
 
 @register_hook
 class SongHook(MPDHook):
+    """The current song.
+
+    Attributes:
+        settle (float): when the song changes, wait until the new one has been
+            current for that many seconds before reporting it; this avoids
+            rendering every song when skipping through the playlist.
+    """
     name = 'song'
 
+    def __init__(self, settle=0, **kwargs):
+        super(SongHook, self).__init__(**kwargs)
+        self.settle = float(settle)
+        self._settled_id = None
+        self._candidate_id = None
+        self._candidate_since = None
+
     def fetch(self, client):
         return client.current_song
 
+    def handle(self, client, subhooks=()):
+        new_data = self.fetch(client)
+        song_id = getattr(new_data, 'id', None)
+
+        # Only delay switching from one song to another.
+        if self.settle and None not in (song_id, self._settled_id) and song_id != self._settled_id:
+            now = self.clock.now()
+            if song_id != self._candidate_id:
+                self._candidate_id = song_id
+                self._candidate_since = now
+            if now - self._candidate_since < self.settle:
+                logger.debug("Hook %s: waiting for song %s to settle", self.name, song_id)
+                return (False, None)
+
+        self._settled_id = song_id
+        self._candidate_id = None
+        return self.compare(new_data, subhooks)
+
     def extract_key(self, data, key=''):
         """Custom ``extract_key`` to detect when any watched field changed."""
         current_song = data
@@ -136,3 +240,206 @@ class SongHook(MPDHook):
         if key == self.name:
             return current_song.id
         return getattr(current_song, key, '')
+
+
+@register_hook
+class VolumeHook(CachedHook):
+    """The mixer volume, from 0 to 100; -1 without a mixer."""
+    name = 'volume'
+    subsystems = ('mixer',)
+
+    def fetch(self, client):
+        return int(client.status.get('volume', -1))
+
+
+@register_hook
+class StatsHook(CachedHook):
+    """The statistics of the MPD database.
+
+    Each sub-hook is the name of a statistic.
+    """
+    name = 'stats'
+    subsystems = ('database',)
+
+    def fetch(self, client):
+        return client.stats
+
+    def extract_key(self, data, key=''):
+        if key == self.name:
+            return data
+        return data.get(key)
+
+
+@register_hook
+class RatingHook(MPDHook):
+    """The rating of the current song, from MPD's sticker database.
+
+    Ratings are kept in a bounded LRU cache, by song URI: MPD is only queried
+    when the current song's file isn't in the cache. The ``sticker`` event
+    doesn't tell which song changed, so it empties the whole cache; as it
+    doesn't show in MPD's status, the runner collects events on each update.
+
+    Attributes:
+        sticker (str): the name of the sticker holding ratings
+        cache_size (int): the maximum number of cached ratings
+    """
+    name = 'rating'
+    subsystems = ('sticker',)
+
+    DEFAULT_STICKER = 'rating'
+    DEFAULT_CACHE_SIZE = 256
+
+    def __init__(self, sticker=DEFAULT_STICKER, cache_size=DEFAULT_CACHE_SIZE, **kwargs):
+        super(RatingHook, self).__init__(**kwargs)
+        self.sticker = sticker
+        self.cache_size = int(cache_size)
+        self._ratings = collections.OrderedDict()
+
+    def subsystems_changed(self, subsystems):
+        if set(subsystems) & set(self.subsystems):
+            self._ratings.clear()
+
+    def fetch(self, client):
+        song = client.current_song
+        if not song:
+            return None
+        uri = song.file
+        if uri in self._ratings:
+            self._ratings.move_to_end(uri)
+            return self._ratings[uri]
+
+        logger.debug("Hook %s: fetching the rating of %s", self.name, uri)
+        rating = client.song_sticker(uri, self.sticker)
+        self._ratings[uri] = rating
+        while len(self._ratings) > self.cache_size:
+            self._ratings.popitem(last=False)
+        return rating
+
+
+@register_hook
+class ClockHook(MPDHook):
+    """The wall clock time.
+
+    Each sub-hook is a strftime() format, which only changes when the
+    formatted text does.
+    """
+    name = 'clock'
+    local = True
+
+    def fetch(self, client):
+        return self.clock.time()
+
+    def extract_key(self, data, key=''):
+        if key == self.name:
+            return int(data)
+        return time.strftime(key, time.localtime(data))
+
+
+@register_hook
+class AudioHook(MPDHook):
+    """Frames of the audio being played, from a mpdlcd.audio.AudioSource.
+
+    Attributes:
+        source (mpdlcd.audio.AudioSource): where frames come from, if any
+    """
+    name = 'audio'
+    local = True
+
+    def __init__(self, source=None, **kwargs):
+        super(AudioHook, self).__init__(**kwargs)
+        self.source = source
+
+    def fetch(self, client):
+        if self.source is None:
+            return None
+        return self.source.frame()
+
+    def extract_key(self, data, key=''):
+        if data is None:
+            return None
+        return data.sequence
+
+
+QueueState = collections.namedtuple('QueueState', ['position', 'length', 'upcoming'])
+
+
+@register_hook
+class QueueHook(MPDHook):
+    """The position in the queue, and the upcoming songs.
+
+    Queues may hold tens of thousands of songs: only a window of upcoming
+    songs, starting at the next one, is kept. When the playlist version
+    changes, only the songs changed within that window are fetched
+    (``plchanges``); songs entering the window are fetched by range.
+
+    The hook's data is a QueueState: the current position (or None), the
+    length of the queue, and the list of upcoming songs.
+
+    Sub-hooks are ``queue`` for the position and length, and ``next:N`` for
+    the Nth upcoming song.
+
+    Attributes:
+        window (int): the minimum number of upcoming songs kept
+        version (int): the playlist version of the kept songs
+    """
+    name = 'queue'
+
+    DEFAULT_WINDOW = 8
+
+    def __init__(self, window=DEFAULT_WINDOW, **kwargs):
+        super(QueueHook, self).__init__(**kwargs)
+        self.window = int(window)
+        self.version = None
+        self._size = self.window
+        self._songs = {}
+
+    def handle(self, client, subhooks=()):
+        offsets = [int(subhook.split(':', 1)[1]) for subhook in subhooks if subhook.startswith('next:')]
+        self._size = max([self.window] + offsets)
+        return super(QueueHook, self).handle(client, subhooks)
+
+    def fetch(self, client):
+        status = client.status
+        version = int(status.get('playlist', 0))
+        length = int(status.get('playlistlength', 0))
+        position = int(status['song']) if 'song' in status else None
+
+        if 'nextsong' in status:
+            start = int(status['nextsong'])
+            # In random mode, only the next song is known.
+            count = 1 if str(status.get('random')) == '1' else self._size
+            end = min(start + count, length)
+        else:
+            start = end = 0
+
+        self._refresh(client, version, start, end)
+        # The queue may have changed since the status was fetched.
+        upcoming = [self._songs.get(pos) for pos in range(start, end)]
+        return QueueState(position, length, upcoming)
+
+    def _refresh(self, client, version, start, end):
+        """Update the kept songs to the [start, end) window of a playlist version."""
+        if self.version is not None and version < self.version:
+            # MPD restarted
+            self._songs = {}
+        self._songs = dict((pos, song) for pos, song in self._songs.items() if start <= pos < end)
+
+        if version != self.version and self._songs:
+            logger.debug("Hook %s: fetching changes from version %s to %s", self.name, self.version, version)
+            for song in client.queue_changes(self.version, start, end):
+                self._songs[int(song.pos)] = song
+
+        missing = [pos for pos in range(start, end) if pos not in self._songs]
+        if missing:
+            for song in client.queue_songs(missing[0], missing[-1] + 1):
+                self._songs[int(song.pos)] = song
+        self.version = version
+
+    def extract_key(self, data, key=''):
+        if key == self.name:
+            return (data.position, data.length)
+        offset = int(key.split(':', 1)[1])
+        song = data.upcoming[offset - 1] if offset <= len(data.upcoming) else None
+        if song is None:
+            return None
+        return tuple(sorted(song.tags.items()))
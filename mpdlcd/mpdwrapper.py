@@ -2,9 +2,13 @@
 # Copyright (c) 2011-2013 Raphaël Barrois
 
 import logging
+import select
+import socket
+
 import mpd
 
 
+from mpdlcd import metrics
 from mpdlcd import utils
 
 
@@ -22,15 +26,117 @@ class MPDConnectionError(MPDError):
     pass
 
 
+class MPDOffline(MPDConnectionError):
+    """The MPD server is unreachable, and no connection attempt is due yet."""
+
+
+class InstrumentedMPDClient(mpd.MPDClient):
+    """A mpd.MPDClient recording its traffic in metrics.
+
+    Replies must also arrive within a per-request deadline; socket.timeout is
+    raised otherwise.
+
+    Attributes:
+        tracer (mpdlcd.trace.TraceWriter): where to record the traffic, if set
+        timeouts (mpdlcd.utils.TimeoutConfig): I/O timeouts
+    """
+
+    def __init__(self, tracer=None, timeouts=None):
+        super(InstrumentedMPDClient, self).__init__()
+        self.tracer = tracer
+        self.timeouts = timeouts or utils.TimeoutConfig()
+        self._deadline = None
+        self._shortened = False
+
+    def connect(self, host, port=None, timeout=None):
+        self.timeout = self.timeouts.connect_timeout
+        super(InstrumentedMPDClient, self).connect(host, port, timeout)
+        self.timeout = self.timeouts.read_timeout
+        if self.tracer is not None:
+            self.tracer.trace_mpd(self)
+
+    def _write_command(self, command, args=[]):
+        # Commands of a command list are all answered after command_list_end.
+        in_list = self._command_list is not None or command.startswith('command_list_')
+        if command == 'command_list_end' or not in_list:
+            metrics.ROUNDTRIPS.labels('mpd').inc()
+        if self._shortened:
+            # Restore the timeout shortened by the previous deadline.
+            self.timeout = self.timeouts.read_timeout
+            self._shortened = False
+        # idle waits for events for as long as it takes.
+        self._deadline = None if command == 'idle' else self.timeouts.deadline()
+        super(InstrumentedMPDClient, self)._write_command(command, args)
+
+    def _write_line(self, line):
+        super(InstrumentedMPDClient, self)._write_line(line)
+        metrics.BYTES.labels('mpd', 'sent').inc(len(line) + 1)
+
+    def _read_line(self):
+        if self._deadline is not None:
+            timeout = self.timeouts.line_timeout(self._deadline)
+            if timeout != self.timeout:
+                self._sock.settimeout(timeout)
+                self._shortened = True
+        line = super(InstrumentedMPDClient, self)._read_line()
+        # 'OK' lines are swallowed by the parent class.
+        metrics.BYTES.labels('mpd', 'received').inc(3 if line is None else len(line) + 1)
+        return line
+
+    def idle_for(self, timeout, subsystems=(), wake_on=()):
+        """Wait for changes in some subsystems, for at most ``timeout`` seconds.
+
+        Args:
+            wake_on (socket list): stop waiting as well when one of those
+                becomes readable
+
+        Returns:
+            str list: the changed subsystems; empty if none changed in time.
+        """
+        self._write_command('idle', subsystems)
+        readable, _w, _x = select.select([self._sock] + list(wake_on), [], [], max(timeout, 0))
+        if self._sock not in readable:
+            # MPD answers with the changes seen so far, if any.
+            self._write_command('noidle')
+        return list(self._parse_list(self._read_lines()))
+
+
 class MPDClient(utils.AutoRetryCandidate):
+    """A MPD client, reconnecting on errors without blocking.
 
-    def __init__(self, host='localhost', port='6600', password=None, *args, **kwargs):
+    When the server can't be reached, requests fail at once with MPDOffline
+    until the connection state allows another attempt.
+
+    After fetch_snapshot(), the status and current song are read from the
+    snapshot instead of the server.
+
+    Changed subsystems are collected from idle replies, and from differences
+    between successive status snapshots; see pop_changes().
+
+    Attributes:
+        connection (mpdlcd.utils.ConnectionState): the state of the connection
+        list_windows (bool): whether the server supports ``list ... window``;
+            assumed until it rejects one
+    """
+    SNAPSHOT_COMMANDS = ('status', 'currentsong')
+    IDLE_SUBSYSTEMS = ('player', 'mixer', 'options', 'playlist', 'database', 'sticker')
+    # Changes of these subsystems show in the status; see _status_changes().
+    STATUS_SUBSYSTEMS = ('player', 'mixer', 'options', 'playlist', 'database')
+
+    _connection_errors = (socket.error, mpd.ConnectionError)
+
+    def __init__(self, host='localhost', port='6600', password=None, tracer=None, timeouts=None, *args, **kwargs):
         super(MPDClient, self).__init__(*args, **kwargs)
-        self._client = mpd.MPDClient()
+        self._client = InstrumentedMPDClient(tracer=tracer, timeouts=timeouts)
         self._connected = False
         self.host = host
         self.port = port
         self.password = password
+        self.connection = utils.ConnectionState(self._retry_config, name='mpd', clock=self._clock)
+        self._snapshot = None
+        self._last_status = None
+        self._changes = set()
+        self.list_windows = True
 
     def _decode_text_or_list(self, text_or_list):
         """Takes a 'text or list' and normalizes it to a UTF-8-decoded list."""
@@ -44,19 +150,139 @@ class MPDClient(utils.AutoRetryCandidate):
         return dict(
             (k, self._decode_text_or_list(v)) for k, v in data.items())
 
-    @utils.auto_retry
-    def connect(self):
-        if not self._connected:
-            logger.info('Connecting to MPD server at %s:%s', self.host, self.port)
+    def _connect(self):
+        if self._connected:
+            return
+        if not self.connection.can_attempt():
+            raise MPDOffline(
+                "MPD server at %s:%s is offline, retrying in %.1fs"
+                % (self.host, self.port, self.connection.retry_in()))
+
+        logger.info('Connecting to MPD server at %s:%s', self.host, self.port)
+        self.connection.attempting()
+        try:
             self._client.connect(host=self.host, port=self.port)
             if self.password:
                 self._client.password(self.password)
-            self._connected = True
+        except self._connection_errors as e:
+            logger.warning('Unable to connect to MPD server at %s:%s: %s', self.host, self.port, e)
+            self._disconnect()
+            self.connection.failed()
+            raise MPDConnectionError(str(e))
+        self._connected = True
+        self.connection.succeeded()
+        # Anything may have changed while disconnected.
+        self._changes.update(self.IDLE_SUBSYSTEMS)
+
+    def connect(self):
+        """Connect to the server, if the connection state allows it.
+
+        Raises:
+            MPDConnectionError: the server can't be reached.
+        """
+        self._connect()
+
+    def disconnect(self):
+        """Close the connection, if any."""
+        if self._connected:
+            logger.info('Disconnecting from MPD server at %s:%s', self.host, self.port)
+            self._disconnect()
+
+    def _disconnect(self):
+        self._connected = False
+        try:
+            self._client.disconnect()
+        except self._connection_errors:
+            pass
+
+    def _request(self, command, *args):
+        """Send a command, reconnecting once if the connection was lost.
+
+        Raises:
+            MPDConnectionError: the server can't be reached.
+        """
+        if self._snapshot is not None and command in self._snapshot:
+            return self._snapshot[command]
+        return self._retrying(getattr(self._client, command), *args)
+
+    def _run_list(self, commands):
+        self._client.command_list_ok_begin()
+        for command in commands:
+            getattr(self._client, command)()
+        return self._client.command_list_end()
+
+    def fetch_snapshot(self):
+        """Fetch the status and current song, in a single roundtrip.
+
+        Raises:
+            MPDConnectionError: the server can't be reached.
+        """
+        self._snapshot = None
+        replies = self._retrying(self._run_list, self.SNAPSHOT_COMMANDS)
+        self._snapshot = dict(zip(self.SNAPSHOT_COMMANDS, replies))
+        status = self._snapshot['status']
+        if self._last_status is not None:
+            self._changes.update(self._status_changes(self._last_status, status))
+        self._last_status = status
+
+    def _status_changes(self, previous, status):
+        """Subsystems whose changes show between two statuses."""
+        changes = set()
+        if previous.get('volume') != status.get('volume'):
+            changes.add('mixer')
+        if 'updating_db' in previous and 'updating_db' not in status:
+            changes.add('database')
+        return changes
+
+    def wait_for_changes(self, timeout, subsystems=IDLE_SUBSYSTEMS, wake_on=()):
+        """Wait until MPD reports a change, for at most ``timeout`` seconds.
+
+        Args:
+            wake_on (socket list): stop waiting as well when one of those
+                becomes readable
+
+        Returns:
+            str list: the changed subsystems; empty on timeout.
+
+        Raises:
+            MPDConnectionError: the server can't be reached.
+        """
+        self._snapshot = None
+        changes = self._retrying(self._client.idle_for, timeout, subsystems, wake_on)
+        self._changes.update(changes)
+        return changes
+
+    def pop_changes(self):
+        """The subsystems which changed since the last call.
+
+        Returns:
+            str set: subsystems reported by idle, or seen changing in the status
+        """
+        changes, self._changes = self._changes, set()
+        return changes
+
+    def _retrying(self, function, *args):
+        for attempt in range(2):
+            self._connect()
+            try:
+                return function(*args)
+            except self._connection_errors as e:
+                logger.warning('Lost connection to MPD server at %s:%s: %s', self.host, self.port, e)
+                self._disconnect()
+                if attempt:
+                    # Failing right after connecting: don't insist.
+                    self.connection.failed()
+                    raise MPDConnectionError(str(e))
+                self.connection.lost()
 
     @property
-    @utils.auto_retry
     def status(self):
-        return self._client.status()
+        return self._request('status')
+
+    @property
+    def stats(self):
+        logger.debug('Fetching MPD stats')
+        return self._request('stats')
 
     @property
     def random(self):
@@ -109,11 +335,59 @@ class MPDClient(utils.AutoRetryCandidate):
         logger.debug('MPD state: %r', state)
         return state
 
+    def list_tags(self, tag, filters=(), window=None):
+        """The sorted values of a tag in the database.
+
+        Args:
+            tag (str): the tag, e.g 'artist'
+            filters (str tuple): alternating tags and values, restricting the songs
+            window ((int, int)): only fetch the values between these positions
+
+        Returns:
+            str list: the values; None if a window was requested, but the
+                server doesn't support them (see list_windows).
+        """
+        logger.debug('Listing MPD %s values in %r (%r)', tag, window, filters)
+        filters = tuple(filters)
+        if window is None:
+            values = self._request('list', tag, *filters)
+        elif not self.list_windows:
+            return None
+        else:
+            try:
+                values = self._request('list', tag, *(filters + ('window', window)))
+            except mpd.CommandError as e:
+                logger.info('MPD server at %s:%s does not support list windows: %s', self.host, self.port, e)
+                self.list_windows = False
+                return None
+        return [value[tag] for value in values]
+
+    def song_sticker(self, uri, name):
+        """A sticker of a song, or None if it isn't set."""
+        logger.debug('Fetching MPD sticker %s of %s', name, uri)
+        try:
+            return self._request('sticker_get', 'song', uri, name)
+        except mpd.CommandError:
+            # No such sticker, or no sticker database.
+            return None
+
+    def _songs(self, songs):
+        return [MPDSong(**self._decode_dict(song)) for song in songs]
+
+    def queue_songs(self, start, end):
+        """The songs of the queue between two positions."""
+        logger.debug('Fetching MPD queue from %d to %d', start, end)
+        return self._songs(self._request('playlistinfo', (start, end)))
+
+    def queue_changes(self, version, start, end):
+        """The songs of the queue changed since a playlist version, between two positions."""
+        logger.debug('Fetching MPD queue changes since version %d, from %d to %d', version, start, end)
+        return self._songs(self._request('plchanges', version, (start, end)))
+
     @property
-    @utils.auto_retry
     def current_song(self):
         logger.debug('Fetching MPD song information')
-        song_tags = self._decode_dict(self._client.currentsong())
+        song_tags = self._decode_dict(self._request('currentsong'))
         logger.debug('MPD currentsong: %r', song_tags)
         return MPDSong(**song_tags)
 
@@ -164,9 +438,11 @@ class MPDSong(object):
         for name, value in self.tags.items():
             setattr(self, name, value)
 
-    def __nonzero__(self):
+    def __bool__(self):
         """If no song is playing, we won't have an ID."""
         return 'id' in self.tags
 
+    __nonzero__ = __bool__
+
     def format(self, fmt='{artist} - {title}'):
         return fmt.format(**self.tags)
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2011-2013 Raphaël Barrois
+
+"""On-demand profiling of a running mpdlcd, driven by signals.
+
+- SIGUSR1 starts profiling display updates; the next SIGUSR1 stops it and
+  dumps the collected statistics;
+- SIGUSR2 starts tracing memory allocations; further SIGUSR2 dump the top
+  allocation sites, and the largest changes since the previous dump.
+"""
+
+import contextlib
+import cProfile
+import io
+import itertools
+import logging
+import os
+import pstats
+import signal
+import time
+import tracemalloc
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_TOP = 25
+
+
+class Profiler(object):
+    """Handle profiling sessions and memory snapshots.
+
+    Attributes:
+        output_dir (str): where to write profiles and snapshots
+        top (int): number of entries to include in reports
+        profile (cProfile.Profile): the current profiling session, if any
+        last_snapshot (tracemalloc.Snapshot): the previous memory snapshot
+    """
+
+    def __init__(self, output_dir, top=DEFAULT_TOP):
+        self.output_dir = output_dir
+        self.top = top
+        self.profile = None
+        self.last_snapshot = None
+        self._sequence = itertools.count(1)
+
+    def install_signal_handlers(self):
+        signal.signal(signal.SIGUSR1, lambda signum, frame: self.toggle_profiling())
+        signal.signal(signal.SIGUSR2, lambda signum, frame: self.snapshot_memory())
+        logger.info(
+            "Send SIGUSR1 to pid %d to toggle profiling, SIGUSR2 for memory snapshots (output in %s)",
+            os.getpid(), self.output_dir)
+
+    def _output_path(self, kind, extension):
+        filename = 'mpdlcd-%d-%s-%s-%d.%s' % (
+            os.getpid(), kind, time.strftime('%Y%m%d-%H%M%S'), next(self._sequence), extension)
+        return os.path.join(self.output_dir, filename)
+
+    @contextlib.contextmanager
+    def profiled(self):
+        """Profile the enclosed block, if a profiling session is active."""
+        profile = self.profile
+        if profile is None:
+            yield
+            return
+
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+
+    def toggle_profiling(self):
+        """Start a profiling session, or end the current one and dump it.
+
+        Returns:
+            str: the path of the text report, when a session ended.
+        """
+        if self.profile is None:
+            self.profile = cProfile.Profile()
+            logger.warning("Profiling started")
+            return None
+
+        profile, self.profile = self.profile, None
+        profile.disable()
+        stats_path = self._output_path('profile', 'prof')
+        report_path = self._output_path('profile', 'txt')
+
+        report = io.StringIO()
+        stats = pstats.Stats(profile, stream=report)
+        stats.dump_stats(stats_path)
+        stats.sort_stats('cumulative').print_stats(self.top)
+        stats.sort_stats('tottime').print_stats(self.top)
+        with open(report_path, 'w') as f:
+            f.write(report.getvalue())
+
+        logger.warning("Profiling stopped; statistics written to %s and %s", report_path, stats_path)
+        return report_path
+
+    def snapshot_memory(self):
+        """Start tracing allocations, or write a report of the current ones.
+
+        Returns:
+            str: the path of the report, if one was written.
+        """
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            logger.warning("Memory tracing started; send SIGUSR2 again for a snapshot")
+            return None
+
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+        ])
+        report_path = self._output_path('memory', 'txt')
+
+        current, peak = tracemalloc.get_traced_memory()
+        lines = ["Traced memory: %d bytes (peak: %d bytes)" % (current, peak), ""]
+        lines.append("Top %d allocation sites:" % self.top)
+        lines.extend(str(stat) for stat in snapshot.statistics('lineno')[:self.top])
+        if self.last_snapshot is not None:
+            lines.append("")
+            lines.append("Top %d changes since the previous snapshot:" % self.top)
+            lines.extend(str(stat) for stat in snapshot.compare_to(self.last_snapshot, 'lineno')[:self.top])
+        self.last_snapshot = snapshot
+
+        with open(report_path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+
+        logger.warning("Memory snapshot written to %s", report_path)
+        return report_path
@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2011-2013 Raphaël Barrois
+
+"""Long-running soak test, against in-process fake MPD and LCDd servers.
+
+A real MpdRunner is driven through days or weeks of simulated time (without
+actually sleeping), while songs play, MPD connections drop and the screen
+pattern is reloaded at regular intervals.
+
+Memory is sampled after each simulated interval:
+- rss: resident set size of the process, in bytes
+- traced: memory allocated by Python, as tracked by tracemalloc
+- widgets, hook_keys, songs, log_handlers: sizes of structures which should
+  not grow with time
+
+The run fails if memory grows by more than a threshold after the warm-up
+period, or if a structure grows beyond its size during the warm-up.
+"""
+
+import collections
+import gc
+import logging
+import optparse
+import resource
+import sys
+import time
+import tracemalloc
+
+from . import cli
+from . import bench
+from . import mpdhooks
+from . import mpdwrapper
+
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_DAYS = 14
+DEFAULT_REFRESH = 30
+DEFAULT_WARMUP = 48
+DEFAULT_SAMPLE_EVERY = 6
+DEFAULT_RECONNECT_EVERY = 5
+DEFAULT_RELOAD_EVERY = 12
+DEFAULT_PAUSE_EVERY = 7
+DEFAULT_MAX_RSS_GROWTH = 8 << 20
+DEFAULT_MAX_TRACED_GROWTH = 512 << 10
+
+# Keep the fake servers from growing: only keep their last commands.
+SERVER_HISTORY = 1000
+
+HOUR = 3600
+
+# Alternates with cli.DEFAULT_PATTERNS on each reload.
+ALTERNATE_PATTERNS = [
+    """{song format="%(title)s",speed=4}""",
+
+    """{song format="%(title)s",speed=2}\n"""
+    """{state} {elapsed} / {total}""",
+
+    """{song format="%(title)s",speed=2}\n"""
+    """{song format="%(artist)s - %(album)s",speed=4}\n"""
+    """{state} {remaining}""",
+
+    """{song format="%(title)s",speed=2}\n"""
+    """{song format="%(artist)s - %(album)s",speed=4}\n"""
+    """\n"""
+    """{state} {elapsed} / {total}""",
+]
+
+# Structures whose size may not exceed their size during the warm-up.
+BOUNDED_FIGURES = ['widgets', 'hook_keys', 'songs', 'log_handlers']
+
+
+Sample = collections.namedtuple(
+    'Sample',
+    ['time', 'rss', 'traced', 'widgets', 'hook_keys', 'songs', 'log_handlers'],
+)
+
+
+def current_rss():
+    """The resident set size of the process, in bytes.
+
+    Falls back to the peak RSS where /proc is not available.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except (IOError, OSError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Kilobytes on Linux, bytes on macOS.
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _count_log_handlers():
+    loggers = [logging.getLogger()] + [
+        item for item in logging.Logger.manager.loggerDict.values()
+        if isinstance(item, logging.Logger)
+    ]
+    return sum(len(item.handlers) for item in loggers)
+
+
+def check(samples, warmup, max_rss_growth=DEFAULT_MAX_RSS_GROWTH, max_traced_growth=DEFAULT_MAX_TRACED_GROWTH):
+    """Look for growth in a list of samples.
+
+    Args:
+        samples (Sample list): the samples, in chronological order
+        warmup (float): the duration of the warm-up, in seconds; it should
+            include at least one sample
+        max_rss_growth (int): allowed RSS growth after the warm-up, in bytes
+        max_traced_growth (int): allowed growth of Python allocations after
+            the warm-up, in bytes
+
+    Returns:
+        str list: the detected problems
+    """
+    during = [sample for sample in samples if sample.time < warmup]
+    after = [sample for sample in samples if sample.time >= warmup]
+    if not during or len(after) < 2:
+        return ["Not enough samples: %d during the warm-up, %d after" % (len(during), len(after))]
+
+    problems = []
+    baseline, last = after[0], after[-1]
+    for name, limit in [('rss', max_rss_growth), ('traced', max_traced_growth)]:
+        growth = getattr(last, name) - getattr(baseline, name)
+        if growth > limit:
+            problems.append("%s grew by %d bytes (limit: %d)" % (name, growth, limit))
+
+    for name in BOUNDED_FIGURES:
+        allowed = max(getattr(sample, name) for sample in during)
+        largest = max(getattr(sample, name) for sample in after)
+        if largest > allowed:
+            problems.append("%s grew from %d to %d" % (name, allowed, largest))
+    return problems
+
+
+class Soak(object):
+    """Run MpdRunner for a long simulated time, sampling memory usage.
+
+    Intervals and the warm-up are in hours of simulated time.
+
+    Attributes:
+        env (mpdlcd.bench.BenchEnvironment): the fake servers and the runner
+        samples (Sample list): the samples taken so far
+        reloads (int): number of pattern reloads
+        errors (str list): failures of the runner
+    """
+
+    def __init__(
+            self, days=DEFAULT_DAYS, refresh=DEFAULT_REFRESH, lines=4, warmup=DEFAULT_WARMUP,
+            sample_every=DEFAULT_SAMPLE_EVERY, reconnect_every=DEFAULT_RECONNECT_EVERY,
+            reload_every=DEFAULT_RELOAD_EVERY, pause_every=DEFAULT_PAUSE_EVERY):
+        self.duration = days * 24 * HOUR
+        self.warmup = warmup * HOUR
+        self.sample_every = sample_every * HOUR
+        self.reconnect_every = reconnect_every * HOUR
+        self.reload_every = reload_every * HOUR
+        self.pause_every = pause_every * HOUR
+        self.env = bench.BenchEnvironment(lines, songs=200, refresh=refresh, history=SERVER_HISTORY)
+        self.samples = []
+        self.baseline_snapshot = None
+        self.last_snapshot = None
+        self.reloads = 0
+        self.errors = []
+        self._start = None
+
+    @property
+    def clock(self):
+        return self.env.clock
+
+    def _every(self, period, callback):
+        """Call ``callback`` every ``period`` seconds of simulated time."""
+        def run():
+            callback()
+            self.clock.call_later(period, run)
+        self.clock.call_later(period, run)
+
+    def reconnect(self):
+        self.env.mpd_server.disconnect_clients()
+
+    def reload(self):
+        self.reloads += 1
+        patterns = ALTERNATE_PATTERNS if self.reloads % 2 else cli.DEFAULT_PATTERNS
+        self.env.runner.reload_pattern(
+            cli._make_patterns(patterns, clock=self.clock),
+            hook_registry=mpdhooks.HookRegistry(clock=self.clock),
+        )
+
+    def pause(self):
+        """Pause playback for a few minutes."""
+        self.env.player.pause()
+        self.clock.call_later(600, self.env.player.pause)
+
+    def sample(self):
+        gc.collect()
+        runner = self.env.runner
+        sample = Sample(
+            time=self.clock.now() - self._start,
+            rss=current_rss(),
+            traced=tracemalloc.get_traced_memory()[0],
+            widgets=len(runner.screen.widgets) + len(runner.lcd.widget_priorities),
+            hook_keys=sum(len(hook.previous_keys) for hook in runner.hooks.values()),
+            songs=sum(1 for obj in gc.get_objects() if isinstance(obj, mpdwrapper.MPDSong)),
+            log_handlers=_count_log_handlers(),
+        )
+        self.samples.append(sample)
+        if sample.time >= self.warmup:
+            self.last_snapshot = tracemalloc.take_snapshot()
+            if self.baseline_snapshot is None:
+                self.baseline_snapshot = self.last_snapshot
+        logger.info(
+            "%6.1fh: rss=%dkB traced=%dkB widgets=%d hook_keys=%d songs=%d",
+            sample.time / HOUR, sample.rss >> 10, sample.traced >> 10,
+            sample.widgets, sample.hook_keys, sample.songs,
+        )
+
+    def finish(self):
+        self.sample()
+        self.env.runner.stop()
+
+    def run(self):
+        """Run the soak; return the wall time it took."""
+        env = self.env
+        self._start = self.clock.now()
+        self._every(self.sample_every, self.sample)
+        self._every(self.reconnect_every, self.reconnect)
+        self._every(self.reload_every, self.reload)
+        self._every(self.pause_every, self.pause)
+        self.clock.call_later(self.duration, self.finish)
+
+        started = time.perf_counter()
+        tracing = tracemalloc.is_tracing()
+        if not tracing:
+            tracemalloc.start()
+        try:
+            env.player.play()
+            env.runner.run()
+        finally:
+            if not tracing:
+                tracemalloc.stop()
+            env.close()
+
+        if self.clock.now() < self._start + self.duration:
+            self.errors.append("The runner exited after %.1fh" % ((self.clock.now() - self._start) / HOUR))
+        return time.perf_counter() - started
+
+    def top_allocations(self, limit=10):
+        """The lines whose allocations grew most since the end of the warm-up."""
+        if self.baseline_snapshot is None:
+            return []
+        return self.last_snapshot.compare_to(self.baseline_snapshot, 'lineno')[:limit]
+
+    def check(self, **thresholds):
+        """Look for problems in the run; see check()."""
+        return self.errors + check(self.samples, warmup=self.warmup, **thresholds)
+
+
+def main(argv=None):
+    parser = optparse.OptionParser(
+        usage="%prog [options]",
+        description="Run mpdlcd against fake servers for a long simulated time, and check for memory growth.",
+    )
+    parser.add_option('--days', type='float', default=DEFAULT_DAYS,
+                      help="Simulated days to run for [default: %default]")
+    parser.add_option('--refresh', type='float', default=DEFAULT_REFRESH,
+                      help="Simulated seconds between display updates [default: %default]")
+    parser.add_option('--warmup', type='float', default=DEFAULT_WARMUP,
+                      help="Hours of warm-up, excluded from growth checks [default: %default]")
+    parser.add_option('--max-rss-growth', type='int', default=DEFAULT_MAX_RSS_GROWTH >> 10, metavar='KB',
+                      help="Allowed RSS growth after the warm-up [default: %default]")
+    parser.add_option('--max-traced-growth', type='int', default=DEFAULT_MAX_TRACED_GROWTH >> 10, metavar='KB',
+                      help="Allowed growth of Python allocations after the warm-up [default: %default]")
+    parser.add_option('-v', '--verbose', action='store_true', default=False,
+                      help="Log each sample")
+    options, _args = parser.parse_args(argv)
+
+    logging.basicConfig(
+        level=logging.INFO if options.verbose else logging.WARNING,
+        format='%(message)s',
+    )
+    # Expected warnings on reconnects would drown the samples.
+    logging.getLogger('mpdlcd.mpdwrapper').setLevel(logging.ERROR)
+
+    soak = Soak(days=options.days, refresh=options.refresh, warmup=options.warmup)
+    elapsed = soak.run()
+    problems = soak.check(
+        max_rss_growth=options.max_rss_growth << 10,
+        max_traced_growth=options.max_traced_growth << 10,
+    )
+
+    first, last = soak.samples[0], soak.samples[-1]
+    print("Simulated %.1f days in %.1fs, %d reloads." % (last.time / (24 * HOUR), elapsed, soak.reloads))
+    print("rss: %dkB -> %dkB, traced: %dkB -> %dkB" % (
+        first.rss >> 10, last.rss >> 10, first.traced >> 10, last.traced >> 10))
+    if not problems:
+        print("OK")
+        return 0
+
+    for problem in problems:
+        print("FAIL: %s" % problem)
+    print("Largest allocation growth:")
+    for stat in soak.top_allocations():
+        print("  %s" % stat)
+    return 1
+
+
+if __name__ == '__main__':  # pragma: no cover
+    sys.exit(main())
@@ -0,0 +1,4 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2011-2013 Raphaël Barrois
+
+"""Local stand-ins for the servers used by mpdlcd, for tests and benchmarks."""
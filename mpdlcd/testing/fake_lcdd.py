@@ -0,0 +1,448 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2011-2013 Raphaël Barrois
+
+"""A recording, in-process LCDd server.
+
+It speaks the subset of the LCDproc protocol used by mpdlcd.vendor.lcdproc,
+records every command with a timestamp, and keeps a simulated character grid
+of the visible screen.
+
+Usage:
+    with fake_lcdd.FakeLCDdServer(width=20, height=4) as lcdd:
+        ... connect to lcdd.address ...
+        mark = lcdd.mark()
+        ... do something ...
+        lcdd.count(since=mark, name='widget_set')
+        lcdd.render()
+"""
+
+import collections
+import shlex
+import socket
+import socketserver
+import threading
+import time
+
+from .. import timing
+
+
+PRIORITIES = ['hidden', 'background', 'info', 'foreground', 'alert', 'input']
+
+ICONS = {
+    'PLAY': '>',
+    'PAUSE': '=',
+    'STOP': '#',
+}
+
+
+Command = collections.namedtuple('Command', ['time', 'client', 'line', 'args'])
+
+
+class ProtocolError(Exception):
+    pass
+
+
+class FakeWidget(object):
+    def __init__(self, ref, kind):
+        self.ref = ref
+        self.kind = kind
+        self.args = []
+
+
+class FakeMenuItem(object):
+    def __init__(self, menu, ref, kind, args):
+        self.menu = menu
+        self.ref = ref
+        self.kind = kind
+        self.args = list(args)
+
+    @property
+    def text(self):
+        if self.args and not self.args[0].startswith('-'):
+            return self.args[0]
+        return ''
+
+
+class FakeScreen(object):
+    def __init__(self, ref):
+        self.ref = ref
+        self.widgets = collections.OrderedDict()
+        self.settings = {'priority': 'info'}
+        # When the screen gets removed, if it has a timeout
+        self.expires = None
+
+    @property
+    def priority(self):
+        return self.settings['priority']
+
+
+class LCDdHandler(socketserver.StreamRequestHandler):
+    """Handle a client connection to the FakeLCDdServer."""
+
+    def setup(self):
+        super(LCDdHandler, self).setup()
+        self.client_id = self.server.register_client(self)
+        self.screens = collections.OrderedDict()
+        self.keys = set()
+        self.menu_items = collections.OrderedDict()
+        self.write_lock = threading.Lock()
+
+    def finish(self):
+        self.server.unregister_client(self)
+        try:
+            super(LCDdHandler, self).finish()
+        except socket.error:
+            pass
+
+    def send_line(self, line):
+        with self.write_lock:
+            self.wfile.write(line.encode(self.server.charset) + b'\n')
+
+    def handle(self):
+        while True:
+            try:
+                raw = self.rfile.readline()
+            except socket.error:
+                return
+            if not raw:
+                return
+            line = raw.decode(self.server.charset).rstrip('\n')
+            try:
+                args = shlex.split(line)
+            except ValueError:
+                args = line.split()
+            self.server.record(self.client_id, line, args)
+            if self.server.consume_failure():
+                return
+
+            try:
+                reply = self.run_command(args)
+            except ProtocolError as e:
+                reply = 'huh? %s' % e
+            if self.server.latency:
+                time.sleep(self.server.latency)
+            if reply is None:
+                return
+            self.send_line(reply)
+
+    def expire_screens(self, now):
+        """Remove screens whose timeout expired."""
+        for ref, screen in list(self.screens.items()):
+            if screen.expires is not None and now >= screen.expires:
+                del self.screens[ref]
+
+    def run_command(self, args):
+        if not args:
+            raise ProtocolError("Empty command")
+        method = getattr(self, 'cmd_%s' % args[0], None)
+        if method is None:
+            raise ProtocolError("Invalid command \"%s\"" % args[0])
+        with self.server.lock:
+            self.expire_screens(self.server.clock.now())
+            try:
+                return method(*args[1:]) or 'success'
+            except TypeError:
+                raise ProtocolError("Wrong number of arguments")
+
+    def _screen(self, ref):
+        if ref not in self.screens:
+            raise ProtocolError("Invalid screen id")
+        return self.screens[ref]
+
+    # Commands
+    # --------
+
+    def cmd_hello(self):
+        server = self.server
+        return 'connect LCDproc 0.5.9 protocol 0.3 lcd wid %d hgt %d cellwid %d cellhgt %d' % (
+            server.width, server.height, server.cell_width, server.cell_height)
+
+    def cmd_bye(self):
+        return None
+
+    def cmd_noop(self):
+        return 'noop complete'
+
+    def cmd_client_set(self, *args):
+        pass
+
+    def cmd_client_add_key(self, *args):
+        self.keys.update(arg for arg in args if not arg.startswith('-'))
+
+    def cmd_client_del_key(self, *args):
+        self.keys.difference_update(args)
+
+    def cmd_menu_add_item(self, menu, ref, kind, *args):
+        if menu and menu not in self.menu_items:
+            raise ProtocolError("Cannot find menu id")
+        if ref in self.menu_items:
+            raise ProtocolError("Item id already in use")
+        self.menu_items[ref] = FakeMenuItem(menu, ref, kind, args)
+
+    def cmd_menu_del_item(self, menu, ref):
+        if ref not in self.menu_items:
+            raise ProtocolError("Cannot find item")
+        del self.menu_items[ref]
+
+    def cmd_backlight(self, state):
+        pass
+
+    def cmd_output(self, value):
+        pass
+
+    def cmd_screen_add(self, ref):
+        if ref in self.screens:
+            raise ProtocolError("Screen already exists")
+        self.screens[ref] = FakeScreen(ref)
+
+    def cmd_screen_del(self, ref):
+        self._screen(ref)
+        del self.screens[ref]
+
+    def cmd_screen_set(self, ref, *args):
+        screen = self._screen(ref)
+        if len(args) % 2:
+            raise ProtocolError("Missing value")
+        for key, value in zip(args[::2], args[1::2]):
+            screen.settings[key.lstrip('-')] = value
+            if key.lstrip('-') == 'timeout':
+                # In eighths of a second
+                screen.expires = self.server.clock.now() + int(value) / 8
+
+    def cmd_widget_add(self, screen_ref, ref, kind, *args):
+        screen = self._screen(screen_ref)
+        if ref in screen.widgets:
+            raise ProtocolError("Widget already exists")
+        screen.widgets[ref] = FakeWidget(ref, kind)
+
+    def cmd_widget_del(self, screen_ref, ref):
+        screen = self._screen(screen_ref)
+        if ref not in screen.widgets:
+            raise ProtocolError("Invalid widget id")
+        del screen.widgets[ref]
+
+    def cmd_widget_set(self, screen_ref, ref, *args):
+        screen = self._screen(screen_ref)
+        if ref not in screen.widgets:
+            raise ProtocolError("Invalid widget id")
+        screen.widgets[ref].args = list(args)
+
+
+class FakeLCDdServer(socketserver.ThreadingTCPServer):
+    """A fake LCDd server, running in a background thread.
+
+    Attributes:
+        width (int): the display width, in characters
+        height (int): the display height, in characters
+        cell_width (int): the width of a character, in pixels
+        cell_height (int): the height of a character, in pixels
+        latency (float): delay before each reply, in seconds
+        commands (Command deque): received commands; only the last
+            ``history`` ones are kept, if set
+        clock (mpdlcd.timing.Clock): the clock timestamping commands
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(
+            self, width=20, height=4, cell_width=5, cell_height=8,
+            host='127.0.0.1', port=0, latency=0, clock=timing.MONOTONIC, charset='iso-8859-1', history=None):
+        super(FakeLCDdServer, self).__init__((host, port), LCDdHandler)
+        self.width = width
+        self.height = height
+        self.cell_width = cell_width
+        self.cell_height = cell_height
+        self.latency = latency
+        self.clock = clock
+        self.charset = charset
+        self.commands = collections.deque(maxlen=history)
+        # Commands dropped from the history, so that marks remain valid.
+        self._dropped = 0
+        self.lock = threading.RLock()
+        self._clients = collections.OrderedDict()
+        self._client_ids = iter(range(1, 1 << 30))
+        self._failures = 0
+        self._thread = None
+
+    @property
+    def address(self):
+        return self.server_address[:2]
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.disconnect_clients()
+        self.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.stop()
+
+    # Clients
+    # -------
+
+    def register_client(self, handler):
+        with self.lock:
+            client_id = next(self._client_ids)
+            self._clients[client_id] = handler
+            return client_id
+
+    def unregister_client(self, handler):
+        with self.lock:
+            self._clients.pop(handler.client_id, None)
+
+    @property
+    def client_count(self):
+        with self.lock:
+            return len(self._clients)
+
+    def disconnect_clients(self):
+        """Abruptly close all client connections."""
+        with self.lock:
+            clients = list(self._clients.values())
+        for handler in clients:
+            try:
+                handler.connection.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+    def fail_next(self, count=1):
+        """Drop the connection upon the next ``count`` commands."""
+        with self.lock:
+            self._failures += count
+
+    def consume_failure(self):
+        with self.lock:
+            if self._failures:
+                self._failures -= 1
+                return True
+            return False
+
+    def press_key(self, key):
+        """Simulate a key press, sent to clients which reserved that key."""
+        with self.lock:
+            clients = [handler for handler in self._clients.values() if key in handler.keys]
+        for handler in clients:
+            handler.send_line('key %s' % key)
+
+    def select_menu_item(self, ref):
+        """Simulate selecting an item of a client menu."""
+        with self.lock:
+            clients = [handler for handler in self._clients.values() if ref in handler.menu_items]
+        for handler in clients:
+            handler.send_line('menuevent select %s' % ref)
+
+    def menu_items(self):
+        """All client menu items, as (client_id, FakeMenuItem) pairs."""
+        with self.lock:
+            return [
+                (client_id, item)
+                for client_id, handler in self._clients.items()
+                for item in handler.menu_items.values()
+            ]
+
+    # Command accounting
+    # ------------------
+
+    def record(self, client_id, line, args):
+        with self.lock:
+            if len(self.commands) == self.commands.maxlen:
+                self._dropped += 1
+            self.commands.append(Command(self.clock.now(), client_id, line, args))
+
+    def mark(self):
+        """Return a marker for the current position in the command log."""
+        with self.lock:
+            return self._dropped + len(self.commands)
+
+    def commands_since(self, mark=0, name=None):
+        """Retrieve commands received since ``mark``, optionally by name.
+
+        Commands already dropped from the history are not returned.
+        """
+        with self.lock:
+            commands = list(self.commands)[max(0, mark - self._dropped):]
+        if name is not None:
+            commands = [command for command in commands if command.args and command.args[0] == name]
+        return commands
+
+    def count(self, since=0, name=None):
+        """Count commands received since ``since``, optionally by name."""
+        return len(self.commands_since(since, name=name))
+
+    def wait_for(self, count, timeout=1):
+        """Wait until at least ``count`` commands have been received."""
+        deadline = time.monotonic() + timeout
+        while self.mark() < count and time.monotonic() < deadline:
+            time.sleep(0.001)
+        return self.mark() >= count
+
+    # Simulated display
+    # -----------------
+
+    def screens(self):
+        """All screens, as (client_id, FakeScreen) pairs; expired screens are removed."""
+        with self.lock:
+            now = self.clock.now()
+            for handler in self._clients.values():
+                handler.expire_screens(now)
+            return [
+                (client_id, screen)
+                for client_id, handler in self._clients.items()
+                for screen in handler.screens.values()
+            ]
+
+    def visible_screen(self):
+        """The screen currently displayed, if any."""
+        best = None
+        for _client_id, screen in self.screens():
+            rank = PRIORITIES.index(screen.priority) if screen.priority in PRIORITIES else 0
+            if rank > 0 and (best is None or rank > best[0]):
+                best = (rank, screen)
+        return best[1] if best else None
+
+    def render(self, screen=None):
+        """Render a screen (by default, the visible one) as a list of lines."""
+        grid = [[' '] * self.width for _i in range(self.height)]
+        screen = screen or self.visible_screen()
+        if screen is None:
+            return [''.join(row) for row in grid]
+
+        def put(x, y, text):
+            if not 1 <= y <= self.height:
+                return
+            for offset, char in enumerate(text):
+                if 1 <= x + offset <= self.width:
+                    grid[y - 1][x + offset - 1] = char
+
+        with self.lock:
+            widgets = list(screen.widgets.values())
+        for widget in widgets:
+            args = widget.args
+            try:
+                if widget.kind == 'string':
+                    put(int(args[0]), int(args[1]), args[2])
+                elif widget.kind == 'title':
+                    put(1, 1, args[0])
+                elif widget.kind == 'scroller':
+                    left, top, right = int(args[0]), int(args[1]), int(args[2])
+                    put(left, top, args[6][:right - left + 1])
+                elif widget.kind == 'icon':
+                    put(int(args[0]), int(args[1]), ICONS.get(args[2], '*'))
+                elif widget.kind == 'hbar':
+                    cells = int(args[2]) // self.cell_width
+                    put(int(args[0]), int(args[1]), '=' * cells)
+                elif widget.kind == 'vbar':
+                    if int(args[2]) > 0:
+                        put(int(args[0]), int(args[1]), '|')
+            except (IndexError, ValueError):
+                # Widget declared but not set yet
+                continue
+        return [''.join(row) for row in grid]
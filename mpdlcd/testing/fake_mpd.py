@@ -0,0 +1,775 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2011-2013 Raphaël Barrois
+
+"""A scriptable, in-process MPD server.
+
+Usage:
+    player = fake_mpd.Player(clock=clock)
+    player.add(fake_mpd.make_song(1))
+    server = fake_mpd.FakeMPDServer(player)
+    server.start()
+    ... connect to server.address ...
+    player.play()
+    server.stop()
+
+Playback is simulated from the ``clock`` (a mpdlcd.timing.Clock), which makes
+it controllable from tests through a VirtualClock.
+"""
+
+import collections
+import logging
+import select
+import shlex
+import socket
+import socketserver
+import threading
+import time
+
+from .. import timing
+
+logger = logging.getLogger(__name__)
+
+
+PROTOCOL_VERSION = '0.23.5'
+
+STATE_PLAY = 'play'
+STATE_PAUSE = 'pause'
+STATE_STOP = 'stop'
+
+TAG_TYPES = ('Artist', 'ArtistSort', 'Album', 'AlbumArtist', 'Title', 'Track', 'Name', 'Genre', 'Date')
+
+# MPD error codes
+ACK_ERROR_ARG = 2
+ACK_ERROR_UNKNOWN = 5
+ACK_ERROR_NO_EXIST = 50
+
+
+class CommandError(Exception):
+    def __init__(self, code, message):
+        super(CommandError, self).__init__(message)
+        self.code = code
+        self.message = message
+
+
+def make_song(index, duration=180, **tags):
+    """Build the tags of a fake song.
+
+    Args:
+        index (int): a number identifying the song
+        duration (float): the song duration, in seconds
+        **tags: extra or overridden tags
+    """
+    song = {
+        'file': 'music/artist-%d/song-%d.flac' % (index % 7, index),
+        'Artist': 'Artist %d' % (index % 7),
+        'Album': 'Album %d' % (index % 13),
+        'Title': 'Song number %d' % index,
+        'duration': duration,
+    }
+    song.update(tags)
+    return song
+
+
+class Player(object):
+    """The simulated state of a MPD server.
+
+    Attributes:
+        clock (mpdlcd.timing.Clock): the clock driving playback
+        playlist (dict list): the queue; each entry holds the song tags, and
+            its 'Id'.
+        playlist_version (int): incremented on each queue change; the
+            version in which each position last changed is kept for plchanges
+        state (str): the player state (play/pause/stop)
+        current (int): position of the current song, or None
+        volume (int): the mixer volume
+        options (dict(str => int)): the random/repeat/single/consume flags
+        bitrate (int): the reported bitrate
+        error (str): the current player error, if any
+        database (dict list): the songs of the database; the initial queue
+            unless given
+        library (dict(str => int)): the database statistics; they start as
+            those of the database
+        updating_db (int): the running database update job, if any
+        stickers (dict((str, str) => str)): song stickers, by URI and name
+    """
+
+    def __init__(self, songs=(), clock=timing.MONOTONIC, database=None):
+        self.clock = clock
+        self.lock = threading.RLock()
+        self.playlist = []
+        self.playlist_version = 1
+        self._versions = []
+        self.state = STATE_STOP
+        self.current = None
+        self.volume = 50
+        self.options = {'random': 0, 'repeat': 0, 'single': 0, 'consume': 0}
+        self.bitrate = 320
+        self.error = None
+        self._next_id = 1
+        self._elapsed = 0.0
+        self._started_at = None
+        self._listeners = []
+        for song in songs:
+            self.add(song)
+        self.database = list(self.playlist if database is None else database)
+        self.library = {
+            'artists': len(set(song.get('Artist') for song in self.database)),
+            'albums': len(set(song.get('Album') for song in self.database)),
+            'songs': len(self.database),
+            'db_playtime': int(sum(float(song.get('duration', 0)) for song in self.database)),
+        }
+        self.updating_db = None
+        self._next_job = 1
+        self.stickers = {}
+
+    # Events
+    # ------
+
+    def add_listener(self, callback):
+        """Register a callback, called with the name of changed subsystems."""
+        with self.lock:
+            self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        with self.lock:
+            self._listeners.remove(callback)
+
+    def notify(self, *subsystems):
+        with self.lock:
+            for callback in list(self._listeners):
+                callback(subsystems)
+
+    # Playback simulation
+    # -------------------
+
+    def _duration(self, pos):
+        return float(self.playlist[pos].get('duration', 0))
+
+    def _sync(self):
+        """Move to the next songs if the current one(s) ended since last call."""
+        if self.state != STATE_PLAY:
+            return
+        changed = False
+        now = self.clock.now()
+        elapsed = self._elapsed + now - self._started_at
+        # Songs without a duration are streams, which never end.
+        while self.current is not None and 0 < self._duration(self.current) <= elapsed:
+            elapsed -= self._duration(self.current)
+            changed = True
+            if self.current + 1 < len(self.playlist):
+                self.current += 1
+            elif self.options['repeat'] and self.playlist:
+                self.current = 0
+            else:
+                self.current = None
+                self.state = STATE_STOP
+                elapsed = 0
+        if changed:
+            self._elapsed = elapsed
+            self._started_at = now
+            self.notify('player')
+
+    @property
+    def elapsed(self):
+        with self.lock:
+            self._sync()
+            if self.state == STATE_PLAY:
+                return self._elapsed + self.clock.now() - self._started_at
+            return self._elapsed
+
+    @property
+    def current_song(self):
+        with self.lock:
+            self._sync()
+            if self.current is None:
+                return None
+            return self.playlist[self.current]
+
+    # Commands
+    # --------
+
+    def add(self, song):
+        """Append a song to the queue; returns its id."""
+        with self.lock:
+            song = dict(song, Id=self._next_id)
+            self._next_id += 1
+            self.playlist.append(song)
+            self._versions.append(None)
+            self._changed(len(self.playlist) - 1)
+        self.notify('playlist')
+        return song['Id']
+
+    def clear(self):
+        with self.lock:
+            self.stop()
+            self.playlist = []
+            self._versions = []
+            self._changed(0)
+        self.notify('playlist')
+
+    def move(self, pos, to):
+        """Move a queued song to another position."""
+        with self.lock:
+            self._sync()
+            current_id = None if self.current is None else self.playlist[self.current]['Id']
+            self.playlist.insert(to, self.playlist.pop(pos))
+            self._versions.insert(to, self._versions.pop(pos))
+            self._changed(min(pos, to), max(pos, to) + 1)
+            if current_id is not None:
+                self.current = [song['Id'] for song in self.playlist].index(current_id)
+        self.notify('playlist')
+
+    def delete(self, pos):
+        """Remove a song from the queue; the following one replaces it if current."""
+        with self.lock:
+            self._sync()
+            del self.playlist[pos]
+            del self._versions[pos]
+            self._changed(pos)
+            if self.current is not None and self.current > pos:
+                self.current -= 1
+            elif self.current == pos:
+                self._elapsed = 0.0
+                self._started_at = self.clock.now()
+                if pos == len(self.playlist):
+                    self.current = None
+                    self.state = STATE_STOP
+        self.notify('playlist', 'player')
+
+    def _changed(self, start, end=None):
+        """Bump the queue version, for positions from start to end (or the end of the queue)."""
+        self.playlist_version += 1
+        end = len(self.playlist) if end is None else end
+        for pos in range(start, end):
+            self._versions[pos] = self.playlist_version
+
+    def changes(self, version, start=0, end=None):
+        """Positions changed since a queue version, between start and end."""
+        with self.lock:
+            end = len(self.playlist) if end is None else min(end, len(self.playlist))
+            return [pos for pos in range(start, end) if self._versions[pos] > version]
+
+    def play(self, pos=None):
+        with self.lock:
+            self._sync()
+            if pos is None:
+                pos = 0 if self.current is None else self.current
+            if not 0 <= pos < len(self.playlist):
+                raise CommandError(ACK_ERROR_ARG, "Bad song index")
+            if pos != self.current or self.state == STATE_STOP:
+                self._elapsed = 0.0
+            self.current = pos
+            self.state = STATE_PLAY
+            self._started_at = self.clock.now()
+        self.notify('player')
+
+    def pause(self):
+        with self.lock:
+            self._sync()
+            if self.state == STATE_PLAY:
+                self._elapsed = self.elapsed
+                self.state = STATE_PAUSE
+            elif self.state == STATE_PAUSE:
+                self.state = STATE_PLAY
+                self._started_at = self.clock.now()
+        self.notify('player')
+
+    def stop(self):
+        with self.lock:
+            self._sync()
+            self.state = STATE_STOP
+            self._elapsed = 0.0
+        self.notify('player')
+
+    def next(self):
+        with self.lock:
+            self._sync()
+            if self.current is not None and self.current + 1 < len(self.playlist):
+                self.play(self.current + 1)
+            elif self.current is not None and self.options['repeat']:
+                self.play(0)
+            else:
+                self.stop()
+                self.current = None
+
+    def previous(self):
+        with self.lock:
+            self._sync()
+            if self.current:
+                self.play(self.current - 1)
+
+    def seek(self, elapsed):
+        with self.lock:
+            self._sync()
+            self._elapsed = float(elapsed)
+            self._started_at = self.clock.now()
+        self.notify('player')
+
+    def set_volume(self, volume):
+        with self.lock:
+            self.volume = int(volume)
+        self.notify('mixer')
+
+    def set_option(self, name, value):
+        with self.lock:
+            self.options[name] = int(value)
+        self.notify('options')
+
+    def set_tags(self, pos=None, **tags):
+        """Change the tags of a queued song, as a radio stream would."""
+        with self.lock:
+            pos = self.current if pos is None else pos
+            self.playlist[pos].update(tags)
+            self._changed(pos, pos + 1)
+        self.notify('playlist', 'player')
+
+    def start_update(self):
+        """Start a database update; returns its job id."""
+        with self.lock:
+            self.updating_db = self._next_job
+            self._next_job += 1
+        self.notify('update')
+        return self.updating_db
+
+    def finish_update(self, **library):
+        """End the running database update, changing some library statistics."""
+        with self.lock:
+            self.updating_db = None
+            self.library.update(library)
+        self.notify('update', 'database')
+
+    def set_sticker(self, uri, name, value=None):
+        """Set a sticker of a song; None deletes it."""
+        with self.lock:
+            if value is None:
+                self.stickers.pop((uri, name), None)
+            else:
+                self.stickers[(uri, name)] = str(value)
+        self.notify('sticker')
+
+    def set_error(self, error):
+        with self.lock:
+            self.error = error
+        self.notify('player')
+
+    # Protocol views
+    # --------------
+
+    def status(self):
+        with self.lock:
+            self._sync()
+            status = [
+                ('volume', self.volume),
+                ('repeat', self.options['repeat']),
+                ('random', self.options['random']),
+                ('single', self.options['single']),
+                ('consume', self.options['consume']),
+                ('playlist', self.playlist_version),
+                ('playlistlength', len(self.playlist)),
+                ('state', self.state),
+            ]
+            if self.current is not None:
+                elapsed = self.elapsed
+                duration = self._duration(self.current)
+                status.extend([
+                    ('song', self.current),
+                    ('songid', self.playlist[self.current]['Id']),
+                ])
+                if self.current + 1 < len(self.playlist):
+                    status.extend([
+                        ('nextsong', self.current + 1),
+                        ('nextsongid', self.playlist[self.current + 1]['Id']),
+                    ])
+                if self.state != STATE_STOP:
+                    status.extend([
+                        ('time', '%d:%d' % (elapsed, duration)),
+                        ('elapsed', '%.3f' % elapsed),
+                        ('duration', '%.3f' % duration),
+                        ('bitrate', self.bitrate),
+                        ('audio', '44100:16:2'),
+                    ])
+            if self.updating_db is not None:
+                status.append(('updating_db', self.updating_db))
+            if self.error:
+                status.append(('error', self.error))
+            return status
+
+    def stats(self):
+        with self.lock:
+            return sorted(self.library.items()) + [
+                ('uptime', int(self.clock.now())),
+                ('playtime', 0),
+                ('db_update', 0),
+            ]
+
+    def list_tag(self, tag, filters=()):
+        """The sorted, distinct values of a tag in songs of the database matching (tag, value) filters."""
+        values = set()
+        with self.lock:
+            for song in self.database:
+                tags = dict((key.lower(), value) for key, value in song.items())
+                if all(tags.get(name.lower()) == value for name, value in filters):
+                    values.add(tags.get(tag.lower(), ''))
+        return sorted(values)
+
+    def sticker(self, uri, name):
+        with self.lock:
+            if (uri, name) not in self.stickers:
+                raise CommandError(ACK_ERROR_NO_EXIST, "no such sticker")
+            return self.stickers[(uri, name)]
+
+    def song_info(self, pos):
+        song = self.playlist[pos]
+        info = []
+        for key, value in song.items():
+            if key in ('Id', 'duration'):
+                continue
+            info.append((key, value))
+        duration = float(song.get('duration', 0))
+        info.extend([
+            ('Time', int(duration)),
+            ('duration', '%.3f' % duration),
+            ('Pos', pos),
+            ('Id', song['Id']),
+        ])
+        return info
+
+
+def _parse_range(arg, length):
+    if ':' in arg:
+        start, end = arg.split(':', 1)
+        return int(start), int(end) if end else length
+    pos = int(arg)
+    return pos, pos + 1
+
+
+class MPDHandler(socketserver.StreamRequestHandler):
+    """Handle a client connection to the FakeMPDServer."""
+
+    def setup(self):
+        super(MPDHandler, self).setup()
+        self.events = set()
+        self.events_lock = threading.Lock()
+        self.server.add_connection(self)
+        self.server.player.add_listener(self.on_event)
+
+    def finish(self):
+        self.server.player.remove_listener(self.on_event)
+        self.server.remove_connection(self)
+        try:
+            super(MPDHandler, self).finish()
+        except socket.error:
+            pass
+
+    def on_event(self, subsystems):
+        with self.events_lock:
+            self.events.update(subsystems)
+
+    def write_lines(self, lines):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        self.wfile.write(''.join('%s\n' % line for line in lines).encode('utf-8'))
+
+    def handle(self):
+        self.write_lines(['OK MPD %s' % PROTOCOL_VERSION])
+        command_list = None
+        list_ok = False
+
+        while True:
+            try:
+                line = self.rfile.readline()
+            except socket.error:
+                return
+            if not line:
+                return
+            line = line.decode('utf-8').rstrip('\n')
+            if self.server.consume_failure():
+                logger.debug("Dropping connection on %r", line)
+                return
+
+            if line in ('command_list_begin', 'command_list_ok_begin'):
+                command_list = []
+                list_ok = line == 'command_list_ok_begin'
+                continue
+            if command_list is not None and line != 'command_list_end':
+                command_list.append(line)
+                continue
+
+            if line == 'noidle':
+                # Outside of idle, MPD ignores it: the idle reply was already sent.
+                continue
+
+            if line == 'command_list_end':
+                commands, command_list = command_list or [], None
+            else:
+                commands, list_ok = [line], False
+
+            output = []
+            for index, command in enumerate(commands):
+                try:
+                    output.extend(self.run_command(command))
+                except CommandError as e:
+                    name = command.split(' ', 1)[0]
+                    output.append('ACK [%d@%d] {%s} %s' % (e.code, index, name, e.message))
+                    break
+                except _Close:
+                    return
+                if list_ok:
+                    output.append('list_OK')
+            else:
+                output.append('OK')
+            self.write_lines(output)
+
+    def run_command(self, line):
+        try:
+            args = shlex.split(line)
+        except ValueError:
+            raise CommandError(ACK_ERROR_ARG, "Invalid quoting")
+        if not args:
+            raise CommandError(ACK_ERROR_UNKNOWN, "No command given")
+        self.server.record(args)
+        command, args = args[0], args[1:]
+        method = getattr(self, 'cmd_%s' % command, None)
+        if method is None:
+            raise CommandError(ACK_ERROR_UNKNOWN, 'unknown command "%s"' % command)
+        try:
+            pairs = method(*args)
+        except (TypeError, ValueError, IndexError):
+            raise CommandError(ACK_ERROR_ARG, 'Invalid arguments for "%s"' % command)
+        return ['%s: %s' % pair for pair in pairs or ()]
+
+    # Commands
+    # --------
+
+    def cmd_ping(self):
+        return []
+
+    def cmd_close(self):
+        raise _Close()
+
+    def cmd_password(self, password):
+        if self.server.password is not None and password != self.server.password:
+            raise CommandError(3, "incorrect password")
+
+    def cmd_status(self):
+        return self.server.player.status()
+
+    def cmd_list(self, tag, *args):
+        args = list(args)
+        start, end = 0, None
+        if len(args) >= 2 and args[-2] == 'window':
+            if not self.server.list_windows:
+                raise CommandError(ACK_ERROR_ARG, "Unknown filter type")
+            start, end = _parse_range(args[-1], None)
+            args = args[:-2]
+        if len(args) % 2:
+            raise CommandError(ACK_ERROR_ARG, "Incorrect arguments")
+        values = self.server.player.list_tag(tag, list(zip(args[::2], args[1::2])))
+        return [(tag.capitalize(), value) for value in values[start:end]]
+
+    def cmd_sticker(self, action, kind, uri, name, value=None):
+        if kind != 'song':
+            raise CommandError(ACK_ERROR_ARG, "unknown sticker domain")
+        player = self.server.player
+        if action == 'get':
+            return [('sticker', '%s=%s' % (name, player.sticker(uri, name)))]
+        elif action == 'set' and value is not None:
+            player.set_sticker(uri, name, value)
+        elif action == 'delete':
+            player.sticker(uri, name)
+            player.set_sticker(uri, name)
+        else:
+            raise CommandError(ACK_ERROR_ARG, "bad request")
+
+    def cmd_stats(self):
+        return self.server.player.stats()
+
+    def cmd_currentsong(self):
+        player = self.server.player
+        with player.lock:
+            if player.current_song is None:
+                return []
+            return player.song_info(player.current)
+
+    def cmd_playlistid(self, song_id=None):
+        player = self.server.player
+        with player.lock:
+            positions = range(len(player.playlist))
+            if song_id is not None:
+                positions = [pos for pos in positions if player.playlist[pos]['Id'] == int(song_id)]
+                if not positions:
+                    raise CommandError(ACK_ERROR_NO_EXIST, "No such song")
+            return [pair for pos in positions for pair in player.song_info(pos)]
+
+    def cmd_playlistinfo(self, pos_range=None):
+        player = self.server.player
+        with player.lock:
+            start, end = _parse_range(pos_range, len(player.playlist)) if pos_range else (0, len(player.playlist))
+            end = min(end, len(player.playlist))
+            return [pair for pos in range(start, end) for pair in player.song_info(pos)]
+
+    def cmd_plchanges(self, version, pos_range=None):
+        player = self.server.player
+        with player.lock:
+            start, end = _parse_range(pos_range, len(player.playlist)) if pos_range else (0, None)
+            return [pair for pos in player.changes(int(version), start, end) for pair in player.song_info(pos)]
+
+    def cmd_tagtypes(self, *args):
+        if args:
+            if args[0] not in ('clear', 'all', 'enable', 'disable'):
+                raise CommandError(ACK_ERROR_ARG, "Unknown sub command")
+            return []
+        return [('tagtype', tag) for tag in TAG_TYPES]
+
+    def _wait_for_input(self, timeout):
+        """Whether input is available, waiting for at most ``timeout`` seconds."""
+        # The next line may have been buffered along with the previous one.
+        self.connection.setblocking(False)
+        try:
+            buffered = self.rfile.peek(1)
+        finally:
+            self.connection.setblocking(True)
+        if buffered:
+            return True
+        readable, _w, _x = select.select([self.connection], [], [], timeout)
+        return bool(readable)
+
+    def cmd_idle(self, *subsystems):
+        while True:
+            with self.events_lock:
+                events = set(self.events)
+                if subsystems:
+                    events &= set(subsystems)
+                if events:
+                    self.events -= events
+                    return [('changed', event) for event in sorted(events)]
+
+            if self._wait_for_input(self.server.poll_interval):
+                line = self.rfile.readline()
+                if not line:
+                    raise _Close()
+                if line.decode('utf-8').strip() == 'noidle':
+                    return []
+                raise CommandError(ACK_ERROR_UNKNOWN, "Only \"noidle\" is allowed during idle")
+
+    def cmd_play(self, pos=None):
+        self.server.player.play(None if pos is None else int(pos))
+
+    def cmd_pause(self, value=None):
+        player = self.server.player
+        with player.lock:
+            paused = player.state == STATE_PAUSE
+            if value is None or bool(int(value)) != paused:
+                player.pause()
+
+    def cmd_stop(self):
+        self.server.player.stop()
+
+    def cmd_next(self):
+        self.server.player.next()
+
+    def cmd_previous(self):
+        self.server.player.previous()
+
+    def cmd_setvol(self, volume):
+        self.server.player.set_volume(volume)
+
+    def cmd_random(self, value):
+        self.server.player.set_option('random', value)
+
+    def cmd_repeat(self, value):
+        self.server.player.set_option('repeat', value)
+
+
+class _Close(Exception):
+    """Raised to close a client connection."""
+
+
+class FakeMPDServer(socketserver.ThreadingTCPServer):
+    """A fake MPD server, running in a background thread.
+
+    Attributes:
+        player (Player): the simulated player
+        password (str): the expected password, if any
+        latency (float): delay before each reply, in seconds
+        commands (deque): received commands, as argument lists; only the
+            last ``history`` ones are kept, if set
+        poll_interval (float): how often idling connections check for events
+        list_windows (bool): whether ``list`` accepts a window, as from MPD 0.24
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, player, host='127.0.0.1', port=0, password=None, latency=0, history=None):
+        super(FakeMPDServer, self).__init__((host, port), MPDHandler)
+        self.player = player
+        self.password = password
+        self.latency = latency
+        self.poll_interval = 0.01
+        self.list_windows = True
+        self.commands = collections.deque(maxlen=history)
+        self._connections = []
+        self._failures = 0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def address(self):
+        return self.server_address[:2]
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.disconnect_clients()
+        self.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.stop()
+
+    def add_connection(self, handler):
+        with self._lock:
+            self._connections.append(handler)
+
+    def remove_connection(self, handler):
+        with self._lock:
+            if handler in self._connections:
+                self._connections.remove(handler)
+
+    @property
+    def connection_count(self):
+        with self._lock:
+            return len(self._connections)
+
+    def record(self, args):
+        with self._lock:
+            self.commands.append(args)
+
+    def disconnect_clients(self):
+        """Abruptly close all client connections."""
+        with self._lock:
+            connections = list(self._connections)
+        for handler in connections:
+            try:
+                handler.connection.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+    def fail_next(self, count=1):
+        """Drop the connection upon the next ``count`` commands."""
+        with self._lock:
+            self._failures += count
+
+    def consume_failure(self):
+        with self._lock:
+            if self._failures:
+                self._failures -= 1
+                return True
+            return False
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2011-2013 Raphaël Barrois
+
+"""Clocks used for all timing decisions (retries, refresh, throttling).
+
+Code needing the time or a delay should use a Clock, defaulting to MONOTONIC;
+tests and simulations can use a VirtualClock instead, whose sleep() returns
+immediately, moving the virtual time to the deadline.
+"""
+
+import contextlib
+import heapq
+import itertools
+import threading
+import time
+
+
+class Clock(object):
+    """The system's monotonic clock."""
+
+    def now(self):
+        """The current time, in seconds."""
+        return time.monotonic()
+
+    def time(self):
+        """The wall clock time, in seconds since the epoch."""
+        return time.time()
+
+    def sleep(self, delay):
+        """Wait for ``delay`` seconds."""
+        if delay > 0:
+            time.sleep(delay)
+
+    def sleep_until(self, deadline):
+        """Wait until the clock reaches ``deadline``."""
+        self.sleep(deadline - self.now())
+
+
+MONOTONIC = Clock()
+
+
+class VirtualClock(Clock):
+    """A clock whose time only moves when asked to.
+
+    Sleeping jumps straight to the deadline, running the callbacks scheduled
+    with call_at() on the way, at their due time.
+
+    Attributes:
+        epoch (float): the wall clock time when now() is 0
+        slept (float): the total time spent in sleep()
+    """
+
+    def __init__(self, start=0.0, epoch=0.0):
+        self._now = start
+        self.epoch = epoch
+        self._lock = threading.RLock()
+        self._scheduled = []
+        self._sequence = itertools.count()
+        self.slept = 0.0
+
+    def now(self):
+        return self._now
+
+    def time(self):
+        return self.epoch + self._now
+
+    def sleep(self, delay):
+        if delay > 0:
+            self.slept += delay
+            self.advance(delay)
+
+    def advance(self, delay):
+        """Move time forward by ``delay`` seconds, running due callbacks."""
+        with self._lock:
+            deadline = self._now + delay
+            while self._scheduled and self._scheduled[0][0] <= deadline:
+                when, _seq, callback = heapq.heappop(self._scheduled)
+                self._now = max(self._now, when)
+                callback()
+            self._now = max(self._now, deadline)
+
+    def call_at(self, when, callback):
+        """Run ``callback`` once the time reaches ``when``."""
+        with self._lock:
+            heapq.heappush(self._scheduled, (when, next(self._sequence), callback))
+
+    def call_later(self, delay, callback):
+        """Run ``callback`` in ``delay`` seconds."""
+        self.call_at(self._now + delay, callback)
+
+
+class StepTimer(object):
+    """Measure the steps of a process, which may run concurrently.
+
+    Attributes:
+        steps (list of (str, float)): the name and duration of each finished
+            step, in seconds
+    """
+
+    def __init__(self, clock=MONOTONIC):
+        self.clock = clock
+        self.started = clock.now()
+        self.steps = []
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def step(self, name):
+        """Measure the enclosed block as step ``name``."""
+        start = self.clock.now()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.steps.append((name, self.clock.now() - start))
+
+    def elapsed(self):
+        """The time since the timer was created."""
+        return self.clock.now() - self.started
+
+    def summary(self):
+        with self._lock:
+            return ', '.join('%s %.1fms' % (name, duration * 1000) for name, duration in self.steps)
@@ -0,0 +1,377 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2011-2013 Raphaël Barrois
+
+"""Record and replay traces of MPD and LCDd sessions.
+
+A trace file starts with a header (magic and format version), followed by
+append-only records:
+- a fixed-size part: monotonic timestamp (double), kind (byte), payload
+  length (unsigned int), all little-endian;
+- the payload itself.
+
+Records hold raw MPD lines (sent and received), LCDd commands and replies,
+the start of each display update (tick), and JSON metadata about the
+configuration. Passwords sent to MPD are not recorded; trace files are only
+readable by their owner.
+
+A trace is replayed by answering the MPD commands of each tick with the
+recorded replies, while a MpdRunner talks to a real or fake LCDd server.
+"""
+
+import collections
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+
+from . import mpdwrapper
+from . import timing
+
+
+logger = logging.getLogger(__name__)
+
+
+MAGIC = b'MPDLCDTR'
+FORMAT_VERSION = 1
+
+_HEADER = struct.Struct('<8sH')
+_RECORD = struct.Struct('<dBI')
+
+KIND_META = 0
+KIND_TICK = 1
+KIND_MPD_CONNECT = 2
+KIND_MPD_SEND = 3
+KIND_MPD_RECV = 4
+KIND_LCD_SEND = 5
+KIND_LCD_RECV = 6
+
+KIND_NAMES = {
+    KIND_META: 'meta',
+    KIND_TICK: 'tick',
+    KIND_MPD_CONNECT: 'mpd-connect',
+    KIND_MPD_SEND: 'mpd-send',
+    KIND_MPD_RECV: 'mpd-recv',
+    KIND_LCD_SEND: 'lcd-send',
+    KIND_LCD_RECV: 'lcd-recv',
+}
+
+
+Record = collections.namedtuple('Record', ['time', 'kind', 'payload'])
+
+REDACTED_PASSWORD = 'password "***"\n'
+
+
+def redact(command):
+    """Hide the password of a MPD ``password`` command."""
+    if command.startswith('password '):
+        return REDACTED_PASSWORD
+    return command
+
+
+class TraceError(Exception):
+    pass
+
+
+class TraceWriter(object):
+    """Append records to a trace file.
+
+    Records are buffered, and flushed on each tick.
+
+    Attributes:
+        path (str): the trace file
+        clock (mpdlcd.timing.Clock): the clock timestamping records
+    """
+
+    def __init__(self, path, clock=timing.MONOTONIC):
+        self.path = path
+        self.clock = clock
+        self._lock = threading.Lock()
+        # Traces may be shared, but hold the details of the music library.
+        self._file = os.fdopen(os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600), 'ab')
+        if self._file.tell() == 0:
+            self._file.write(_HEADER.pack(MAGIC, FORMAT_VERSION))
+        else:
+            with open(path, 'rb') as f:
+                _check_header(f.read(_HEADER.size), path)
+
+    def record(self, kind, payload=b''):
+        if not isinstance(payload, bytes):
+            payload = payload.encode('utf-8')
+        data = _RECORD.pack(self.clock.now(), kind, len(payload)) + payload
+        with self._lock:
+            self._file.write(data)
+
+    def meta(self, **values):
+        """Record configuration values, used when replaying the trace."""
+        self.record(KIND_META, json.dumps(values, sort_keys=True))
+
+    def trace_mpd(self, client):
+        """Record the traffic of a freshly connected mpd.MPDClient."""
+        self.record(KIND_MPD_CONNECT, client.mpd_version)
+        client._rbfile = RecordingReader(client._rbfile, self)
+        client._wfile = RecordingWriter(client._wfile, self)
+
+    def tick(self):
+        """Record the start of a display update."""
+        self.record(KIND_TICK)
+        self.flush()
+
+    def flush(self):
+        with self._lock:
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def _check_header(data, path):
+    if len(data) < _HEADER.size:
+        raise TraceError("%s: truncated header" % path)
+    magic, version = _HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise TraceError("%s is not a mpdlcd trace" % path)
+    if version != FORMAT_VERSION:
+        raise TraceError("%s: unsupported trace version %d" % (path, version))
+
+
+class TraceReader(object):
+    """Iterate over the records of a trace file, through a memory mapping.
+
+    A truncated record at the end of the file (e.g after a crash) is ignored.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def __iter__(self):
+        with open(self.path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size <= _HEADER.size:
+                _check_header(f.read(), self.path)
+                return
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                _check_header(data[:_HEADER.size], self.path)
+                for record in self._records(data):
+                    yield record
+            finally:
+                data.close()
+
+    def _records(self, data):
+        offset = _HEADER.size
+        end = len(data)
+        while offset + _RECORD.size <= end:
+            timestamp, kind, length = _RECORD.unpack_from(data, offset)
+            offset += _RECORD.size
+            if offset + length > end:
+                logger.warning("%s: ignoring truncated record at offset %d", self.path, offset)
+                return
+            yield Record(timestamp, kind, data[offset:offset + length])
+            offset += length
+
+
+# Recording
+# =========
+
+
+class RecordingReader(object):
+    """Record lines read from a MPD connection."""
+
+    def __init__(self, stream, tracer):
+        self._stream = stream
+        self._tracer = tracer
+
+    def readline(self):
+        line = self._stream.readline()
+        self._tracer.record(KIND_MPD_RECV, line)
+        return line
+
+    def read(self, amount):
+        data = self._stream.read(amount)
+        self._tracer.record(KIND_MPD_RECV, data)
+        return data
+
+    def close(self):
+        self._stream.close()
+
+
+class RecordingWriter(object):
+    """Record lines written to a MPD connection, without passwords."""
+
+    def __init__(self, stream, tracer):
+        self._stream = stream
+        self._tracer = tracer
+
+    def write(self, text):
+        self._tracer.record(KIND_MPD_SEND, redact(text))
+        return self._stream.write(text)
+
+    def flush(self):
+        self._stream.flush()
+
+    def close(self):
+        self._stream.close()
+
+
+# Replaying
+# =========
+
+
+class Tick(object):
+    """The records of a display update.
+
+    Attributes:
+        time (float): when the update started, or None for records preceding
+            the first update
+        exchanges (list of (bytes, bytes list)): MPD commands, with the lines
+            received until the next command
+        lcd_commands (int): number of commands sent to LCDd
+    """
+
+    def __init__(self, time):
+        self.time = time
+        self.exchanges = []
+        self.lcd_commands = 0
+
+
+class TraceSession(object):
+    """Information about a recorded session, and its display updates.
+
+    Attributes:
+        meta (dict): the recorded configuration
+        mpd_version (str): the version announced by the MPD server
+        screen_size ((int, int)): the width and height of the LCD screen
+    """
+
+    def __init__(self, path):
+        self.reader = TraceReader(path)
+        self.meta = {}
+        self.mpd_version = '0.0.0'
+        self.screen_size = None
+
+    def ticks(self):
+        """Yield Tick objects; records before the first tick are in a Tick(None)."""
+        tick = Tick(None)
+        for record in self.reader:
+            if record.kind == KIND_TICK:
+                yield tick
+                tick = Tick(record.time)
+            elif record.kind == KIND_MPD_SEND:
+                tick.exchanges.append((record.payload, []))
+            elif record.kind == KIND_MPD_RECV:
+                if tick.exchanges:
+                    tick.exchanges[-1][1].append(record.payload)
+            elif record.kind == KIND_LCD_SEND:
+                tick.lcd_commands += 1
+            elif record.kind == KIND_LCD_RECV:
+                self._read_lcd_reply(record.payload)
+            elif record.kind == KIND_MPD_CONNECT:
+                self.mpd_version = record.payload.decode('utf-8')
+            elif record.kind == KIND_META:
+                self.meta.update(json.loads(record.payload.decode('utf-8')))
+        yield tick
+
+    def _read_lcd_reply(self, payload):
+        bits = payload.decode('utf-8', 'replace').split()
+        if bits[:1] == ['connect'] and len(bits) >= 10:
+            self.screen_size = (int(bits[7]), int(bits[9]))
+
+
+class MPDReplay(object):
+    """Answer MPD commands from recorded exchanges.
+
+    Commands are matched with the unused exchanges of the current tick; if
+    none matches, the last answer for that command is reused, or an empty
+    reply is sent.
+
+    Attributes:
+        misses (int): number of commands not found in their tick
+    """
+
+    EMPTY_REPLY = [b'OK\n']
+
+    def __init__(self):
+        self.exchanges = []
+        self.last_replies = {}
+        self.misses = 0
+
+    def start_tick(self, tick):
+        self.exchanges = list(tick.exchanges)
+
+    def answer(self, command):
+        for index, (recorded, replies) in enumerate(self.exchanges):
+            if recorded == command:
+                del self.exchanges[index]
+                if not replies or replies[-1]:
+                    # Don't replay disconnections outside of their tick.
+                    # Commands within a command list have no reply of their own.
+                    self.last_replies[command] = replies
+                return replies
+        self.misses += 1
+        return self.last_replies.get(command, self.EMPTY_REPLY)
+
+
+class _ReplaySocket(object):
+    def settimeout(self, timeout):
+        pass
+
+    def close(self):
+        pass
+
+
+class _ReplayReader(object):
+    def __init__(self, lines):
+        self._lines = lines
+
+    def readline(self):
+        if not self._lines:
+            return b''
+        return self._lines.popleft()
+
+    def read(self, amount):
+        return self.readline()
+
+    def close(self):
+        pass
+
+
+class _ReplayWriter(object):
+    def __init__(self, replay, lines):
+        self._replay = replay
+        self._lines = lines
+
+    def write(self, text):
+        # Passwords were redacted when recording.
+        self._lines.extend(self._replay.answer(redact(text).encode('utf-8')))
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class ReplayMPDConnection(mpdwrapper.InstrumentedMPDClient):
+    """A mpd.MPDClient reading its replies from a MPDReplay."""
+
+    def __init__(self, replay, mpd_version):
+        super(ReplayMPDConnection, self).__init__()
+        self.replay = replay
+        self.replay_version = mpd_version
+
+    def connect(self, host, port=None, timeout=None):
+        lines = collections.deque()
+        self._sock = _ReplaySocket()
+        self._rbfile = _ReplayReader(lines)
+        self._wfile = _ReplayWriter(self.replay, lines)
+        self.mpd_version = self.replay_version
+
+
+class ReplayMPDClient(mpdwrapper.MPDClient):
+    """A mpdwrapper.MPDClient replaying a trace."""
+
+    def __init__(self, replay, mpd_version, *args, **kwargs):
+        super(ReplayMPDClient, self).__init__(*args, **kwargs)
+        self._client = ReplayMPDConnection(replay, mpd_version)
@@ -3,9 +3,16 @@
 
 import functools
 import logging
+import random
 import socket
 import time
 
+from . import metrics
+from . import timing
+
+
+logger = logging.getLogger(__name__)
+
 
 class AutoRetryConfig(object):
     """Hold the auto-retry configuration.
@@ -30,22 +37,73 @@ class AutoRetryConfig(object):
         self.retry_attempts = retry_attempts
 
 
+class TimeoutConfig(object):
+    """Hold the I/O timeouts of a connection, in seconds.
+
+    A zero value disables a timeout; it is then stored as None.
+
+    Attributes:
+        connect_timeout (float): maximum time to establish a connection
+        read_timeout (float): maximum time to wait for each line of a reply
+        request_timeout (float): maximum time for a whole request, from
+            sending it to reading the last line of its reply
+    """
+    def __init__(self, connect_timeout=0, read_timeout=0, request_timeout=0):
+        for name, value in [('connect', connect_timeout), ('read', read_timeout), ('request', request_timeout)]:
+            if value < 0:
+                raise ValueError('%s_timeout should be positive or zero.' % name)
+        self.connect_timeout = connect_timeout or None
+        self.read_timeout = read_timeout or None
+        self.request_timeout = request_timeout or None
+
+    def line_timeout(self, deadline):
+        """Timeout for reading a line, given the deadline of the request.
+
+        Args:
+            deadline (float): the time.monotonic() deadline, or None
+
+        Raises:
+            socket.timeout: the deadline has passed.
+        """
+        if deadline is None:
+            return self.read_timeout
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise socket.timeout('Request timed out after %.1fs' % self.request_timeout)
+        if self.read_timeout is None:
+            return remaining
+        return min(remaining, self.read_timeout)
+
+    def deadline(self):
+        """The deadline for a request starting now, or None."""
+        if self.request_timeout is None:
+            return None
+        return time.monotonic() + self.request_timeout
+
+
 class AutoRetryCandidate(object):
     """Base class for objects wishing to use the @auto_retry decorator.
 
     Attributes:
         _retry_config (AutoRetryConfig): auto-retry configuration
         _retry_logger (logging.Logger): where to log connection failures
+        _retry_errors (exception class tuple): errors triggering a retry
+        _clock (mpdlcd.timing.Clock): the clock used for waiting
     """
+    _retry_errors = (socket.error,)
 
-    def __init__(self, retry_config, logger=None, *args, **kwargs):
+    def __init__(self, retry_config, logger=None, clock=None, *args, **kwargs):
         self._retry_config = retry_config
+        self._clock = clock or timing.MONOTONIC
 
         if not logger:
             logger = logging.getLogger(self.__class__.__module__)
         self._retry_logger = logger
         super(AutoRetryCandidate, self).__init__(*args, **kwargs)
 
+    def _on_retry_error(self, error):
+        """Called after a failed attempt, before retrying."""
+
 
 def auto_retry(fun):
     """Decorator for retrying method calls, based on instance parameters."""
@@ -62,9 +120,11 @@ def auto_retry(fun):
         while remaining_tries >= 0:
             try:
                 return fun(instance, *args, **kwargs)
-            except socket.error as e:
+            except instance._retry_errors as e:
                 last_error = e
                 instance._retry_logger.warning('Connection failed: %s', e)
+                metrics.RETRIES.labels(instance.__class__.__name__).inc()
+                instance._on_retry_error(e)
 
             remaining_tries -= 1
             if remaining_tries == 0:
@@ -72,7 +132,7 @@ def auto_retry(fun):
                 break
 
             # Wait a bit
-            time.sleep(current_wait)
+            instance._clock.sleep(current_wait)
             current_wait *= retry_backoff
 
         # All attempts failed, let's raise the last error.
@@ -81,6 +141,154 @@ def auto_retry(fun):
     return decorated
 
 
+CONNECTION_DISCONNECTED = 'disconnected'
+CONNECTION_CONNECTED = 'connected'
+CONNECTION_BACKING_OFF = 'backing-off'
+CONNECTION_RECONNECTING = 'reconnecting'
+CONNECTION_CIRCUIT_OPEN = 'circuit-open'
+
+
+class ConnectionState(object):
+    """Track the state of a connection, and when to attempt reconnecting.
+
+    Nothing here sleeps: callers check can_attempt() before connecting, and
+    report the outcome with succeeded() or failed().
+
+    After a failed attempt, the next one is delayed by ``retry_wait``, then
+    multiplied by ``retry_backoff`` on each consecutive failure, with some
+    random jitter.
+    After ``retry_attempts`` consecutive failures, the circuit breaker opens:
+    the server is considered dead, and only probed every
+    ``retry_wait * retry_backoff ** retry_attempts`` seconds.
+
+    A lost connection (as opposed to a failed attempt) may be re-established
+    right away.
+
+    Attributes:
+        name (str): the name of the server, for logging
+        state (str): one of the CONNECTION_* states
+        failures (int): consecutive failed attempts
+        next_attempt (float): the earliest time for the next attempt
+        jitter (float): delays are multiplied by a random factor within
+            [1 - jitter, 1 + jitter]
+    """
+
+    JITTER = 0.2
+
+    def __init__(self, retry_config, name='', clock=None, jitter=JITTER, rng=None):
+        self.retry_config = retry_config
+        self.name = name
+        self.clock = clock or timing.MONOTONIC
+        self.jitter = jitter
+        self._rng = rng or random.Random()
+        self.state = CONNECTION_DISCONNECTED
+        self.failures = 0
+        self.next_attempt = self.clock.now()
+
+    def __repr__(self):
+        return '<ConnectionState %s: %s, %d failures>' % (self.name, self.state, self.failures)
+
+    @property
+    def connected(self):
+        return self.state == CONNECTION_CONNECTED
+
+    @property
+    def circuit_open(self):
+        return self.state == CONNECTION_CIRCUIT_OPEN
+
+    def can_attempt(self):
+        """Whether a connection attempt may be made now."""
+        return not self.connected and self.clock.now() >= self.next_attempt
+
+    def retry_in(self):
+        """Time until the next allowed attempt."""
+        return max(0, self.next_attempt - self.clock.now())
+
+    def attempting(self):
+        self.state = CONNECTION_RECONNECTING
+
+    def succeeded(self):
+        if self.failures:
+            logger.info('%s: connected after %d failed attempts', self.name, self.failures)
+        self.state = CONNECTION_CONNECTED
+        self.failures = 0
+
+    def lost(self):
+        """An established connection was lost; reconnect at once."""
+        metrics.RETRIES.labels(self.name).inc()
+        self.state = CONNECTION_DISCONNECTED
+        self.next_attempt = self.clock.now()
+
+    def failed(self):
+        """A connection attempt failed; back off before the next one."""
+        metrics.RETRIES.labels(self.name).inc()
+        cfg = self.retry_config
+        self.failures += 1
+        threshold = max(cfg.retry_attempts, 1)
+        if self.failures >= threshold:
+            if not self.circuit_open:
+                logger.warning(
+                    '%s: giving up after %d failed attempts, probing every %.1fs',
+                    self.name, self.failures, cfg.retry_wait * cfg.retry_backoff ** threshold,
+                )
+            self.state = CONNECTION_CIRCUIT_OPEN
+            delay = cfg.retry_wait * cfg.retry_backoff ** threshold
+        else:
+            self.state = CONNECTION_BACKING_OFF
+            delay = cfg.retry_wait * cfg.retry_backoff ** (self.failures - 1)
+        delay *= self._rng.uniform(1 - self.jitter, 1 + self.jitter)
+        self.next_attempt = self.clock.now() + delay
+
+
+class TokenBucket(object):
+    """A token bucket, limiting the rate of some operation.
+
+    Attributes:
+        rate (float): number of tokens added per second
+        burst (int): maximum number of tokens stored
+        tokens (float): available tokens; may be negative after force()
+        clock (mpdlcd.timing.Clock): the clock used for refilling
+    """
+
+    def __init__(self, rate, burst=1, clock=timing.MONOTONIC):
+        if rate <= 0:
+            raise ValueError('rate should be positive.')
+        if burst < 1:
+            raise ValueError('burst should be at least 1.')
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.tokens = float(burst)
+        self.updated = clock.now()
+
+    def _refill(self):
+        now = self.clock.now()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def consume(self, amount=1):
+        """Take ``amount`` tokens, if available.
+
+        Returns:
+            bool: whether the tokens were available.
+        """
+        self._refill()
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return True
+        return False
+
+    def force(self, amount=1):
+        """Take ``amount`` tokens, even if that leaves the bucket in debt."""
+        self._refill()
+        self.tokens -= amount
+
+    def delay(self, amount=1):
+        """Time to wait until ``amount`` tokens are available."""
+        self._refill()
+        return max(0, (amount - self.tokens) / self.rate)
+
+
 def extract_pattern(fmt):
     """Extracts used strings from a %(foo)s pattern."""
     class FakeDict(object):
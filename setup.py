@@ -37,7 +37,7 @@ setup(
     download_url="http://pypi.python.org/pypi/mpdlcd/",
     keywords=['MPD', 'lcdproc', 'lcd'],
     packages=find_packages(exclude=['tests']),
-    scripts=['bin/mpdlcd'],
+    scripts=['bin/mpdlcd', 'bin/mpdlcd-bench'],
     license='MIT',
     setup_requires=[
         'setuptools>=0.8',
@@ -45,6 +45,10 @@ setup(
     install_requires=[
         'python_mpd2',
     ],
+    extras_require={
+        # Spectrum and VU meter fields
+        'audio': ['numpy'],
+    },
     tests_require=[],
     zip_safe=False,
     classifiers=[
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2011-2013 Raphaël Barrois
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from mpdlcd import audio
+from mpdlcd import bench
+from mpdlcd import cli
+from mpdlcd import metrics
+from mpdlcd import mpdhooks
+from mpdlcd import timing
+
+numpy = audio.numpy
+
+RATE = 44100
+
+
+def sine(frequency, amplitude=1.0, count=4096, channels=2):
+    """16 bits PCM data of a sine."""
+    times = numpy.arange(count) / float(RATE)
+    wave = amplitude * 32767 * numpy.sin(2 * numpy.pi * frequency * times)
+    return numpy.repeat(wave.astype('<i2')[:, None], channels, axis=1).tobytes()
+
+
+@unittest.skipIf(numpy is None, "NumPy is not installed")
+class AnalysisTest(unittest.TestCase):
+    def samples(self, data):
+        return numpy.frombuffer(data, dtype='<i2').reshape(-1, 2) / 32768.0
+
+    def test_bands(self):
+        levels = audio.band_levels(self.samples(sine(1000, count=2048)), 8, RATE)
+        loudest = levels.index(max(levels))
+        self.assertAlmostEqual(1.0, levels[loudest], delta=0.05)
+        # 40Hz to 16kHz in 8 bands: 1kHz is in the 5th one.
+        self.assertEqual(4, loudest)
+        self.assertLess(max(levels[:3] + levels[6:]), 0.2)
+
+    def test_vu(self):
+        self.assertAlmostEqual(1.0, max(audio.vu_levels(self.samples(sine(440)))), delta=0.01)
+        # -6dB on a 60dB scale
+        self.assertAlmostEqual(0.9, max(audio.vu_levels(self.samples(sine(440, amplitude=0.5)))), delta=0.01)
+        self.assertEqual([0.0, 0.0], audio.vu_levels(numpy.zeros((1024, 2))))
+
+    def test_format(self):
+        self.assertEqual((48000, 16, 1), audio.parse_format('48000:16:1'))
+        with self.assertRaises(audio.AudioFormatError):
+            audio.parse_format('44100:24:2')
+        with self.assertRaises(audio.AudioFormatError):
+            audio.parse_format('44100:16')
+
+
+@unittest.skipIf(numpy is None, "NumPy is not installed")
+class AudioSourceTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = timing.VirtualClock()
+        self.source = audio.AudioSource('unused', window=1024, clock=self.clock)
+
+    def test_ring(self):
+        data = numpy.arange(3000, dtype='<i2').repeat(2).tobytes()
+        # Samples may be split anywhere.
+        self.source.feed(data[:1001])
+        self.source.feed(data[1001:])
+        samples = self.source.samples()
+        self.assertEqual((1024, 2), samples.shape)
+        self.assertEqual(list(range(1976, 3000)), [int(value) for value in samples[:, 0] * 32768])
+
+    def test_frames(self):
+        first = self.source.frame()
+        self.assertIsNone(first.samples)
+        self.assertEqual([0.0] * 4, first.bands(4))
+
+        self.source.feed(sine(440))
+        frame = self.source.frame()
+        self.assertNotEqual(first.sequence, frame.sequence)
+        self.assertAlmostEqual(1.0, frame.vu(), delta=0.01)
+        # No new data: same frame
+        self.assertIs(frame, self.source.frame())
+
+        # Playback stopped
+        self.clock.advance(1)
+        silent = self.source.frame()
+        self.assertIsNone(silent.samples)
+        self.assertIs(silent, self.source.frame())
+
+    def test_fifo(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'mpd.fifo')
+        os.mkfifo(path)
+        source = audio.AudioSource(path).start()
+        self.addCleanup(source.stop)
+
+        def play():
+            with open(path, 'wb') as fifo:
+                fifo.write(sine(440, count=RATE // 10))
+        writer = threading.Thread(target=play)
+        writer.start()
+        writer.join(5)
+
+        deadline = time.monotonic() + 5
+        while source.frame().samples is None and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertAlmostEqual(1.0, source.frame().vu(), delta=0.01)
+
+
+@unittest.skipIf(numpy is None, "NumPy is not installed")
+class AudioFieldsTest(unittest.TestCase):
+    def setUp(self):
+        self.env = bench.BenchEnvironment(lines=1)
+        self.addCleanup(self.env.close)
+        self.source = audio.AudioSource('unused', clock=self.env.clock)
+        self.env.runner.reload_pattern(
+            cli._make_patterns(['{spectrum bands=8} {vu}'], clock=self.env.clock),
+            hook_registry=mpdhooks.HookRegistry(clock=self.env.clock, hook_options={'audio': {'source': self.source}}),
+        )
+
+    def test_render(self):
+        env = self.env
+        env.player.play()
+        self.source.feed(sine(1000))
+        env.runner.update()
+        line = env.lcdd.render()[0]
+        # A single band, and a full VU meter
+        self.assertEqual('    |   ', line[:8])
+        self.assertEqual('=' * 11, line[9:])
+
+        # Stopping clears them.
+        env.player.stop()
+        env.runner.update()
+        self.assertEqual('', env.lcdd.render()[0].strip())
+
+    def test_frames(self):
+        """Frames only run local hooks, and are dropped when late."""
+        env = self.env
+        runner = env.runner
+        env.player.play()
+        runner.update()
+        runner.running = True
+        self.assertEqual(0.1, runner.frame_interval())
+
+        polls = []
+        original = runner.update_frame
+
+        def update_frame():
+            polls.append(env.clock.now())
+            self.source.feed(sine(1000 * len(polls), count=512))
+            original()
+        runner.update_frame = update_frame
+
+        roundtrips = metrics.ROUNDTRIPS.labels('mpd')
+        before = roundtrips.value
+        runner.play_frames(1)
+        self.assertEqual(9, len(polls))
+        self.assertEqual(before, roundtrips.value)
+
+        # Slow frames are dropped.
+        def slow_frame():
+            polls.append(env.clock.now())
+            env.clock.advance(0.25)
+        runner.update_frame = slow_frame
+        del polls[:]
+        runner.play_frames(1)
+        self.assertEqual(3, len(polls))
+
+
+if __name__ == '__main__':  # pragma: no cover
+    unittest.main()
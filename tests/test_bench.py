@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2011-2013 Raphaël Barrois
+
+import unittest
+
+from mpdlcd import bench
+
+
+class PercentileTest(unittest.TestCase):
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(50, bench.percentile(values, 0.5))
+        self.assertEqual(99, bench.percentile(values, 0.99))
+        self.assertEqual(3, bench.percentile([3], 0.99))
+        self.assertIsNone(bench.percentile([], 0.5))
+
+
+class CompareTest(unittest.TestCase):
+    def test_regressions(self):
+        baseline = {
+            'steady/4': {'ticks_per_second': 1000, 'latency_p99': 0.002, 'commands_per_event': 1.0},
+            'skipping/4': {'ticks_per_second': 1000},
+        }
+        results = {
+            'steady/4': {'ticks_per_second': 700, 'latency_p99': 0.0021, 'commands_per_event': 2.0},
+            'stream/4': {'ticks_per_second': 1},
+        }
+        regressions = bench.compare(results, baseline, tolerance=0.2)
+        self.assertEqual(2, len(regressions))
+        self.assertIn('steady/4: ticks_per_second', regressions[0])
+        self.assertIn('steady/4: commands_per_event', regressions[1])
+
+    def test_improvements(self):
+        baseline = {'steady/4': {'ticks_per_second': 1000, 'latency_p50': 0.002}}
+        results = {'steady/4': {'ticks_per_second': 2000, 'latency_p50': 0.001}}
+        self.assertEqual([], bench.compare(results, baseline))
+
+
+class ScenarioTest(unittest.TestCase):
+    def test_scenarios(self):
+        for name, scenario in bench.SCENARIOS.items():
+            result = bench.run_scenario(scenario(), lines=4, ticks=20)
+            summary = result.summary()
+            self.assertEqual(20, summary['ticks'], name)
+            self.assertGreater(summary['ticks_per_second'], 0, name)
+            self.assertIsNotNone(summary['latency_p99'], name)
+
+    def test_skipping(self):
+        summary = bench.run_scenario(bench.SkippingScenario(), lines=4, ticks=20).summary()
+        # Artist, album and title lines
+        self.assertEqual(3, summary['commands_per_event'])
+
+
+if __name__ == '__main__':  # pragma: no cover
+    unittest.main()
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2011-2013 Raphaël Barrois
+
+import time
+import unittest
+
+from mpdlcd import bench
+from mpdlcd import browser
+from mpdlcd.testing import fake_mpd
+
+
+class PageCacheTest(unittest.TestCase):
+    def test_lru(self):
+        cache = browser.PageCache(size=2)
+        cache.put('a', [1])
+        cache.put('b', [2])
+        self.assertEqual([1], cache.get('a'))
+        cache.put('c', [3])
+        # 'b' was the least recently used.
+        self.assertNotIn('b', cache)
+        self.assertEqual([1], cache.get('a'))
+        self.assertEqual(2, len(cache))
+
+
+class LibraryBrowserTest(unittest.TestCase):
+    def setUp(self):
+        self.env = bench.BenchEnvironment(lines=4)
+        self.addCleanup(self.env.close)
+        self.env.player.database = [
+            fake_mpd.make_song(i, Artist='Artist %04d' % (i // 2), Album='Album %d' % i) for i in range(1000)
+        ]
+        self.browser = browser.LibraryBrowser(
+            self.env.runner.lcd, self.env.make_client, ref='MPD_browser', page_size=10, cache_pages=3,
+            clock=self.env.clock)
+        self.addCleanup(self.browser.loader.close)
+        self.env.runner.browser = self.browser
+        with self.env.runner.lcd.batch():
+            self.browser.setup()
+
+    def update(self):
+        self.browser.loader.wait(5)
+        self.env.runner.update()
+
+    def deliver(self, condition):
+        """Update until LCDd's notification was handled."""
+        deadline = time.monotonic() + 5
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.01)
+            self.env.runner.update()
+        self.update()
+
+    def list_commands(self):
+        return [command for command in self.env.mpd_server.commands if command[0] == 'list']
+
+    def test_setup(self):
+        items = [item.text for _client, item in self.env.lcdd.menu_items()]
+        self.assertEqual(['Artists', 'Albums'], items)
+        self.assertEqual('hidden', self.browser.screen.priority)
+
+    def test_browse(self):
+        env = self.env
+        env.lcdd.select_menu_item('mpdlcd_artists')
+        self.deliver(lambda: self.browser.active)
+        self.assertEqual('MPD_browser', env.lcdd.visible_screen().ref)
+        self.assertEqual(
+            ['Artists            1', '>Artist 0000', ' Artist 0001', ' Artist 0002'],
+            [line.rstrip() for line in env.lcdd.render()])
+
+        env.lcdd.press_key('Down')
+        self.deliver(lambda: self.browser.listings[-1].cursor == 1)
+        self.assertEqual(' Artist 0000', env.lcdd.render()[1].rstrip())
+        self.assertEqual('>Artist 0001', env.lcdd.render()[2].rstrip())
+
+        # Only windows of the list are fetched.
+        self.assertEqual([['list', 'artist', 'window', '0:10']], self.list_commands())
+
+        # Enter an artist
+        env.lcdd.press_key('Enter')
+        self.deliver(lambda: len(self.browser.listings) == 2)
+        self.assertEqual(
+            ['Artist 0001      1/2', '>Album 2', ' Album 3', ''],
+            [line.rstrip() for line in env.lcdd.render()])
+        self.assertEqual(['list', 'album', 'artist', 'Artist 0001', 'window', '0:10'], self.list_commands()[-1])
+
+        env.lcdd.press_key('Escape')
+        self.deliver(lambda: len(self.browser.listings) == 1)
+        self.assertEqual('>Artist 0001', env.lcdd.render()[2].rstrip())
+        env.lcdd.press_key('Escape')
+        self.deliver(lambda: not self.browser.active)
+        self.assertEqual('hidden', self.browser.screen.priority)
+        self.assertEqual('MPD', env.lcdd.visible_screen().ref)
+
+    def test_prefetch(self):
+        self.browser.open(browser.Listing('artist'))
+        self.update()
+        listing = self.browser.listings[-1]
+        for _i in range(7):
+            self.browser.key_pressed(browser.KEY_DOWN)
+        self.update()
+        self.assertEqual(['0:10'], [command[-1] for command in self.list_commands()])
+        # The next page is loaded before being reached.
+        self.browser.key_pressed(browser.KEY_DOWN)
+        self.update()
+        self.assertEqual(['0:10', '10:20'], [command[-1] for command in self.list_commands()])
+        self.browser.key_pressed(browser.KEY_DOWN)
+        self.browser.key_pressed(browser.KEY_DOWN)
+        self.update()
+        self.assertEqual('>Artist 0010', self.env.lcdd.render()[2].rstrip())
+
+        # Only the last pages are kept.
+        for _i in range(489):
+            self.browser.key_pressed(browser.KEY_DOWN)
+            self.browser.loader.wait(5)
+        self.update()
+        self.assertEqual(3, len(self.browser.loader.cache))
+        self.assertEqual(499, listing.cursor)
+        self.assertEqual(500, listing.length)
+        self.assertEqual('Artists      500/500', self.env.lcdd.render()[0])
+
+        # Going back refetches dropped pages.
+        self.browser.key_pressed(browser.KEY_UP)
+        for _i in range(30):
+            self.browser.key_pressed(browser.KEY_UP)
+        self.update()
+        self.assertEqual('>Artist 0468', self.env.lcdd.render()[1].rstrip())
+        self.assertEqual(2, [command[-1] for command in self.list_commands()].count('460:470'))
+
+    def test_without_windows(self):
+        """Without windows, each list is only fetched once."""
+        self.env.mpd_server.list_windows = False
+        self.browser.open(browser.Listing('artist'))
+        self.update()
+        for _i in range(60):
+            self.browser.key_pressed(browser.KEY_DOWN)
+            self.browser.loader.wait(5)
+        self.update()
+        self.assertEqual('>Artist 0060', self.env.lcdd.render()[1].rstrip())
+        # Dropped pages are taken from the same list.
+        for _i in range(60):
+            self.browser.key_pressed(browser.KEY_UP)
+            self.browser.loader.wait(5)
+        self.update()
+        self.assertEqual('>Artist 0000', self.env.lcdd.render()[1].rstrip())
+        self.assertEqual(
+            [['list', 'artist', 'window', '0:10'], ['list', 'artist']], self.list_commands())
+
+    def test_quit(self):
+        """Exiting closes the connection of the page loader."""
+        self.browser.open(browser.Listing('artist'))
+        self.update()
+        connections = self.env.mpd_server.connection_count
+        self.env.runner.quit()
+        deadline = time.monotonic() + 5
+        while self.env.mpd_server.connection_count == connections and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(connections - 1, self.env.mpd_server.connection_count)
+
+    def test_timeout(self):
+        self.browser.open(browser.Listing('album'))
+        self.update()
+        self.env.clock.advance(self.browser.timeout)
+        self.update()
+        self.assertFalse(self.browser.active)
+
+
+if __name__ == '__main__':  # pragma: no cover
+    unittest.main()
@@ -1,15 +1,23 @@
 # -*- coding: utf-8 -*-
 # Copyright (c) 2011-2013 Raphaël Barrois
 
+import time
 import unittest
 
 from mpdlcd import display_fields
+from mpdlcd import mpdhooks
+from mpdlcd import mpdwrapper
+from mpdlcd import timing
 
 
 class FieldRegistryTestCase(unittest.TestCase):
     def setUp(self):
+        self._saved_registry = display_fields.FieldRegistry._REGISTRY
         display_fields.FieldRegistry._REGISTRY = {}
 
+    def tearDown(self):
+        display_fields.FieldRegistry._REGISTRY = self._saved_registry
+
     def test_register(self):
         class SomeField(object):
             def __init__(self, ref):
@@ -127,6 +135,213 @@ class FieldRegistryTestCase(unittest.TestCase):
         self.assertRaises(display_fields.FieldRegistryError, reg.create, 'foo')
 
 
+class FakeWidget(object):
+    def __init__(self):
+        self.ref = 'fake'
+        self.texts = []
+
+    def set_text(self, text):
+        self.texts.append(text)
+
+    def set_length(self, length):
+        self.texts.append(length)
+
+
+class FieldThrottleTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = timing.VirtualClock(100.0)
+
+    def test_no_options(self):
+        """Without options, only identical writes are skipped."""
+        field = display_fields.BitRateField(ref=0, clock=self.clock)
+        widget = FakeWidget()
+        for bitrate in (128, 129, 129, 130):
+            field.status_changed(widget, {'bitrate': bitrate})
+        self.assertEqual(['128', '129', '130'], widget.texts)
+
+    def test_deadband(self):
+        field = display_fields.BitRateField(ref=0, deadband='8', clock=self.clock)
+        widget = FakeWidget()
+        for bitrate in (128, 131, 135, 136, 120):
+            field.status_changed(widget, {'bitrate': bitrate})
+        self.assertEqual(['128', '136', '120'], widget.texts)
+
+    def test_min_interval(self):
+        field = display_fields.BitRateField(ref=0, min_interval='5', clock=self.clock)
+        widget = FakeWidget()
+        field.status_changed(widget, {'bitrate': 128})
+        self.clock.advance(1)
+        field.status_changed(widget, {'bitrate': 129})
+        field.status_changed(widget, {'bitrate': 130})
+        field.flush(widget)
+        self.assertEqual(['128'], widget.texts)
+
+        # The latest value gets written once the delay expired.
+        self.clock.advance(4)
+        field.flush(widget)
+        self.assertEqual(['128', '130'], widget.texts)
+        field.flush(widget)
+        self.assertEqual(['128', '130'], widget.texts)
+
+    def test_hold_reverted(self):
+        """A delayed value reverting to the displayed one is dropped."""
+        field = display_fields.ElapsedTimeField(ref=0, hold='2', clock=self.clock)
+        widget = FakeWidget()
+        field.time_changed(widget, 10, 20)
+        self.clock.advance(1)
+        field.time_changed(widget, 11, 20)
+        field.time_changed(widget, 10, 20)
+        self.clock.advance(2)
+        field.flush(widget)
+        self.assertEqual(['00:10'], widget.texts)
+
+    def test_hold_alias(self):
+        """hold behaves as min_interval."""
+        texts = []
+        for option in ('min_interval', 'hold'):
+            clock = timing.VirtualClock(100.0)
+            field = display_fields.BitRateField(ref=0, clock=clock, **{option: '5'})
+            widget = FakeWidget()
+            for bitrate in (128, 129, 130, 131, 132, 133, 134):
+                field.status_changed(widget, {'bitrate': bitrate})
+                field.flush(widget)
+                clock.advance(2)
+            texts.append(widget.texts)
+        self.assertEqual(['128', '131', '134'], texts[0])
+        self.assertEqual(texts[0], texts[1])
+
+    def test_invalid_option(self):
+        with self.assertRaises(ValueError):
+            display_fields.BitRateField(ref=0, deadband='-1')
+
+
+class ClockFieldTestCase(unittest.TestCase):
+    def test_format(self):
+        clock = timing.VirtualClock(epoch=43200)
+        field = display_fields.ClockField(ref=0, clock=clock)
+        self.assertEqual(5, field.width)
+        self.assertEqual(60, field.resolution)
+        self.assertEqual([('clock', set(['%H:%M']))], list(field.register_hooks()))
+
+        widget = FakeWidget()
+        field.hook_changed('clock', widget, clock.time())
+        self.assertEqual([time.strftime('%H:%M', time.localtime(43200))], widget.texts)
+
+    def test_seconds(self):
+        field = display_fields.ClockField(ref=0, format='%H:%M:%S', clock=timing.VirtualClock())
+        self.assertEqual(8, field.width)
+        self.assertEqual(1, field.resolution)
+        self.assertEqual(60, display_fields.DateField(ref=0).resolution)
+
+    def test_variable_length(self):
+        """The width fits the longest day name, whatever the current day."""
+        friday = 86400 + 43200
+        field = display_fields.ClockField(ref=0, format='%A %H:%M', clock=timing.VirtualClock(epoch=friday))
+        self.assertEqual(len('Wednesday 00:00'), field.width)
+
+        widget = FakeWidget()
+        field.hook_changed('clock', widget, friday)
+        field.hook_changed('clock', widget, friday + 5 * 86400)
+        self.assertEqual([
+            time.strftime('%A %H:%M', time.localtime(friday)).ljust(15),
+            time.strftime('%A %H:%M', time.localtime(friday + 5 * 86400)),
+        ], widget.texts)
+        self.assertTrue(widget.texts[1].startswith('Wednesday '))
+
+        # Longer texts are truncated to an explicit width.
+        field = display_fields.DateField(ref=0, format='%A', width='3', clock=timing.VirtualClock(epoch=friday))
+        widget = FakeWidget()
+        field.hook_changed('clock', widget, friday + 5 * 86400)
+        self.assertEqual(['Wed'], widget.texts)
+
+
+class ProgressFieldTestCase(unittest.TestCase):
+    def test_pixel_changes(self):
+        """Only write when the bar length, in pixels, changes."""
+        field = display_fields.ProgressField(ref=0, clock=timing.VirtualClock())
+        field.width = 20
+        widget = FakeWidget()
+        for elapsed in range(241):
+            field.time_changed(widget, elapsed, 240)
+        self.assertEqual(list(range(101)), widget.texts)
+
+        field.state_changed(widget, display_fields.MPD_STOP)
+        field.time_changed(widget, None, None)
+        self.assertEqual(0, widget.texts[-1])
+        self.assertEqual(102, len(widget.texts))
+
+
+class SpectrumFieldTestCase(unittest.TestCase):
+    class FakeFrame(object):
+        def __init__(self, levels):
+            self.levels = levels
+
+        def bands(self, count):
+            return self.levels[:count]
+
+    def setUp(self):
+        self.clock = timing.VirtualClock(100.0)
+        self.bars = display_fields.WidgetGroup([FakeWidget(), FakeWidget()])
+
+    def texts(self):
+        return [bar.texts for bar in self.bars.widgets]
+
+    def test_write_options(self):
+        """Write options apply to each bar."""
+        field = display_fields.SpectrumField(ref=0, bands=2, min_interval='1', deadband='2', clock=self.clock)
+        field.hook_changed('audio', self.bars, self.FakeFrame([0.5, 0.5]))
+        self.assertEqual([[4], [4]], self.texts())
+
+        # The second bar is within the deadband.
+        self.clock.advance(0.5)
+        field.hook_changed('audio', self.bars, self.FakeFrame([1.0, 0.625]))
+        field.flush(self.bars)
+        self.assertEqual([[4], [4]], self.texts())
+        self.clock.advance(0.5)
+        field.flush(self.bars)
+        self.assertEqual([[4, 8], [4]], self.texts())
+
+
+class RatingFieldTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = timing.VirtualClock(100.0)
+
+    def test_deadband(self):
+        """Ratings are compared as numbers."""
+        field = display_fields.RatingField(ref=0, deadband='1', clock=self.clock)
+        widget = FakeWidget()
+        for rating in ('8', '4', '4.5', 'great', None, '10'):
+            field.hook_changed('rating', widget, rating)
+        self.assertEqual(['****.', '**...', 'great', '     ', '*****'], widget.texts)
+
+    def test_not_finite(self):
+        """Non-finite ratings are displayed as text."""
+        field = display_fields.RatingField(ref=0, deadband='1', clock=self.clock)
+        widget = FakeWidget()
+        for rating in ('nan', '8', 'inf', '-inf'):
+            field.hook_changed('rating', widget, rating)
+        self.assertEqual(['nan  ', '****.', 'inf  ', '-inf '], widget.texts)
+
+
+class QueueFieldsTestCase(unittest.TestCase):
+    def test_queue(self):
+        field = display_fields.QueueField(ref=0, width=7)
+        self.assertEqual([('queue', set(['queue']))], list(field.register_hooks()))
+        widget = FakeWidget()
+        field.hook_changed('queue', widget, mpdhooks.QueueState(11, 3400, []))
+        field.hook_changed('queue', widget, mpdhooks.QueueState(None, 3400, []))
+        field.hook_changed('queue', widget, mpdhooks.QueueState(None, 0, []))
+        self.assertEqual(["12/3400", " -/3400", "       "], widget.texts)
+
+    def test_next(self):
+        field = display_fields.NextSongField(ref=0, pos=2, width=20)
+        self.assertEqual([('queue', set(['next:2']))], list(field.register_hooks()))
+        widget = FakeWidget()
+        songs = [mpdwrapper.MPDSong(id=[str(i)], artist=['Artist'], title=['Song %d' % i]) for i in range(2)]
+        field.hook_changed('queue', widget, mpdhooks.QueueState(0, 3, songs))
+        field.hook_changed('queue', widget, mpdhooks.QueueState(1, 3, songs[:1]))
+        self.assertEqual(["Artist - Song 1", ""], widget.texts)
+
 
 if __name__ == '__main__':  # pragma: no cover
     unittest.main()
@@ -104,3 +104,19 @@ class DisplayPatternTests(unittest.TestCase):
         self.assertEqual("%(artist)s - %(title)s", field.format)
         self.assertEqual(2, field.speed)
         self.assertEqual(" - ", field.padding)
+
+    def test_write_options(self):
+        pattern = self.parse([
+            """{bitrate deadband=16,min_interval=2.5} {elapsed hold=1}""",
+        ])
+        field = self.select_field(display_fields.BitRateField, pattern.widgets)
+        self.assertEqual(16, field.throttle.deadband)
+        self.assertEqual(2.5, field.throttle.min_interval)
+        field = self.select_field(display_fields.ElapsedTimeField, pattern.widgets)
+        self.assertEqual(1, field.throttle.hold)
+
+    def test_shorter_pattern(self):
+        patterns = display_pattern.ScreenPatternList(field_registry=display_fields.FieldRegistry())
+        patterns.add(['{state} {elapsed}'])
+        # Vertically centered
+        self.assertEqual(('', '{state} {elapsed}'), patterns[4].lines)
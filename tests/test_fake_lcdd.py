@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2011-2013 Raphaël Barrois
+
+import time
+import unittest
+
+from mpdlcd import cli
+from mpdlcd import lcdrunner
+from mpdlcd import mpdhooks
+from mpdlcd import mpdwrapper
+from mpdlcd import timing
+from mpdlcd import utils
+from mpdlcd.testing import fake_lcdd
+from mpdlcd.testing import fake_mpd
+from mpdlcd.vendor.lcdproc import server
+
+
+class FakeLCDdTestCase(unittest.TestCase):
+    def setUp(self):
+        self.lcdd = fake_lcdd.FakeLCDdServer(width=16, height=2).start()
+        self.addCleanup(self.lcdd.stop)
+
+    def connect(self):
+        host, port = self.lcdd.address
+        lcd = server.Server(host, port)
+        lcd.start_session()
+        self.addCleanup(lcd.tn.close)
+        return lcd
+
+
+class ProtocolTest(FakeLCDdTestCase):
+    def test_hello(self):
+        lcd = self.connect()
+        self.assertEqual(16, lcd.server_info['screen_width'])
+        self.assertEqual(2, lcd.server_info['screen_height'])
+        self.assertEqual(['hello'], [command.line for command in self.lcdd.commands])
+
+    def test_render(self):
+        lcd = self.connect()
+        screen = lcd.add_screen('MPD')
+        screen.set_priority('foreground')
+        screen.add_string_widget('title', 'Hello', x=1, y=1)
+        screen.add_scroller_widget('artist', left=3, top=2, right=8, text='The Artist')
+        screen.add_icon_widget('state', x=16, y=2, name='PLAY')
+        self.assertEqual(['Hello           ', '  The Ar       >'], self.lcdd.render())
+
+        # Hidden screens are not displayed
+        screen.set_priority('hidden')
+        self.assertEqual([' ' * 16] * 2, self.lcdd.render())
+
+    def test_errors(self):
+        lcd = self.connect()
+        self.assertEqual('huh? Invalid screen id\n', lcd.request('widget_set nope w 1 1 "x"'))
+        self.assertEqual('huh? Invalid command "frobnicate"\n', lcd.request('frobnicate'))
+
+    def test_accounting(self):
+        lcd = self.connect()
+        screen = lcd.add_screen('MPD')
+        widget = screen.add_string_widget('title', 'Hello', x=1, y=1)
+        mark = self.lcdd.mark()
+        widget.set_text('World')
+        widget.set_text('!')
+        self.assertEqual(2, self.lcdd.count(since=mark))
+        self.assertEqual(2, self.lcdd.count(since=mark, name='widget_set'))
+        self.assertEqual(0, self.lcdd.count(since=mark, name='screen_add'))
+        self.assertEqual(['MPD', 'title', '1', '1', '!'], self.lcdd.commands[-1].args[1:])
+
+        times = [command.time for command in self.lcdd.commands]
+        self.assertEqual(sorted(times), times)
+
+    def test_disconnect(self):
+        lcd = self.connect()
+        lcd.add_screen('MPD')
+        self.assertEqual(1, len(self.lcdd.screens()))
+        lcd.tn.close()
+        deadline = time.monotonic() + 1
+        while self.lcdd.client_count and time.monotonic() < deadline:
+            time.sleep(0.001)
+
+        # Screens go away with their client.
+        self.assertEqual([], self.lcdd.screens())
+
+
+class CommandCostTest(unittest.TestCase):
+    """Check the number of LCDd commands caused by MPD events."""
+
+    def setUp(self):
+        self.clock = timing.VirtualClock(1000.0)
+        self.player = fake_mpd.Player(
+            [fake_mpd.make_song(i, duration=120) for i in range(3)],
+            clock=self.clock,
+        )
+        mpd_server = fake_mpd.FakeMPDServer(self.player).start()
+        self.addCleanup(mpd_server.stop)
+        self.lcdd = fake_lcdd.FakeLCDdServer(width=20, height=4).start()
+        self.addCleanup(self.lcdd.stop)
+
+        retry_config = utils.AutoRetryConfig(retry_attempts=1, retry_wait=0.01, retry_backoff=2)
+        mpd_host, mpd_port = mpd_server.address
+        mpd_client = mpdwrapper.MPDClient(host=mpd_host, port=mpd_port, retry_config=retry_config)
+        lcd_host, lcd_port = self.lcdd.address
+        lcd = lcdrunner.LcdProcServer(lcd_host, lcd_port)
+        self.addCleanup(lcd.tn.close)
+
+        self.runner = lcdrunner.MpdRunner(
+            mpd_client, lcd,
+            lcdproc_screen='MPD',
+            refresh_rate=cli.DEFAULT_REFRESH,
+            backlight_on=cli.DEFAULT_BACKLIGHT_ON,
+            priority_playing=cli.DEFAULT_PRIORITY,
+            priority_not_playing=cli.DEFAULT_PRIORITY,
+            retry_config=retry_config,
+        )
+        self.runner.setup_pattern(cli._make_patterns(cli.DEFAULT_PATTERNS), hook_registry=mpdhooks.HookRegistry())
+        mpd_client.connect()
+
+    def test_song_change(self):
+        self.player.play()
+        self.clock.advance(30)
+        self.runner.update()
+        self.assertEqual('Artist 0', self.lcdd.render()[0].strip())
+
+        mark = self.lcdd.mark()
+        self.player.next()
+        self.runner.update()
+        self.assertEqual('Artist 1', self.lcdd.render()[0].strip())
+        # 3 song lines, elapsed and remaining time
+        self.assertLessEqual(self.lcdd.count(since=mark, name='widget_set'), 5)
+
+        # Nothing changes: nothing is sent.
+        mark = self.lcdd.mark()
+        self.runner.update()
+        self.assertEqual(0, self.lcdd.count(since=mark))
+
+
+if __name__ == '__main__':  # pragma: no cover
+    unittest.main()
@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2011-2013 Raphaël Barrois
+
+import threading
+import unittest
+
+import mpd
+
+from mpdlcd import mpdhooks
+from mpdlcd import mpdwrapper
+from mpdlcd import timing
+from mpdlcd import utils
+from mpdlcd.testing import fake_mpd
+
+
+class FakeMPDTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = timing.VirtualClock(1000.0)
+        self.player = fake_mpd.Player(
+            [fake_mpd.make_song(i, duration=60) for i in range(3)],
+            clock=self.clock,
+        )
+        self.server = fake_mpd.FakeMPDServer(self.player).start()
+        self.addCleanup(self.server.stop)
+
+    def connect_raw(self):
+        client = mpd.MPDClient()
+        client.timeout = 5
+        client.connect(*self.server.address)
+        self.addCleanup(client.disconnect)
+        return client
+
+    def connect(self):
+        host, port = self.server.address
+        client = mpdwrapper.MPDClient(
+            host=host, port=port,
+            retry_config=utils.AutoRetryConfig(retry_attempts=1, retry_wait=0.01, retry_backoff=2),
+        )
+        client.connect()
+        return client
+
+
+class ProtocolTest(FakeMPDTestCase):
+    def test_stopped(self):
+        client = self.connect()
+        self.assertEqual('stop', client.state)
+        self.assertEqual((None, None), client.elapsed_and_total)
+        self.assertFalse(client.current_song)
+
+    def test_playback(self):
+        client = self.connect()
+        self.player.play()
+        self.clock.advance(15)
+        self.assertEqual('play', client.state)
+        self.assertEqual((15, 60), client.elapsed_and_total)
+        self.assertEqual('Song number 0', client.current_song.title)
+
+        # Move to the next song
+        self.clock.advance(60)
+        self.assertEqual((15, 60), client.elapsed_and_total)
+        self.assertEqual('Song number 1', client.current_song.title)
+
+        # Pause
+        self.player.pause()
+        self.clock.advance(100)
+        self.assertEqual('pause', client.state)
+        self.assertEqual((15, 60), client.elapsed_and_total)
+
+        # End of playlist
+        self.player.pause()
+        self.clock.advance(200)
+        self.assertEqual('stop', client.state)
+        self.assertFalse(client.current_song)
+
+    def test_hooks(self):
+        client = self.connect()
+        hook = mpdhooks.SongHook()
+        self.assertEqual((False, None), hook.handle(client, ('title',)))
+
+        self.player.play()
+        changed, song = hook.handle(client, ('title',))
+        self.assertTrue(changed)
+        self.assertEqual('Song number 0', song.title)
+
+        # Radio streams change titles
+        self.player.set_tags(Title="Live!")
+        changed, song = hook.handle(client, ('title',))
+        self.assertTrue(changed)
+        self.assertEqual('Live!', song.title)
+
+    def test_command_list(self):
+        client = self.connect_raw()
+        self.player.play(2)
+        client.command_list_ok_begin()
+        client.status()
+        client.currentsong()
+        status, song = client.command_list_end()
+        self.assertEqual('2', status['song'])
+        self.assertEqual('Song number 2', song['title'])
+
+    def test_playlistid_tagtypes(self):
+        client = self.connect_raw()
+        song_id = self.player.playlist[1]['Id']
+        songs = client.playlistid(song_id)
+        self.assertEqual(1, len(songs))
+        self.assertEqual('Song number 1', songs[0]['title'])
+        self.assertIn('Artist', client.tagtypes())
+        with self.assertRaises(mpd.CommandError):
+            client.playlistid(42)
+
+    def test_idle(self):
+        client = self.connect_raw()
+        threading.Timer(0.05, self.player.set_volume, [10]).start()
+        self.assertEqual(['mixer'], client.idle())
+
+        # Events are remembered until the next idle.
+        self.player.play()
+        self.player.set_option('random', 1)
+        self.assertEqual(['options'], client.idle('options'))
+        self.assertEqual(['player'], client.idle())
+
+    def test_disconnects(self):
+        client = self.connect_raw()
+        self.server.fail_next()
+        with self.assertRaises(mpd.ConnectionError):
+            client.status()
+
+        client.disconnect()
+        client.connect(*self.server.address)
+        self.assertEqual('stop', client.status()['state'])
+
+        self.server.disconnect_clients()
+        with self.assertRaises(mpd.ConnectionError):
+            client.status()
+
+    def test_plchanges(self):
+        client = self.connect_raw()
+        version = int(client.status()['playlist'])
+        self.player.move(2, 0)
+        self.assertEqual(['0', '1', '2'], [song['pos'] for song in client.plchanges(version)])
+
+        version = int(client.status()['playlist'])
+        self.player.set_tags(1, Title="Live!")
+        self.player.add(fake_mpd.make_song(3))
+        changes = client.plchanges(version, (0, 2))
+        self.assertEqual(['Live!'], [song['title'] for song in changes])
+
+    def test_list(self):
+        self.player.database = [
+            fake_mpd.make_song(i, Artist='Artist %d' % (i % 3), Album='Album %d' % i) for i in range(6)
+        ]
+        client = self.connect_raw()
+        self.assertEqual(
+            ['Artist 1', 'Artist 2'], [value['artist'] for value in client.list('artist', 'window', (1, 3))])
+        self.assertEqual(
+            ['Album 2', 'Album 5'], [value['album'] for value in client.list('album', 'artist', 'Artist 2')])
+
+
+class QueueHookTest(FakeMPDTestCase):
+    def setUp(self):
+        super(QueueHookTest, self).setUp()
+        for i in range(3, 5000):
+            self.player.add(fake_mpd.make_song(i, duration=60))
+        self.client = self.connect()
+        self.fetched = []
+        for method in ('queue_songs', 'queue_changes'):
+            self.spy(method)
+
+    def spy(self, name):
+        method = getattr(self.client, name)
+
+        def spied(*args):
+            songs = method(*args)
+            self.fetched.append((name, len(songs)))
+            return songs
+        setattr(self.client, name, spied)
+
+    def handle(self, hook, subhooks=('queue', 'next:1')):
+        del self.fetched[:]
+        self.client.fetch_snapshot()
+        return hook.handle(self.client, subhooks)
+
+    def test_window(self):
+        hook = mpdhooks.QueueHook(window=4)
+        self.player.play(10)
+        changed, queue = self.handle(hook)
+        self.assertTrue(changed)
+        self.assertEqual((10, 5000), queue[:2])
+        self.assertEqual(['Song number %d' % i for i in range(11, 15)], [song.title for song in queue.upcoming])
+        self.assertEqual([('queue_songs', 4)], self.fetched)
+
+        # Nothing changed
+        self.assertEqual((False, None), self.handle(hook))
+        self.assertEqual([], self.fetched)
+
+        # Next song: a single song enters the window.
+        self.player.next()
+        changed, queue = self.handle(hook)
+        self.assertTrue(changed)
+        self.assertEqual('Song number 12', queue.upcoming[0].title)
+        self.assertEqual([('queue_songs', 1)], self.fetched)
+
+    def test_reorder(self):
+        hook = mpdhooks.QueueHook(window=4)
+        self.player.play(10)
+        self.handle(hook)
+
+        # Moving a song across the whole queue only fetches changes in the window.
+        self.player.move(4000, 12)
+        changed, queue = self.handle(hook, ('queue', 'next:2'))
+        self.assertTrue(changed)
+        self.assertEqual(['Song number 4000', 'Song number 12'], [song.title for song in queue.upcoming[1:3]])
+        self.assertEqual([('queue_changes', 3)], self.fetched)
+
+        # Changes after the window are ignored.
+        self.player.move(4000, 4001)
+        self.assertEqual((False, None), self.handle(hook, ('queue', 'next:2')))
+        self.assertEqual([('queue_changes', 0)], self.fetched)
+
+        # Truncated queue
+        for _i in range(4988):
+            self.player.delete(12)
+        changed, queue = self.handle(hook)
+        self.assertEqual((10, 12), queue[:2])
+        self.assertEqual(['Song number 11'], [song.title for song in queue.upcoming])
+        self.assertEqual([('queue_changes', 0)], self.fetched)
+
+    def test_random(self):
+        hook = mpdhooks.QueueHook(window=4)
+        self.player.play(10)
+        self.player.set_option('random', 1)
+        changed, queue = self.handle(hook, ('queue', 'next:2'))
+        self.assertEqual(1, len(queue.upcoming))
+        self.assertEqual(None, hook.extract_key(queue, 'next:2'))
+
+
+if __name__ == '__main__':  # pragma: no cover
+    unittest.main()
@@ -0,0 +1,756 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2011-2013 Raphaël Barrois
+
+import socket
+import time
+import unittest
+
+from mpdlcd import bench
+from mpdlcd import cli
+from mpdlcd import lcdrunner
+from mpdlcd import metrics
+from mpdlcd import mpdhooks
+from mpdlcd import mpdwrapper
+from mpdlcd import timing
+from mpdlcd import utils
+from mpdlcd.testing import fake_lcdd
+from mpdlcd.testing import fake_mpd
+
+
+class CommandQueueTest(unittest.TestCase):
+    def test_priority(self):
+        queue = lcdrunner.CommandQueue()
+        queue.push(('s', 'song'), 2, 'song')
+        queue.push(('s', 'bitrate'), 2, 'bitrate')
+        queue.push(('s', 'elapsed'), 0, 'elapsed')
+        queue.push(('s', 'fixed'), 1, 'fixed')
+
+        self.assertEqual(4, len(queue))
+        self.assertEqual(['elapsed', 'fixed', 'song', 'bitrate'], [queue.pop() for _i in range(4)])
+        self.assertEqual(0, len(queue))
+
+    def test_merge(self):
+        queue = lcdrunner.CommandQueue()
+        queue.push(('s', 'song'), 2, 'song1')
+        queue.push(('s', 'bitrate'), 2, 'bitrate')
+        queue.push(('s', 'song'), 2, 'song2')
+
+        # The merged update keeps its place in the queue.
+        self.assertEqual(2, len(queue))
+        self.assertEqual(['song2', 'bitrate'], [queue.pop() for _i in range(2)])
+
+
+class ReconnectTest(unittest.TestCase):
+    def setUp(self):
+        self.env = bench.BenchEnvironment(lines=4)
+        self.addCleanup(self.env.close)
+        self.runner = self.env.runner
+        self.env.player.play()
+        self.runner.update()
+
+    def restart_mpd(self):
+        self.env.mpd_server = fake_mpd.FakeMPDServer(self.env.player, port=self.env.mpd_server.address[1]).start()
+
+    def test_mpd_offline(self):
+        env = self.env
+        env.mpd_server.stop()
+        self.runner.update()
+        self.assertTrue(self.runner.offline)
+        self.assertEqual('MPD offline', env.lcdd.render()[1].strip())
+        # Nothing waited.
+        self.assertEqual(0, env.clock.slept)
+
+        # No new attempt until the backoff expires.
+        connection = self.runner.client.connection
+        self.assertEqual(1, connection.failures)
+        self.runner.update()
+        self.assertEqual(1, connection.failures)
+
+        self.restart_mpd()
+        env.clock.advance(connection.retry_in())
+        self.runner.update()
+        self.assertFalse(self.runner.offline)
+        self.assertTrue(connection.connected)
+        self.assertEqual('Artist 0', env.lcdd.render()[0].strip())
+
+    def test_circuit_breaker(self):
+        env = self.env
+        env.mpd_server.stop()
+        connection = self.runner.client.connection
+        for _i in range(10):
+            self.runner.update()
+            env.clock.advance(connection.retry_in())
+        self.assertTrue(connection.circuit_open)
+        # Once open, attempts are spread out.
+        self.assertGreaterEqual(connection.retry_in(), 0)
+        env.clock.advance(1)
+        self.runner.update()
+        self.assertFalse(connection.can_attempt())
+
+    def test_lcdd_reconnect(self):
+        env = self.env
+        env.lcdd.disconnect_clients()
+        env.player.next()
+        self.runner.update()
+        self.assertFalse(self.runner.lcd_connection.connected)
+
+        # The screen is restored on the next update.
+        self.runner.update()
+        self.assertTrue(self.runner.lcd_connection.connected)
+        self.assertEqual('Artist 1', env.lcdd.render()[0].strip())
+
+    def test_lcdd_restore(self):
+        env = self.env
+        displayed = env.lcdd.render()
+        env.lcdd.disconnect_clients()
+        self.runner.lcd_connection.lost()
+
+        roundtrips = metrics.ROUNDTRIPS.labels('lcdproc')
+        before = roundtrips.value
+        mark = env.lcdd.mark()
+        self.assertTrue(self.runner._reconnect_lcd())
+        # hello, then all screens and widgets in a single batch.
+        self.assertEqual(2, roundtrips.value - before)
+        self.assertEqual(displayed, env.lcdd.render())
+
+        screens = dict((screen.ref, screen) for _client, screen in env.lcdd.screens())
+        self.assertEqual(sorted(self.runner.lcd.screens), sorted(screens))
+        self.assertEqual(sorted(self.runner.screen.widgets), sorted(screens[self.runner.screen.ref].widgets))
+        self.assertEqual('hidden', screens[self.runner.offline_screen.ref].priority)
+        self.assertEqual(0, env.lcdd.count(mark, name='widget_del'))
+
+    def test_mpd_snapshot(self):
+        roundtrips = metrics.ROUNDTRIPS.labels('mpd')
+        before = roundtrips.value
+        self.env.player.next()
+        self.runner.update()
+        # status and currentsong, in one command list.
+        self.assertEqual(1, roundtrips.value - before)
+        self.assertEqual('Artist 1', self.env.lcdd.render()[0].strip())
+
+
+class BatchTest(unittest.TestCase):
+    def setUp(self):
+        self.lcdd = fake_lcdd.FakeLCDdServer().start()
+        self.addCleanup(self.lcdd.stop)
+        self.lcd = lcdrunner.LcdProcServer(*self.lcdd.address)
+        self.addCleanup(self.lcd.tn.close)
+        self.lcd.start_session()
+
+    def test_batch(self):
+        roundtrips = metrics.ROUNDTRIPS.labels('lcdproc')
+        before = roundtrips.value
+        with self.lcd.batch():
+            screen = self.lcd.add_screen('s')
+            with self.lcd.batch():
+                screen.add_string_widget('w', 'text', x=2, y=1)
+            self.assertEqual(0, self.lcdd.count(name='widget_set'))
+        self.assertEqual(1, roundtrips.value - before)
+        self.assertEqual(' text', self.lcdd.render()[0][:5])
+
+    def test_batch_error(self):
+        mark = self.lcdd.mark()
+        with self.assertRaises(ValueError):
+            with self.lcd.batch():
+                self.lcd.add_screen('s')
+                raise ValueError()
+        # Nothing was sent.
+        self.assertEqual([], self.lcdd.commands_since(mark))
+        self.assertEqual('success\n', self.lcd.request('screen_add s'))
+
+    def test_rejected(self):
+        """Rejected commands are logged, not printed."""
+        with self.assertLogs('mpdlcd.lcdrunner', 'WARNING') as logs:
+            response = self.lcd.request('widget_set missing w 1 1 "x"')
+        self.assertIn('huh', response)
+        self.assertEqual(1, len(logs.records))
+        self.assertIn("lcdproc rejected 'widget_set missing", logs.output[0])
+
+
+class RateLimitTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = timing.VirtualClock()
+        self.lcdd = fake_lcdd.FakeLCDdServer().start()
+        self.addCleanup(self.lcdd.stop)
+        self.lcd = lcdrunner.LcdProcServer(*self.lcdd.address, command_rate=2, command_burst=1, clock=self.clock)
+        self.addCleanup(self.lcd.tn.close)
+        self.lcd.start_session()
+        self.screen = self.lcd.add_screen('s')
+        self.widget = self.screen.add_string_widget('w', 'one', x=1, y=1)
+        # Send the initial updates, one per token.
+        while self.lcd.queue:
+            self.clock.advance(0.5)
+            self.lcd.flush()
+
+    def test_flush_delay(self):
+        self.assertIsNone(self.lcd.flush_delay())
+        self.widget.set_text('two')
+        self.assertEqual(0.5, self.lcd.flush_delay())
+        self.clock.advance(0.5)
+        self.lcd.flush()
+        self.assertEqual('two', self.lcdd.render()[0][:3])
+        self.assertIsNone(self.lcd.flush_delay())
+
+    def test_batch_after_queue(self):
+        """A batched value replaces a queued one."""
+        self.widget.set_text('two')
+        with self.lcd.batch():
+            self.widget.set_text('three')
+        self.clock.advance(10)
+        self.lcd.flush()
+        self.assertEqual('three', self.lcdd.render()[0][:5])
+        self.assertEqual(0, len(self.lcd.queue))
+
+    def test_forget_widget(self):
+        self.lcd.set_widget_priority('s', 'w', 0)
+        self.widget.set_text('two')
+        self.lcd.forget_widget('s', 'w')
+        self.assertEqual({}, self.lcd.widget_priorities)
+        self.assertEqual(0, len(self.lcd.queue))
+
+
+class StartupTest(unittest.TestCase):
+    def setUp(self):
+        self.player = fake_mpd.Player([fake_mpd.make_song(i) for i in range(3)])
+        self.mpd_server = fake_mpd.FakeMPDServer(self.player).start()
+        self.addCleanup(self.mpd_server.stop)
+        self.lcdd = fake_lcdd.FakeLCDdServer(width=16, height=2).start()
+        self.addCleanup(self.lcdd.stop)
+        self.retry_config = utils.AutoRetryConfig(retry_attempts=1, retry_wait=0.01, retry_backoff=2)
+
+    def make_client(self):
+        host, port = self.mpd_server.address
+        return mpdwrapper.MPDClient(host=host, port=port, retry_config=self.retry_config)
+
+    def make_lcd(self):
+        lcd = lcdrunner.LcdProcServer(*self.lcdd.address)
+        self.addCleanup(lcd.tn.close)
+        lcd.start_session()
+        return lcd
+
+    def test_clear(self):
+        lcd = self.make_lcd()
+        mark = self.lcdd.mark()
+        lcd.add_screen('s')
+        # Sized to the display
+        self.assertEqual(2, self.lcdd.count(mark, name='widget_add'))
+        self.assertEqual(
+            ['widget_set', 's', '_w2_', '1', '2', ' ' * 16],
+            self.lcdd.commands_since(mark, name='widget_set')[-1].args,
+        )
+
+    def test_batched_setup(self):
+        lcd = self.make_lcd()
+        roundtrips = metrics.ROUNDTRIPS.labels('lcdproc')
+        before = roundtrips.value
+        with lcd.batch():
+            runner = lcdrunner.MpdRunner(
+                self.make_client(), lcd,
+                lcdproc_screen='MPD',
+                refresh_rate=1,
+                backlight_on=cli.DEFAULT_BACKLIGHT_ON,
+                priority_playing=cli.DEFAULT_PRIORITY,
+                priority_not_playing=cli.DEFAULT_PRIORITY,
+                retry_config=self.retry_config,
+            )
+            runner.setup_pattern(cli._make_patterns(cli.DEFAULT_PATTERNS), hook_registry=mpdhooks.HookRegistry())
+        self.assertEqual(1, roundtrips.value - before)
+
+        self.player.play()
+        runner.update()
+        self.assertEqual('Artist 0', self.lcdd.render()[0][:8])
+
+    def test_concurrent_connect(self):
+        latency = 0.2
+        self.mpd_server.latency = latency
+        self.lcdd.latency = latency
+        client = self.make_client()
+        startup = timing.StepTimer()
+        lcd = cli._connect_servers(client, self.make_lcd, startup)
+
+        self.assertTrue(client.connection.connected)
+        self.assertEqual(16, lcd.server_info['screen_width'])
+        self.assertEqual(['lcdproc connect', 'mpd connect'], sorted(name for name, _duration in startup.steps))
+        # Both take at least one latency, and they overlap.
+        self.assertLess(startup.elapsed(), 2 * latency)
+
+    def test_mpd_offline(self):
+        self.mpd_server.stop()
+        client = self.make_client()
+        lcd = cli._connect_servers(client, self.make_lcd, timing.StepTimer())
+        self.assertFalse(client.connection.connected)
+        self.assertTrue(lcd.server_info)
+
+
+class StateScreensTest(unittest.TestCase):
+    def setUp(self):
+        self.env = bench.BenchEnvironment(lines=2, state_patterns={
+            'pause': ['{song format="%(title)s"}\nPaused {elapsed}'],
+            'stop': ['Stopped'],
+        })
+        self.addCleanup(self.env.close)
+        self.runner = self.env.runner
+        self.env.player.play()
+        self.runner.update()
+
+    def visible(self):
+        return self.env.lcdd.visible_screen().ref
+
+    def test_switch(self):
+        env = self.env
+        self.assertEqual('MPD', self.visible())
+        self.assertEqual(['MPD', 'MPD_offline', 'MPD_pause', 'MPD_stop'], sorted(self.runner.lcd.screens))
+
+        env.player.pause()
+        mark = env.lcdd.mark()
+        self.runner.update()
+        self.assertEqual('MPD_pause', self.visible())
+        self.assertEqual(['Song number 0', 'Paused 00:00'], [line.strip() for line in env.lcdd.render()])
+        # Nothing is written to the main screen.
+        screens = set(command.args[1] for command in env.lcdd.commands_since(mark) if len(command.args) > 1)
+        self.assertEqual({'MPD', 'MPD_pause'}, screens)
+        self.assertEqual(2, env.lcdd.count(mark, name='screen_set'))
+
+        env.player.stop()
+        self.runner.update()
+        self.assertEqual('MPD_stop', self.visible())
+        self.assertEqual('Stopped', env.lcdd.render()[0].strip())
+
+    def test_lazy_update(self):
+        env = self.env
+        env.player.pause()
+        self.runner.update()
+
+        # The hidden main screen isn't updated.
+        env.player.next()
+        env.player.pause()
+        mark = env.lcdd.mark()
+        self.runner.update()
+        self.assertEqual(0, len([
+            command for command in env.lcdd.commands_since(mark, name='widget_set') if command.args[1] == 'MPD'
+        ]))
+        self.assertEqual('Song number 1', env.lcdd.render()[0].strip())
+
+        env.player.play()
+        self.runner.update()
+        self.assertEqual('MPD', self.visible())
+        self.assertEqual('Artist 1', env.lcdd.render()[0][:8])
+
+    def test_reload(self):
+        self.env.player.pause()
+        self.runner.update()
+        self.runner.reload_pattern(
+            cli._make_patterns(cli.DEFAULT_PATTERNS, clock=self.env.clock),
+            hook_registry=mpdhooks.HookRegistry(clock=self.env.clock),
+        )
+        self.assertEqual(['MPD', 'MPD_offline'], sorted(self.runner.lcd.screens))
+        self.runner.update()
+        self.assertEqual('MPD', self.visible())
+
+
+class ProgressTest(unittest.TestCase):
+    def test_bar(self):
+        env = bench.BenchEnvironment(lines=1)
+        self.addCleanup(env.close)
+        env.runner.reload_pattern(
+            cli._make_patterns(['{elapsed} {progress}'], clock=env.clock),
+            hook_registry=mpdhooks.HookRegistry(clock=env.clock),
+        )
+        env.player.play()
+        env.runner.update()
+        env.clock.advance(90)
+        env.runner.update()
+        # Half of 14 cells
+        self.assertEqual('01:30 =======', env.lcdd.render()[0].rstrip())
+
+        mark = env.lcdd.mark()
+        env.clock.advance(1)
+        env.runner.update()
+        # 1s is less than a pixel: only the time changes.
+        self.assertEqual(1, env.lcdd.count(mark, name='widget_set'))
+
+
+class LibraryFieldsTest(unittest.TestCase):
+    def setUp(self):
+        self.env = bench.BenchEnvironment(lines=2)
+        self.addCleanup(self.env.close)
+        self.env.runner.reload_pattern(
+            cli._make_patterns(['{volume} {stats key=songs} {stats key=artists}\n{volbar}'], clock=self.env.clock),
+            hook_registry=mpdhooks.HookRegistry(clock=self.env.clock),
+        )
+
+    def stats_requests(self):
+        return len([command for command in self.env.mpd_server.commands if command[0] == 'stats'])
+
+    def test_render(self):
+        env = self.env
+        env.player.play()
+        env.runner.update()
+        self.assertEqual([' 50%     50      7', '=' * 10], [line.rstrip() for line in env.lcdd.render()])
+
+        env.player.set_volume(100)
+        env.runner.update()
+        self.assertEqual(['100%     50      7', '=' * 20], [line.rstrip() for line in env.lcdd.render()])
+
+    def test_stats_cache(self):
+        env = self.env
+        env.player.play()
+        for _i in range(10):
+            env.runner.update()
+            env.clock.advance(1)
+        self.assertEqual(1, self.stats_requests())
+
+        # Database updates show in the status while running.
+        env.player.start_update()
+        env.runner.update()
+        env.player.finish_update(songs=12)
+        env.runner.update()
+        self.assertEqual(2, self.stats_requests())
+        self.assertEqual(' 50%     12      7', env.lcdd.render()[0].rstrip())
+
+        # Short updates are only seen by idle.
+        env.player.finish_update(songs=14)
+        env.runner.client.wait_for_changes(0)
+        env.runner.update()
+        self.assertEqual(3, self.stats_requests())
+        self.assertEqual(' 50%     14      7', env.lcdd.render()[0].rstrip())
+
+        env.clock.advance(mpdhooks.CachedHook.DEFAULT_TTL)
+        env.runner.update()
+        self.assertEqual(4, self.stats_requests())
+
+
+class RatingFieldTest(unittest.TestCase):
+    def setUp(self):
+        self.env = bench.BenchEnvironment(lines=1)
+        self.addCleanup(self.env.close)
+        self.env.runner.reload_pattern(
+            cli._make_patterns(['{rating} {rating scale=20,width=4}'], clock=self.env.clock),
+            hook_registry=mpdhooks.HookRegistry(clock=self.env.clock),
+        )
+
+    def sticker_requests(self):
+        return len([command for command in self.env.mpd_server.commands if command[0] == 'sticker'])
+
+    def test_favourites(self):
+        env = self.env
+        favourites = [0, 1, 2, 3]
+        for pos in favourites:
+            env.player.set_sticker(env.player.playlist[pos]['file'], 'rating', 2 * pos + 4)
+        env.runner.update()
+
+        for i in range(40):
+            env.player.play(favourites[(i * 7) % len(favourites)])
+            env.runner.update()
+        # Each rating is only looked up once.
+        self.assertEqual(len(favourites), self.sticker_requests())
+        self.assertEqual('***.. *...', env.lcdd.render()[0][:10])
+
+        env.player.play(4)
+        env.runner.update()
+        self.assertEqual('', env.lcdd.render()[0].strip())
+
+        # Rating the current song, while it plays
+        env.player.set_sticker(env.player.playlist[4]['file'], 'rating', '10')
+        env.runner.wait()
+        env.runner.update()
+        self.assertEqual('***** **..', env.lcdd.render()[0][:10])
+        self.assertEqual(len(favourites) + 2, self.sticker_requests())
+
+
+class StatusNotificationsTest(unittest.TestCase):
+    STATUS = {'volume': '50', 'random': '0', 'repeat': '1', 'single': '0', 'consume': '0', 'elapsed': '1.000'}
+
+    def test_changes(self):
+        status = dict(self.STATUS, volume='55', random='1', elapsed='2.000', error='Failed to decode')
+        self.assertEqual(
+            ['Volume: 55%', 'Random: on', 'Error: Failed to decode'],
+            lcdrunner.status_notifications(self.STATUS, status),
+        )
+
+    def test_no_changes(self):
+        self.assertEqual([], lcdrunner.status_notifications(None, self.STATUS))
+        self.assertEqual([], lcdrunner.status_notifications(self.STATUS, dict(self.STATUS, elapsed='3.000')))
+        # No mixer
+        self.assertEqual([], lcdrunner.status_notifications(self.STATUS, dict(self.STATUS, volume='-1')))
+
+
+class OverlayTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = timing.VirtualClock()
+        self.lcdd = fake_lcdd.FakeLCDdServer(width=16, height=2, clock=self.clock).start()
+        self.addCleanup(self.lcdd.stop)
+        self.lcd = lcdrunner.LcdProcServer(*self.lcdd.address)
+        self.addCleanup(self.lcd.tn.close)
+        self.lcd.start_session()
+        screen = self.lcd.add_screen('MPD')
+        screen.add_string_widget('w', 'Main screen')
+        self.overlay = lcdrunner.Overlay(self.lcd, 'MPD_overlay', duration=2, clock=self.clock)
+
+    def test_show(self):
+        roundtrips = metrics.ROUNDTRIPS.labels('lcdproc')
+        mark, before = self.lcdd.mark(), roundtrips.value
+        self.overlay.show('Volume: 40%')
+        self.assertEqual(1, roundtrips.value - before)
+        self.assertEqual('MPD_overlay', self.lcdd.visible_screen().ref)
+        self.assertEqual('  Volume: 40%   ', self.lcdd.render()[0])
+
+        # While displayed, only the timeout and text change.
+        self.clock.advance(1)
+        mark = self.lcdd.mark()
+        self.overlay.show('Volume: 45%')
+        self.assertEqual(2, self.lcdd.count(mark))
+        self.assertEqual('Volume: 45%', self.lcdd.render()[0].strip())
+
+        # LCDd removes the screen, without any command from us.
+        self.clock.advance(2)
+        mark = self.lcdd.mark()
+        self.assertEqual('Main screen', self.lcdd.render()[0].strip())
+        self.assertEqual(0, self.lcdd.count(mark))
+
+        self.overlay.show('Random: on')
+        self.assertEqual(4, self.lcdd.count(mark))
+        self.assertEqual('Random: on', self.lcdd.render()[0].strip())
+
+    def test_runner(self):
+        env = bench.BenchEnvironment(lines=2)
+        self.addCleanup(env.close)
+        runner = env.runner
+        runner.overlay = lcdrunner.Overlay(runner.lcd, 'MPD_overlay', duration=2, clock=env.clock)
+        env.player.play()
+        runner.update()
+        self.assertEqual('MPD', env.lcdd.visible_screen().ref)
+
+        env.player.set_volume(40)
+        runner.update()
+        self.assertEqual('MPD_overlay', env.lcdd.visible_screen().ref)
+        self.assertEqual('Volume: 40%', env.lcdd.render()[0].strip())
+
+
+class IdleClockTest(unittest.TestCase):
+    def setUp(self):
+        self.env = bench.BenchEnvironment(lines=2, state_patterns={'stop': cli.DEFAULT_IDLE_PATTERNS})
+        self.addCleanup(self.env.close)
+        # 12:00:30 UTC
+        self.env.clock.epoch = 43230
+        self.runner = self.env.runner
+
+    def test_display(self):
+        env = self.env
+        self.runner.update()
+        self.assertEqual('MPD_stop', env.lcdd.visible_screen().ref)
+        now = time.localtime(env.clock.time())
+        self.assertEqual(
+            [time.strftime('%H:%M', now), time.strftime('%a %d %b', now)],
+            [line.strip() for line in env.lcdd.render()],
+        )
+
+        # Only the clock changes, once a minute.
+        env.clock.advance(20)
+        mark = env.lcdd.mark()
+        self.runner.update()
+        self.assertEqual(0, env.lcdd.count(mark, name='widget_set'))
+        env.clock.advance(20)
+        self.runner.update()
+        self.assertEqual(1, env.lcdd.count(mark, name='widget_set'))
+
+    def test_wait(self):
+        env = self.env
+        self.runner.update()
+        before = env.clock.slept
+        self.runner.wait()
+        # Until the next minute
+        self.assertAlmostEqual(30 + self.runner.IDLE_MARGIN, env.clock.slept - before)
+        self.assertEqual(0, int(env.clock.time()) % 60)
+
+        env.player.play()
+        self.runner.update()
+        before = env.clock.slept
+        self.runner.wait()
+        self.assertEqual(self.runner.refresh_rate, env.clock.slept - before)
+
+    def test_wait_seconds(self):
+        env = self.env
+        self.runner.reload_pattern(
+            cli._make_patterns(cli.DEFAULT_PATTERNS, clock=env.clock),
+            hook_registry=mpdhooks.HookRegistry(clock=env.clock),
+            state_patterns=cli._make_state_patterns({'stop': ['{clock format="%H:%M:%S"}']}, clock=env.clock),
+        )
+        env.clock.advance(0.25)
+        self.runner.update()
+        before = env.clock.slept
+        self.runner.wait()
+        self.assertAlmostEqual(0.75 + self.runner.IDLE_MARGIN, env.clock.slept - before)
+
+    def test_wait_events(self):
+        env = self.env
+        self.runner.idle_events = True
+        self.runner.update()
+        # Drain the events seen since connecting.
+        self.runner.client.wait_for_changes(0)
+
+        env.player.set_volume(40)
+        start = time.monotonic()
+        self.runner.wait()
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertEqual(0, env.clock.slept)
+
+
+class PowerSaveTest(unittest.TestCase):
+    def setUp(self):
+        self.env = bench.BenchEnvironment(lines=2)
+        self.addCleanup(self.env.close)
+        self.runner = self.env.runner
+        self.runner.power_save_after = 60
+
+    def main_screen(self):
+        [screen] = [screen for _client, screen in self.env.lcdd.screens() if screen.ref == 'MPD']
+        return screen
+
+    def test_power_save(self):
+        env = self.env
+        env.player.play()
+        self.runner.update()
+        env.player.stop()
+        self.runner.update()
+        env.clock.advance(59)
+        self.runner.update()
+        self.assertFalse(self.runner.power_saving)
+
+        env.clock.advance(1)
+        self.runner.update()
+        self.assertTrue(self.runner.power_saving)
+        self.assertEqual('off', self.main_screen().settings['backlight'])
+        self.assertEqual('background', self.main_screen().priority)
+
+        # Nothing is sent to LCDd, and MPD is rarely polled.
+        mark = env.lcdd.mark()
+        before = env.clock.slept
+        self.runner.wait()
+        self.runner.update()
+        self.assertEqual(self.runner.POWER_SAVE_POLL, env.clock.slept - before)
+        self.assertEqual(0, env.lcdd.count(mark))
+
+        # The first change redraws everything.
+        env.player.play()
+        self.runner.update()
+        self.assertFalse(self.runner.power_saving)
+        self.assertEqual('foreground', self.main_screen().priority)
+        self.assertEqual('open', self.main_screen().settings['backlight'])
+        self.assertEqual(['Artist 0', 'Song number 0'], [line[:len(text)] for line, text in zip(
+            env.lcdd.render(), ['Artist 0', 'Song number 0'])])
+
+    def test_playing(self):
+        env = self.env
+        env.player.play()
+        for _i in range(5):
+            self.runner.update()
+            env.clock.advance(60)
+        self.assertFalse(self.runner.power_saving)
+
+    def test_disabled(self):
+        self.runner.power_save_after = 0
+        self.runner.update()
+        self.env.clock.advance(3600)
+        self.runner.update()
+        self.assertFalse(self.runner.power_saving)
+
+
+class MPDIdleTest(unittest.TestCase):
+    def setUp(self):
+        self.player = fake_mpd.Player([fake_mpd.make_song(0)])
+        server = fake_mpd.FakeMPDServer(self.player).start()
+        self.addCleanup(server.stop)
+        host, port = server.address
+        self.client = mpdwrapper.MPDClient(
+            host=host, port=port,
+            retry_config=utils.AutoRetryConfig(retry_attempts=1, retry_wait=0.01, retry_backoff=2),
+        )
+        self.client.connect()
+
+    def test_timeout(self):
+        self.client.wait_for_changes(0)
+        start = time.monotonic()
+        self.assertEqual([], self.client.wait_for_changes(0.05))
+        self.assertGreaterEqual(time.monotonic() - start, 0.05)
+        # The connection is still usable.
+        self.assertEqual('stop', self.client.state)
+
+    def test_changes(self):
+        self.client.wait_for_changes(0)
+        self.player.play()
+        self.player.set_volume(20)
+        self.assertEqual(['mixer', 'player'], sorted(self.client.wait_for_changes(5)))
+        self.assertEqual('play', self.client.state)
+
+    def test_pop_changes(self):
+        # Anything may have changed before connecting.
+        self.assertEqual(set(self.client.IDLE_SUBSYSTEMS), self.client.pop_changes())
+        self.client.fetch_snapshot()
+        self.player.set_volume(20)
+        self.player.start_update()
+        self.client.fetch_snapshot()
+        self.assertEqual(set(['mixer']), self.client.pop_changes())
+
+        self.player.finish_update()
+        self.client.fetch_snapshot()
+        self.assertEqual(set(['database']), self.client.pop_changes())
+        self.assertEqual(set(), self.client.pop_changes())
+
+
+class TimeoutTest(unittest.TestCase):
+    LATENCY = 0.3
+
+    def connect_lcd(self, **timeouts):
+        lcdd = fake_lcdd.FakeLCDdServer(latency=self.LATENCY).start()
+        self.addCleanup(lcdd.stop)
+        lcd = lcdrunner.LcdProcServer(*lcdd.address, timeouts=utils.TimeoutConfig(**timeouts))
+        self.addCleanup(lcd.tn.close)
+        return lcd
+
+    def connect_mpd(self, **timeouts):
+        server = fake_mpd.FakeMPDServer(fake_mpd.Player(), latency=self.LATENCY).start()
+        self.addCleanup(server.stop)
+        host, port = server.address
+        return mpdwrapper.MPDClient(
+            host=host, port=port,
+            retry_config=utils.AutoRetryConfig(retry_attempts=3, retry_wait=1, retry_backoff=2),
+            timeouts=utils.TimeoutConfig(**timeouts),
+        )
+
+    def assertTimesOut(self, exception, fun, *args, **kwargs):
+        limit = kwargs.pop('limit', self.LATENCY)
+        start = time.monotonic()
+        with self.assertRaises(exception):
+            fun(*args, **kwargs)
+        self.assertLess(time.monotonic() - start, limit)
+
+    def test_lcd_read_timeout(self):
+        lcd = self.connect_lcd(read_timeout=0.05)
+        self.assertTimesOut(socket.timeout, lcd.start_session)
+
+    def test_lcd_request_timeout(self):
+        lcd = self.connect_lcd(read_timeout=5, request_timeout=0.05)
+        self.assertTimesOut(socket.timeout, lcd.start_session)
+
+    def test_lcd_no_timeout(self):
+        lcd = self.connect_lcd(read_timeout=5, request_timeout=5)
+        lcd.start_session()
+        self.assertEqual(20, lcd.server_info['screen_width'])
+
+    def test_mpd_request_timeout(self):
+        # The fake server delays its replies, including the initial greeting.
+        client = self.connect_mpd(connect_timeout=5, read_timeout=5, request_timeout=0.05)
+        client.connect()
+        # The connection is dropped, and a fresh one (with a slow greeting) times out as well.
+        self.assertTimesOut(mpdwrapper.MPDConnectionError, getattr, client, 'status', limit=2 * self.LATENCY)
+        self.assertEqual(utils.CONNECTION_BACKING_OFF, client.connection.state)
+
+    def test_mpd_connect_timeout(self):
+        client = self.connect_mpd(connect_timeout=0.05)
+        self.assertTimesOut(mpdwrapper.MPDConnectionError, client.connect)
+        self.assertEqual(1, client.connection.failures)
+
+
+if __name__ == '__main__':  # pragma: no cover
+    unittest.main()
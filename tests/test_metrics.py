@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2011-2013 Raphaël Barrois
+
+import os
+import shutil
+import tempfile
+import unittest
+import urllib.request
+
+from mpdlcd import metrics
+
+
+class RegistryTest(unittest.TestCase):
+    def setUp(self):
+        self.registry = metrics.Registry()
+
+    def test_counter(self):
+        counter = self.registry.counter('foo_total', "Some foo.")
+        counter.inc()
+        counter.inc(2)
+        self.assertEqual(
+            "# HELP foo_total Some foo.\n"
+            "# TYPE foo_total counter\n"
+            "foo_total 3\n",
+            self.registry.render(),
+        )
+
+    def test_labels(self):
+        counter = self.registry.counter('foo_total', "Some foo.", labelnames=['kind'])
+        counter.labels('a').inc()
+        counter.labels('b"').inc(4)
+        counter.labels('a').inc()
+        self.assertEqual(2, counter.labels('a').value)
+        self.assertEqual(
+            "# HELP foo_total Some foo.\n"
+            "# TYPE foo_total counter\n"
+            'foo_total{kind="a"} 2\n'
+            'foo_total{kind="b\\""} 4\n',
+            self.registry.render(),
+        )
+
+        with self.assertRaises(metrics.MetricError):
+            counter.labels()
+
+    def test_histogram(self):
+        histogram = self.registry.histogram('bar', "Some bar.", buckets=(1, 0.5))
+        for value in (0.2, 0.5, 0.7, 3):
+            histogram.observe(value)
+        self.assertEqual(
+            "# HELP bar Some bar.\n"
+            "# TYPE bar histogram\n"
+            'bar_bucket{le="0.5"} 2\n'
+            'bar_bucket{le="1"} 3\n'
+            'bar_bucket{le="+Inf"} 4\n'
+            'bar_sum 4.4\n'
+            'bar_count 4\n',
+            self.registry.render(),
+        )
+
+    def test_duplicate(self):
+        self.registry.counter('foo_total', "Some foo.")
+        with self.assertRaises(metrics.MetricError):
+            self.registry.histogram('foo_total', "Other foo.")
+
+
+class ExportersTest(unittest.TestCase):
+    def setUp(self):
+        self.registry = metrics.Registry()
+        self.registry.counter('foo_total', "Some foo.").inc()
+
+    def test_textfile(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        path = os.path.join(tmpdir, 'mpdlcd.prom')
+
+        self.registry.write_textfile(path)
+        with open(path) as f:
+            self.assertEqual(self.registry.render(), f.read())
+        # No temporary file left behind
+        self.assertEqual(['mpdlcd.prom'], os.listdir(tmpdir))
+
+    def test_http(self):
+        exporter = metrics.HTTPExporter('127.0.0.1', 0, registry=self.registry)
+        exporter.start()
+        self.addCleanup(exporter.stop)
+
+        with urllib.request.urlopen('http://%s:%d/metrics' % exporter.address) as response:
+            self.assertEqual(self.registry.render(), response.read().decode('utf-8'))
+
+
+if __name__ == '__main__':  # pragma: no cover
+    unittest.main()
@@ -4,12 +4,18 @@
 import unittest
 
 from mpdlcd import mpdhooks
+from mpdlcd import mpdwrapper
+from mpdlcd import timing
 
 
 class HookRegistryTest(unittest.TestCase):
     def setUp(self):
+        self._saved_registry = mpdhooks.HookRegistry._REGISTRY
         mpdhooks.HookRegistry._REGISTRY = {}
 
+    def tearDown(self):
+        mpdhooks.HookRegistry._REGISTRY = self._saved_registry
+
     def test_register(self):
         class SomeHook(object):
             pass
@@ -39,6 +45,21 @@ class HookRegistryTest(unittest.TestCase):
         self.assertEqual(4, hook2.foo)
         self.assertEqual(SomeHook, hook2.__class__)
 
+    def test_create_hook_options(self):
+        """Registry-level options should pass to Hook.__init__."""
+        class SomeHook(object):
+            def __init__(self, foo=2, bar=3):
+                self.foo = foo
+                self.bar = bar
+
+        mpdhooks.HookRegistry.register_hook('some_hook', SomeHook)
+
+        reg = mpdhooks.HookRegistry(hook_options={'some_hook': {'foo': 4, 'bar': 5}})
+
+        hook = reg.create('some_hook', bar=6)
+        self.assertEqual(4, hook.foo)
+        self.assertEqual(6, hook.bar)
+
     def test_register_hook_decorator(self):
         """The @register_hook decorator should guess the name."""
         @mpdhooks.register_hook
@@ -320,6 +341,118 @@ class SpecificHooksTest(unittest.TestCase):
         self.assertTrue(changed7)
         self.assertEqual(third_song_full, new7)
 
+    def test_song_hook_settle(self):
+        class FakeSong(object):
+            def __init__(self, id, title):
+                self.id = id
+                self.title = title
+
+        clock = timing.VirtualClock(100.0)
+        hook = mpdhooks.SongHook(settle=2, clock=clock)
+
+        def handle(song, delay=0.5):
+            clock.advance(delay)
+            return hook.handle(self.FakeClient(current_song=song), ('title',))
+
+        # The first song is displayed right away
+        first = FakeSong(id=1, title="first")
+        self.assertEqual((True, first), handle(first))
+
+        # Skipping through songs: nothing is reported
+        for song_id in range(2, 10):
+            self.assertEqual((False, None), handle(FakeSong(id=song_id, title="song %d" % song_id)))
+
+        # Once a song stays long enough, it is reported.
+        last = FakeSong(id=10, title="last")
+        self.assertEqual((False, None), handle(last))
+        self.assertEqual((False, None), handle(last, delay=1))
+        self.assertEqual((True, last), handle(last, delay=1))
+        self.assertEqual((False, None), handle(last))
+
+        # Stopping is reported right away.
+        self.assertEqual((True, None), handle(None))
+
+    def test_clock(self):
+        clock = timing.VirtualClock(epoch=43200)
+        hook = mpdhooks.HookRegistry(clock=clock).create('clock')
+        self.assertEqual((True, 43200), hook.handle(None, ('%H:%M',)))
+        # Only changes on minute boundaries
+        clock.advance(59)
+        self.assertEqual((False, None), hook.handle(None, ('%H:%M',)))
+        clock.advance(1)
+        self.assertEqual((True, 43260), hook.handle(None, ('%H:%M',)))
+
+    def test_cached_hooks(self):
+        clock = timing.VirtualClock()
+        registry = mpdhooks.HookRegistry(clock=clock)
+        volume = registry.create('volume')
+        stats = registry.create('stats', ttl=600)
+        client = self.FakeClient(status={'volume': '50'})
+        client.stats = {'songs': '12', 'artists': '3'}
+
+        self.assertEqual((True, 50), volume.handle(client))
+        self.assertEqual((True, client.stats), stats.handle(client, ('songs',)))
+
+        # Cached until MPD reports a change in their subsystem
+        client.status = {'volume': '20'}
+        client.stats = {'songs': '13', 'artists': '3'}
+        self.assertEqual((False, None), volume.handle(client))
+        volume.subsystems_changed({'player', 'database'})
+        stats.subsystems_changed({'player', 'mixer'})
+        self.assertEqual((False, None), volume.handle(client))
+        self.assertEqual((False, None), stats.handle(client, ('songs',)))
+        volume.subsystems_changed({'mixer'})
+        self.assertEqual((True, 20), volume.handle(client))
+
+        # ... or until they expire.
+        clock.advance(600)
+        self.assertEqual((True, client.stats), stats.handle(client, ('songs',)))
+        client.stats = {'songs': '13', 'artists': '4'}
+        stats.invalidate()
+        self.assertEqual((False, None), stats.handle(client, ('songs',)))
+
+    def test_rating_cache(self):
+        class StickerClient(self.FakeClient):
+            def __init__(self):
+                super(StickerClient, self).__init__()
+                self.stickers = {}
+                self.lookups = []
+
+            def play(self, uri):
+                self.current_song = mpdwrapper.MPDSong(id=['1'], file=[uri])
+
+            def song_sticker(self, uri, name):
+                self.lookups.append(uri)
+                return self.stickers.get((uri, name))
+
+        hook = mpdhooks.RatingHook(cache_size=2)
+        client = StickerClient()
+        client.stickers[('a.flac', 'rating')] = '8'
+        client.play('a.flac')
+        self.assertEqual((True, '8'), hook.handle(client))
+        client.play('b.flac')
+        self.assertEqual((True, None), hook.handle(client))
+        client.play('a.flac')
+        self.assertEqual((True, '8'), hook.handle(client))
+        self.assertEqual(['a.flac', 'b.flac'], client.lookups)
+
+        # The least recently used rating is dropped.
+        client.play('c.flac')
+        hook.handle(client)
+        client.play('b.flac')
+        hook.handle(client)
+        self.assertEqual(['a.flac', 'b.flac', 'c.flac', 'b.flac'], client.lookups)
+
+        # Sticker changes empty the cache.
+        client.stickers[('b.flac', 'rating')] = '2'
+        hook.subsystems_changed({'player'})
+        self.assertEqual((False, None), hook.handle(client))
+        hook.subsystems_changed({'sticker'})
+        self.assertEqual((True, '2'), hook.handle(client))
+        client.current_song = mpdwrapper.MPDSong()
+        self.assertEqual((True, None), hook.handle(client))
+        self.assertEqual(5, len(client.lookups))
+
 
 if __name__ == '__main__':  # pragma: no cover
     unittest.main()
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2011-2013 Raphaël Barrois
+
+import os
+import shutil
+import tempfile
+import tracemalloc
+import unittest
+
+from mpdlcd import profiling
+
+
+def busy_function():
+    return sum(i * i for i in range(1000))
+
+
+class ProfilerTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.profiler = profiling.Profiler(output_dir=self.tmpdir)
+
+    def test_profiling(self):
+        # Inactive: nothing recorded
+        with self.profiler.profiled():
+            busy_function()
+        self.assertIsNone(self.profiler.toggle_profiling())
+
+        with self.profiler.profiled():
+            busy_function()
+        report_path = self.profiler.toggle_profiling()
+
+        self.assertIsNone(self.profiler.profile)
+        with open(report_path) as f:
+            self.assertIn('busy_function', f.read())
+        self.assertEqual(2, len(os.listdir(self.tmpdir)))
+
+    def test_memory_snapshot(self):
+        self.addCleanup(tracemalloc.stop)
+        self.assertIsNone(self.profiler.snapshot_memory())
+        self.assertTrue(tracemalloc.is_tracing())
+
+        report_path = self.profiler.snapshot_memory()
+        with open(report_path) as f:
+            self.assertIn("Top 25 allocation sites", f.read())
+
+        report_path = self.profiler.snapshot_memory()
+        with open(report_path) as f:
+            self.assertIn("changes since the previous snapshot", f.read())
+
+
+if __name__ == '__main__':  # pragma: no cover
+    unittest.main()
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2011-2013 Raphaël Barrois
+
+import unittest
+
+from mpdlcd import bench
+from mpdlcd import cli
+from mpdlcd import mpdhooks
+from mpdlcd import soak
+
+
+def make_sample(hours, rss=1 << 20, traced=1 << 16, widgets=10, hook_keys=5, songs=0, log_handlers=1):
+    return soak.Sample(hours * soak.HOUR, rss, traced, widgets, hook_keys, songs, log_handlers)
+
+
+class CheckTest(unittest.TestCase):
+    def test_stable(self):
+        samples = [make_sample(hour, widgets=10 + hour % 2) for hour in range(10)]
+        self.assertEqual([], soak.check(samples, warmup=2 * soak.HOUR))
+
+    def test_growth(self):
+        samples = [
+            make_sample(hour, traced=(1 << 16) + hour * (1 << 17), hook_keys=5 + hour // 5)
+            for hour in range(10)
+        ]
+        problems = soak.check(samples, warmup=2 * soak.HOUR)
+        self.assertEqual(2, len(problems))
+        self.assertIn('traced grew', problems[0])
+        self.assertEqual('hook_keys grew from 5 to 6', problems[1])
+
+    def test_warmup_growth(self):
+        # Growth during the warm-up is ignored.
+        samples = [make_sample(hour, rss=(1 << 20) * min(hour, 3) * 10) for hour in range(10)]
+        self.assertEqual([], soak.check(samples, warmup=4 * soak.HOUR))
+
+    def test_not_enough_samples(self):
+        samples = [make_sample(hour) for hour in range(3)]
+        self.assertEqual(1, len(soak.check(samples, warmup=2 * soak.HOUR)))
+
+
+class ReloadTest(unittest.TestCase):
+    def test_reload_pattern(self):
+        env = bench.BenchEnvironment(lines=4)
+        self.addCleanup(env.close)
+        env.player.play()
+        env.runner.update()
+        self.assertEqual('Artist 0', env.lcdd.render()[0].strip())
+
+        env.runner.reload_pattern(
+            cli._make_patterns(soak.ALTERNATE_PATTERNS, clock=env.clock),
+            hook_registry=mpdhooks.HookRegistry(clock=env.clock),
+        )
+        env.runner.update()
+        lines = env.lcdd.render()
+        self.assertEqual('Song number 0', lines[0].strip())
+        self.assertEqual('', lines[2].strip())
+
+        # Old widgets were removed, on both sides; Screen.clear() adds _wN_ widgets.
+        [screen] = [screen for _client, screen in env.lcdd.screens() if screen.ref == env.runner.screen.ref]
+        lcdd_widgets = [ref for ref in screen.widgets if not ref.startswith('_')]
+        self.assertEqual(sorted(env.runner.screen.widgets), sorted(lcdd_widgets))
+
+
+class SoakTest(unittest.TestCase):
+    def test_short_soak(self):
+        run = soak.Soak(
+            days=0.5, refresh=120, warmup=3,
+            sample_every=2, reconnect_every=1.5, reload_every=2.5, pause_every=1,
+        )
+        run.run()
+        # Every 2 hours, and at the end
+        self.assertEqual(7, len(run.samples))
+        self.assertEqual(4, run.reloads)
+        # Only check structures: memory figures are noisy over a short run.
+        self.assertEqual([], run.check(max_rss_growth=1 << 30, max_traced_growth=1 << 30))
+
+
+if __name__ == '__main__':  # pragma: no cover
+    unittest.main()
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2011-2013 Raphaël Barrois
+
+import socket
+import unittest
+
+from mpdlcd import cli
+from mpdlcd import lcdrunner
+from mpdlcd import metrics
+from mpdlcd import mpdhooks
+from mpdlcd import mpdwrapper
+from mpdlcd import timing
+from mpdlcd import utils
+from mpdlcd.testing import fake_lcdd
+from mpdlcd.testing import fake_mpd
+
+
+class VirtualClockTest(unittest.TestCase):
+    def test_sleep(self):
+        clock = timing.VirtualClock(10)
+        clock.sleep(5)
+        clock.sleep(-1)
+        self.assertEqual(15, clock.now())
+        self.assertEqual(5, clock.slept)
+
+        clock.sleep_until(12)
+        self.assertEqual(15, clock.now())
+        clock.sleep_until(20)
+        self.assertEqual(20, clock.now())
+
+    def test_call_at(self):
+        clock = timing.VirtualClock()
+        calls = []
+        clock.call_at(3, lambda: calls.append(('a', clock.now())))
+        clock.call_later(1, lambda: calls.append(('b', clock.now())))
+        clock.call_at(3, lambda: calls.append(('c', clock.now())))
+        clock.call_at(10, lambda: calls.append(('d', clock.now())))
+
+        clock.sleep(5)
+        self.assertEqual([('b', 1), ('a', 3), ('c', 3)], calls)
+        self.assertEqual(5, clock.now())
+
+
+class StepTimerTest(unittest.TestCase):
+    def test_steps(self):
+        clock = timing.VirtualClock()
+        timer = timing.StepTimer(clock=clock)
+        with timer.step('connect'):
+            clock.advance(0.25)
+        with self.assertRaises(ValueError):
+            with timer.step('setup'):
+                clock.advance(0.0015)
+                raise ValueError()
+
+        self.assertEqual(['connect', 'setup'], [name for name, _duration in timer.steps])
+        self.assertAlmostEqual(0.0015, timer.steps[1][1])
+        self.assertAlmostEqual(0.2515, timer.elapsed())
+        self.assertEqual('connect 250.0ms, setup 1.5ms', timer.summary())
+
+
+class AutoRetryTest(unittest.TestCase):
+    class Flaky(utils.AutoRetryCandidate):
+        def __init__(self, failures, **kwargs):
+            super(AutoRetryTest.Flaky, self).__init__(**kwargs)
+            self.failures = failures
+            self.attempts = 0
+
+        @utils.auto_retry
+        def call(self):
+            self.attempts += 1
+            if self.attempts <= self.failures:
+                raise socket.error("Connection refused")
+            return self.attempts
+
+    def make_flaky(self, failures, clock):
+        return self.Flaky(
+            failures,
+            retry_config=utils.AutoRetryConfig(retry_attempts=4, retry_wait=3, retry_backoff=2),
+            clock=clock,
+        )
+
+    def test_backoff(self):
+        clock = timing.VirtualClock()
+        flaky = self.make_flaky(3, clock)
+        self.assertEqual(4, flaky.call())
+        self.assertEqual(3 + 6 + 12, clock.slept)
+
+    def test_give_up(self):
+        clock = timing.VirtualClock()
+        flaky = self.make_flaky(10, clock)
+        with self.assertRaises(socket.error):
+            flaky.call()
+        self.assertEqual(4, flaky.attempts)
+
+
+class SimulationTest(unittest.TestCase):
+    """Run the real update loop through simulated time."""
+
+    REFRESH = 15
+
+    def setUp(self):
+        self.clock = timing.VirtualClock()
+        self.player = fake_mpd.Player([fake_mpd.make_song(i, duration=200 + i) for i in range(40)], clock=self.clock)
+        self.player.set_option('repeat', 1)
+        self.mpd_server = fake_mpd.FakeMPDServer(self.player).start()
+        self.addCleanup(self.mpd_server.stop)
+        self.lcdd = fake_lcdd.FakeLCDdServer(width=20, height=4).start()
+        self.addCleanup(self.lcdd.stop)
+
+        retry_config = utils.AutoRetryConfig(
+            retry_attempts=cli.DEFAULT_RETRY_ATTEMPTS,
+            retry_wait=cli.DEFAULT_RETRY_WAIT,
+            retry_backoff=cli.DEFAULT_RETRY_BACKOFF,
+        )
+        host, port = self.mpd_server.address
+        self.client = mpdwrapper.MPDClient(host=host, port=port, retry_config=retry_config, clock=self.clock)
+        host, port = self.lcdd.address
+        lcd = lcdrunner.LcdProcServer(host, port)
+        self.addCleanup(lcd.tn.close)
+        self.runner = lcdrunner.MpdRunner(
+            self.client, lcd,
+            lcdproc_screen='MPD',
+            refresh_rate=self.REFRESH,
+            backlight_on=cli.DEFAULT_BACKLIGHT_ON,
+            priority_playing=cli.DEFAULT_PRIORITY,
+            priority_not_playing=cli.DEFAULT_PRIORITY,
+            retry_config=retry_config,
+            clock=self.clock,
+        )
+        self.runner.setup_pattern(
+            cli._make_patterns(cli.DEFAULT_PATTERNS, clock=self.clock),
+            hook_registry=mpdhooks.HookRegistry(clock=self.clock),
+        )
+
+    def test_one_day(self):
+        day = 24 * 3600
+        snapshots = []
+
+        def check():
+            snapshots.append((self.player.current_song['Title'], self.lcdd.render()))
+            self.runner.stop()
+
+        # MPD drops its connections every hour.
+        for hour in range(1, 24):
+            self.clock.call_at(hour * 3600 + 1, self.mpd_server.disconnect_clients)
+        self.clock.call_at(day, check)
+
+        retries = metrics.RETRIES.labels('mpd')
+        retries_before = retries.value
+        self.client.connect()
+        self.player.play()
+        self.runner.run()
+
+        self.assertGreaterEqual(self.clock.now(), day)
+        # Each disconnection was retried once.
+        self.assertEqual(23, retries.value - retries_before)
+        self.assertEqual(1, len(snapshots))
+        title, lines = snapshots[0]
+        self.assertEqual(title, lines[2].strip())
+
+        # The screen was removed on exit.
+        self.assertEqual([], self.lcdd.screens())
+
+
+if __name__ == '__main__':  # pragma: no cover
+    unittest.main()
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2011-2013 Raphaël Barrois
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from mpdlcd import bench
+from mpdlcd import cli
+from mpdlcd import lcdrunner
+from mpdlcd import mpdhooks
+from mpdlcd import mpdwrapper
+from mpdlcd import timing
+from mpdlcd import trace
+from mpdlcd import utils
+from mpdlcd.testing import fake_lcdd
+from mpdlcd.testing import fake_mpd
+
+
+class TraceFileTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.path = os.path.join(self.tmpdir, 'trace')
+
+    def test_roundtrip(self):
+        clock = timing.VirtualClock(10.0)
+        writer = trace.TraceWriter(self.path, clock=clock)
+        writer.meta(refresh=0.5)
+        writer.record(trace.KIND_MPD_SEND, 'status\n')
+        clock.advance(0.5)
+        writer.record(trace.KIND_MPD_RECV, b'OK\n')
+        writer.close()
+
+        # Traces are appended to.
+        writer = trace.TraceWriter(self.path, clock=clock)
+        writer.tick()
+        writer.close()
+
+        records = list(trace.TraceReader(self.path))
+        self.assertEqual([
+            trace.Record(10.0, trace.KIND_META, b'{"refresh": 0.5}'),
+            trace.Record(10.0, trace.KIND_MPD_SEND, b'status\n'),
+            trace.Record(10.5, trace.KIND_MPD_RECV, b'OK\n'),
+            trace.Record(10.5, trace.KIND_TICK, b''),
+        ], records)
+
+    def test_permissions(self):
+        trace.TraceWriter(self.path).close()
+        self.assertEqual(0o600, os.stat(self.path).st_mode & 0o777)
+
+    def test_truncated(self):
+        writer = trace.TraceWriter(self.path)
+        writer.record(trace.KIND_LCD_SEND, 'hello')
+        writer.record(trace.KIND_LCD_RECV, 'connect LCDproc')
+        writer.close()
+        with open(self.path, 'ab') as f:
+            f.truncate(os.path.getsize(self.path) - 3)
+
+        records = list(trace.TraceReader(self.path))
+        self.assertEqual([b'hello'], [record.payload for record in records])
+
+    def test_empty(self):
+        trace.TraceWriter(self.path).close()
+        self.assertEqual([], list(trace.TraceReader(self.path)))
+
+    def test_invalid(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'Not a trace at all')
+        with self.assertRaises(trace.TraceError):
+            list(trace.TraceReader(self.path))
+        with self.assertRaises(trace.TraceError):
+            trace.TraceWriter(self.path)
+
+
+class MPDReplayTest(unittest.TestCase):
+    def test_answer(self):
+        tick = trace.Tick(1.0)
+        tick.exchanges = [
+            (b'status\n', [b'state: play\n', b'OK\n']),
+            (b'currentsong\n', [b'Title: foo\n', b'OK\n']),
+        ]
+        replay = trace.MPDReplay()
+        replay.start_tick(tick)
+        self.assertEqual([b'Title: foo\n', b'OK\n'], replay.answer(b'currentsong\n'))
+        self.assertEqual([b'state: play\n', b'OK\n'], replay.answer(b'status\n'))
+
+        # Unknown commands reuse the last reply, if any.
+        replay.start_tick(trace.Tick(2.0))
+        self.assertEqual([b'state: play\n', b'OK\n'], replay.answer(b'status\n'))
+        self.assertEqual([b'OK\n'], replay.answer(b'stats\n'))
+        self.assertEqual(2, replay.misses)
+
+
+class RecordReplayTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.path = os.path.join(self.tmpdir, 'trace')
+
+        self.clock = timing.VirtualClock()
+        self.player = fake_mpd.Player([fake_mpd.make_song(i) for i in range(5)], clock=self.clock)
+        self.mpd_server = fake_mpd.FakeMPDServer(self.player).start()
+        self.addCleanup(self.mpd_server.stop)
+        self.lcdd = fake_lcdd.FakeLCDdServer(width=20, height=2).start()
+        self.addCleanup(self.lcdd.stop)
+
+    def record(self, ticks, password=None):
+        tracer = trace.TraceWriter(self.path)
+        self.addCleanup(tracer.close)
+        tracer.meta(patterns=cli.DEFAULT_PATTERNS, refresh=0.5, hook_options={})
+        retry_config = utils.AutoRetryConfig(retry_attempts=0, retry_wait=0.01, retry_backoff=2)
+
+        host, port = self.mpd_server.address
+        client = mpdwrapper.MPDClient(
+            host=host, port=port, password=password, retry_config=retry_config, tracer=tracer)
+        host, port = self.lcdd.address
+        lcd = lcdrunner.LcdProcServer(host, port, tracer=tracer)
+        self.addCleanup(lcd.tn.close)
+        runner = lcdrunner.MpdRunner(
+            client, lcd,
+            lcdproc_screen='MPD',
+            refresh_rate=0.5,
+            backlight_on=cli.DEFAULT_BACKLIGHT_ON,
+            priority_playing=cli.DEFAULT_PRIORITY,
+            priority_not_playing=cli.DEFAULT_PRIORITY,
+            retry_config=retry_config,
+            tracer=tracer,
+        )
+        runner.setup_pattern(cli._make_patterns(cli.DEFAULT_PATTERNS), hook_registry=mpdhooks.HookRegistry())
+        client.connect()
+
+        self.player.play()
+        for tick in range(ticks):
+            self.clock.advance(0.5)
+            if tick % 4 == 3:
+                self.player.next()
+            runner.update()
+
+    def test_replay(self):
+        self.record(ticks=20)
+        recorded = self.lcdd.count()
+        self.assertGreater(recorded, 0)
+
+        session = trace.TraceSession(self.path)
+        ticks = list(session.ticks())
+        self.assertEqual(21, len(ticks))
+        self.assertEqual((20, 2), session.screen_size)
+        self.assertEqual('0.23.5', session.mpd_version)
+        self.assertEqual(0.5, session.meta['refresh'])
+
+        result = bench.run_replay(self.path)
+        self.assertEqual(20, result.ticks)
+        self.assertEqual(0, result.errors)
+        # The same display updates get sent.
+        self.assertGreater(result.recorded_commands, 0)
+        self.assertEqual(result.recorded_commands, result.commands)
+
+    def test_password(self):
+        """Passwords aren't recorded, and replays still work."""
+        self.mpd_server.password = 's3cret'
+        self.record(ticks=4, password='s3cret')
+        sent = [record.payload for record in trace.TraceReader(self.path) if record.kind == trace.KIND_MPD_SEND]
+        self.assertIn(b'password "***"\n', sent)
+        with open(self.path, 'rb') as f:
+            self.assertNotIn(b's3cret', f.read())
+
+        result = bench.run_replay(self.path)
+        self.assertEqual(0, result.errors)
+        self.assertEqual(result.recorded_commands, result.commands)
+
+
+if __name__ == '__main__':  # pragma: no cover
+    unittest.main()
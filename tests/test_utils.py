@@ -1,8 +1,12 @@
 # -*- coding: utf-8 -*-
 # Copyright (c) 2011-2013 Raphaël Barrois
 
+import random
+import socket
+import time
 import unittest
 
+from mpdlcd import timing
 from mpdlcd import utils
 
 
@@ -28,5 +32,121 @@ class ExtractPatternTest(unittest.TestCase):
         self.assertEqual({'aa'}, utils.extract_pattern('%(aa)s %d %(bbb)d'))
 
 
+class TokenBucketTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = timing.VirtualClock()
+
+    def make_bucket(self, rate, burst):
+        return utils.TokenBucket(rate, burst, clock=self.clock)
+
+    def test_burst(self):
+        bucket = self.make_bucket(rate=2, burst=3)
+        self.assertEqual([True, True, True, False], [bucket.consume() for _i in range(4)])
+
+    def test_refill(self):
+        bucket = self.make_bucket(rate=2, burst=3)
+        for _i in range(3):
+            bucket.consume()
+        self.assertFalse(bucket.consume())
+        self.assertEqual(0.5, bucket.delay())
+
+        self.clock.advance(0.5)
+        self.assertTrue(bucket.consume())
+        self.assertFalse(bucket.consume())
+
+        # Never refills past the burst size
+        self.clock.advance(100)
+        self.assertEqual([True, True, True, False], [bucket.consume() for _i in range(4)])
+
+    def test_force(self):
+        bucket = self.make_bucket(rate=1, burst=1)
+        bucket.force(3)
+        self.assertFalse(bucket.consume())
+        self.assertEqual(3, bucket.delay())
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, self.make_bucket, rate=0, burst=1)
+        self.assertRaises(ValueError, self.make_bucket, rate=1, burst=0)
+
+
+class TimeoutConfigTest(unittest.TestCase):
+    def test_disabled(self):
+        timeouts = utils.TimeoutConfig(connect_timeout=3)
+        self.assertEqual(3, timeouts.connect_timeout)
+        self.assertIsNone(timeouts.read_timeout)
+        self.assertIsNone(timeouts.deadline())
+        self.assertIsNone(timeouts.line_timeout(None))
+
+    def test_line_timeout(self):
+        timeouts = utils.TimeoutConfig(read_timeout=2, request_timeout=10)
+        self.assertEqual(2, timeouts.line_timeout(timeouts.deadline()))
+        self.assertLessEqual(timeouts.line_timeout(time.monotonic() + 1), 1)
+        with self.assertRaises(socket.timeout):
+            timeouts.line_timeout(time.monotonic() - 1)
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, utils.TimeoutConfig, read_timeout=-1)
+
+
+class ConnectionStateTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = timing.VirtualClock()
+        self.config = utils.AutoRetryConfig(retry_attempts=3, retry_wait=3, retry_backoff=2)
+
+    def make_state(self, **kwargs):
+        kwargs.setdefault('jitter', 0)
+        return utils.ConnectionState(self.config, name='test', clock=self.clock, **kwargs)
+
+    def fail(self, state):
+        self.assertTrue(state.can_attempt())
+        state.attempting()
+        self.assertEqual(utils.CONNECTION_RECONNECTING, state.state)
+        state.failed()
+        return state.retry_in()
+
+    def test_backoff(self):
+        state = self.make_state()
+        self.assertEqual(utils.CONNECTION_DISCONNECTED, state.state)
+        self.assertEqual(3, self.fail(state))
+        self.assertEqual(utils.CONNECTION_BACKING_OFF, state.state)
+        self.assertFalse(state.can_attempt())
+
+        self.clock.advance(3)
+        self.assertEqual(6, self.fail(state))
+
+        # Circuit breaker: probe every 3 * 2 ** 3 seconds.
+        self.clock.advance(6)
+        self.assertEqual(24, self.fail(state))
+        self.assertTrue(state.circuit_open)
+        self.clock.advance(24)
+        self.assertEqual(24, self.fail(state))
+
+        self.clock.advance(24)
+        state.attempting()
+        state.succeeded()
+        self.assertTrue(state.connected)
+        self.assertEqual(0, state.failures)
+        self.assertFalse(state.can_attempt())
+
+    def test_lost(self):
+        state = self.make_state()
+        state.attempting()
+        state.succeeded()
+        state.lost()
+        # No wait for the first reconnection.
+        self.assertTrue(state.can_attempt())
+        self.assertEqual(3, self.fail(state))
+
+    def test_jitter(self):
+        state = self.make_state(jitter=0.2, rng=random.Random(42))
+        delays = []
+        for _i in range(20):
+            delays.append(self.fail(state))
+            self.clock.advance(delays[-1])
+            state.failures = 0
+        self.assertTrue(all(2.4 <= delay <= 3.6 for delay in delays), delays)
+        self.assertGreater(len(set(delays)), 1)
+
+
 if __name__ == '__main__':  # pragma: no cover
     unittest.main()